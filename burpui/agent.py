@@ -2,16 +2,25 @@
 import os
 import struct
 import re
-import time
 import sys
 import json
+import time
 import logging
 import traceback
 
+import gevent
+
+from gevent.lock import Semaphore
 from gevent.server import StreamServer
+from gevent.threadpool import ThreadPool
 from logging.handlers import RotatingFileHandler
-from .exceptions import BUIserverException
-from .misc.backend.interface import BUIbackend
+from .exceptions import BUIserverException, BUIagentBusy
+from .misc.backend.interface import BUIbackend, INTERFACE_METHODS
+from .misc.backend.utils import ReadCache, run_calls, client_events, \
+    counter_events, is_running
+from .misc.protocol import MUX_VERSION, FRAME_CALL, FRAME_OK, FRAME_ER, \
+    FRAME_KO, FRAME_BY, FRAME_EV, pack_frame, read_frame, read_message, sendfile, choose_codec, \
+    compress, decompress, choose_serializer, dumps, loads, pack_stream_error
 from ._compat import pickle
 from .utils import BUIlogging, BUIConfig
 
@@ -22,6 +31,11 @@ G_VERSION = 1
 G_SSLCERT = u''
 G_SSLKEY = u''
 G_PASSWORD = u'password'
+G_CACHE = 1000
+G_CACHECHECK = 5
+G_WORKERS = 5
+G_QUEUE = 50
+G_EVENTS = 5
 
 DISCLOSURE = 5
 
@@ -31,12 +45,15 @@ class BurpHandler(BUIbackend):
     # The hack here is to get the list of the functions and let the interpreter
     # think we don't have to implement them.
     # Thanks to this list, we know what function are implemented by our backend.
-    foreign = BUIbackend.__abstractmethods__
+    foreign = INTERFACE_METHODS
     BUIbackend.__abstractmethods__ = frozenset()
+    # implemented here so the batched calls go through the cache
+    local = ['multi_call']
 
-    def __init__(self, vers=1, logger=None, conf=None):
+    def __init__(self, vers=1, logger=None, conf=None, cache=0, cachecheck=G_CACHECHECK):
         self.vers = vers
         self.logger = logger
+        self.cache = None
 
         module = 'burpui.misc.backend.burp{0}'.format(self.vers)
         try:
@@ -47,18 +64,27 @@ class BurpHandler(BUIbackend):
         except Exception as e:
             self.logger.error('{}\n\nFailed loading backend for Burp version {}: {}'.format(traceback.format_exc(), self.vers, str(e)))
             sys.exit(2)
+        if cache:
+            self.cache = ReadCache(self.backend, cache, cachecheck)
 
     def __getattribute__(self, name):
         # always return this value because we need it and if we don't do that
         # we'll end up with an infinite loop
-        if name == 'foreign':
+        if name in ['foreign', 'local']:
             return object.__getattribute__(self, name)
         # now we can retrieve the 'foreign' list and know if the object called
         # is in the backend
-        if name in self.foreign:
+        if name in self.foreign and name not in self.local:
+            cache = object.__getattribute__(self, 'cache')
+            if cache:
+                return cache.wrap(name, getattr(self.backend, name))
             return getattr(self.backend, name)
         return object.__getattribute__(self, name)
 
+    def multi_call(self, calls, agent=None):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.multi_call`"""
+        return run_calls(self, calls, self.logger)
+
 
 class BUIAgent(BUIbackend, BUIlogging):
     BUIbackend.__abstractmethods__ = frozenset()
@@ -71,6 +97,11 @@ class BUIAgent(BUIbackend, BUIlogging):
             'sslkey': G_SSLKEY,
             'version': G_VERSION,
             'password': G_PASSWORD,
+            'cache': G_CACHE,
+            'cachecheck': G_CACHECHECK,
+            'workers': G_WORKERS,
+            'queue': G_QUEUE,
+            'events': G_EVENTS,
         },
     }
 
@@ -122,12 +153,40 @@ class BUIAgent(BUIbackend, BUIlogging):
         self.sslcert = self.conf.safe_get('sslcert')
         self.sslkey = self.conf.safe_get('sslkey')
         self.password = self.conf.safe_get('password')
+        self.cachesize = self.conf.safe_get('cache', 'integer')
+        self.cachecheck = self.conf.safe_get('cachecheck', 'integer')
+        self.workers = self.conf.safe_get('workers', 'integer')
+        self.queue = max(self.conf.safe_get('queue', 'integer'), 0)
+        # calls waiting for or running in a worker
+        self.pending = 0
+        self.pool = None
+        if self.workers > 0:
+            self.pool = ThreadPool(self.workers)
+        self.events = self.conf.safe_get('events', 'integer')
+        # connection: subscription
+        self.subscribers = {}
+        self.publisher = None
 
-        self.cli = BurpHandler(self.vers, self.logger, self.conf)
+        self.cli = BurpHandler(
+            self.vers,
+            self.logger,
+            self.conf,
+            self.cachesize,
+            self.cachecheck
+        )
         if not self.ssl:
             self.server = StreamServer((self.bind, self.port), self.handle)
         else:
-            self.server = StreamServer((self.bind, self.port), self.handle, keyfile=self.sslkey, certfile=self.sslcert)
+            self.server = StreamServer((self.bind, self.port), self.handle, ssl_context=self._ssl_context())
+
+    def _ssl_context(self):
+        """Builds the SSL context shared by every connection. Its session
+        cache and session tickets let the servers resume their TLS sessions
+        instead of doing a full handshake on each connection."""
+        from gevent import ssl
+        ctx = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        ctx.load_cert_chain(self.sslcert, self.sslkey)
+        return ctx
 
     def run(self):
         try:
@@ -136,94 +195,312 @@ class BUIAgent(BUIbackend, BUIlogging):
             sys.exit(0)
 
     def handle(self, request, address):
-        """self.request is the client connection"""
+        """request is the client connection"""
         try:
-            self.request = request
             err = None
-            lengthbuf = self.request.recv(8)
-            length, = struct.unpack('!Q', lengthbuf)
-            data = self.recvall(length)
-            self._logger('info', 'recv: {}'.format(data))
+            data = read_message(request)
+            if data is None:
+                return
             txt = data.decode('UTF-8')
+            self._logger('info', 'recv: {}'.format(txt))
             if txt == 'RE':
                 return
             j = json.loads(txt)
             if j['password'] != self.password:
                 self._logger('warning', '-----> Wrong Password <-----')
-                self.request.sendall(b'KO')
+                request.sendall(b'KO')
+                return
+            if j['func'] == 'hello':
+                # the connection is kept open for many calls
+                args = j['args'] or {}
+                codec = choose_codec(args.get('compress'))
+                serializer = choose_serializer(args.get('serializers'))
+                res = json.dumps({
+                    'version': MUX_VERSION,
+                    'compress': codec,
+                    'serializer': serializer
+                })
+                request.sendall(b'OK')
+                request.sendall(struct.pack('!Q', len(res)))
+                request.sendall(res.encode('UTF-8'))
+                self.serve(request, codec, serializer)
                 return
             try:
-                if j['func'] == 'restore_files':
-                    res, err = getattr(self.cli, j['func'])(**j['args'])
+                if j['func'] in ['restore_files', 'restore_files_stream']:
+                    res, err = self._submit(j['func'], getattr(self.cli, j['func']), j['args'])
                 else:
-                    if j['args']:
-                        if 'pickled' in j and j['pickled']:
-                            # de-serialize arguments if needed
-                            from base64 import b64decode
-                            j['args'] = pickle.loads(b64decode(j['args']))
-                        res = json.dumps(getattr(self.cli, j['func'])(**j['args']))
-                    else:
-                        res = json.dumps(getattr(self.cli, j['func'])())
+                    res = json.dumps(self._call(j))
                 self._logger('info', 'result: {}'.format(res))
-                self.request.sendall(b'OK')
+                request.sendall(b'OK')
+            except BUIagentBusy as e:
+                request.sendall(b'BY')
+                res = str(e)
+                request.sendall(struct.pack('!Q', len(res)))
+                request.sendall(res.encode('UTF-8'))
+                return
             except BUIserverException as e:
-                self.request.sendall(b'ER')
+                request.sendall(b'ER')
                 res = str(e)
-                self.request.sendall(struct.pack('!Q', len(res)))
-                self.request.sendall(res.encode('UTF-8'))
+                request.sendall(struct.pack('!Q', len(res)))
+                request.sendall(res.encode('UTF-8'))
                 return
-            if j['func'] == 'restore_files':
+            if j['func'] == 'restore_files_stream':
+                if err:
+                    request.sendall(b'KO')
+                    request.sendall(struct.pack('!Q', len(err)))
+                    request.sendall(err.encode('UTF-8'))
+                    self._logger('error', 'Restoration failed')
+                    return
+                request.sendall(b'OK')
+                # we don't know the size of the archive in advance so we send
+                # it by chunks, an empty one marking the end
+                sent = 0
+                stream = iter(res)
+                try:
+                    while True:
+                        try:
+                            chunk = next(stream)
+                        except StopIteration:
+                            break
+                        except Exception as e:
+                            # the archive is incomplete, tell burp-ui instead
+                            # of ending it as if it was complete
+                            self._logger('error', 'Archive failed after {} Bytes: {}\n{}'.format(sent, str(e), traceback.format_exc()))
+                            request.sendall(pack_stream_error('Restoration failed: {}'.format(str(e))))
+                            return
+                        self._logger('debug', 'sending {} Bytes'.format(len(chunk)))
+                        request.sendall(struct.pack('!Q', len(chunk)))
+                        request.sendall(chunk)
+                        sent += len(chunk)
+                finally:
+                    if hasattr(res, 'close'):
+                        res.close()
+                request.sendall(struct.pack('!Q', 0))
+                self._logger('info', 'sent {} Bytes'.format(sent))
+            elif j['func'] == 'restore_files':
                 if err:
-                    self.request.sendall(b'KO')
-                    self.request.sendall(struct.pack('!Q', len(err)))
-                    self.request.sendall(err.encode('UTF-8'))
+                    request.sendall(b'KO')
+                    request.sendall(struct.pack('!Q', len(err)))
+                    request.sendall(err.encode('UTF-8'))
                     self._logger('error', 'Restoration failed')
                     return
-                self.request.sendall(b'OK')
+                request.sendall(b'OK')
                 size = os.path.getsize(res)
-                self.request.sendall(struct.pack('!Q', size))
+                request.sendall(struct.pack('!Q', size))
                 with open(res, 'rb') as f:
-                    buf = f.read(1024)
-                    while buf:
-                        self._logger('info', 'sending {} Bytes'.format(len(buf)))
-                        self.request.sendall(buf)
-                        buf = f.read(1024)
+                    self._logger('info', 'sending {} Bytes'.format(size))
+                    sendfile(request, f)
                 os.unlink(res)
-                lengthbuf = self.request.recv(8)
-                length, = struct.unpack('!Q', lengthbuf)
-                data = self.recvall(length)
-                txt = data.decode('UTF-8')
-                if txt == 'RE':
+                data = read_message(request)
+                if data is None or data.decode('UTF-8') == 'RE':
                     return
             else:
-                self.request.sendall(struct.pack('!Q', len(res)))
-                self.request.sendall(res.encode('UTF-8'))
+                request.sendall(struct.pack('!Q', len(res)))
+                request.sendall(res.encode('UTF-8'))
         except AttributeError as e:
             self._logger('warning', '{}\nWrong method => {}'.format(traceback.format_exc(), str(e)))
-            self.request.sendall(b'KO')
+            request.sendall(b'KO')
             return
         except Exception as e:
             self._logger('error', '!!! {} !!!\n{}'.format(str(e), traceback.format_exc()))
         finally:
             try:
-                self.request.close()
+                request.close()
             except Exception as e:
                 self._logger('error', '!!! {} !!!\n{}'.format(str(e), traceback.format_exc()))
 
-    def recvall(self, length=1024):
-        buf = b''
-        bsize = 1024
-        received = 0
-        if length < bsize:
-            bsize = length
-        while received < length:
-            newbuf = self.request.recv(bsize)
-            if not newbuf:
-                time.sleep(0.1)
-                continue
-            buf += newbuf
-            received += len(newbuf)
-        return buf
+    def _call(self, j):
+        """Runs a call of the backend
+
+        :param j: The decoded call
+        :type j: dict
+
+        :returns: The result
+        """
+        if j['args'] and 'pickled' in j and j['pickled']:
+            # de-serialize arguments if needed
+            from base64 import b64decode
+            j['args'] = pickle.loads(b64decode(j['args']))
+        return self._submit(j['func'], getattr(self.cli, j['func']), j['args'])
+
+    def _submit(self, name, func, args=None):
+        """Runs a call of the backend in the worker pool. The calling greenlet
+        waits for a worker while the other connections are still served.
+
+        :param name: Name of the call, for the logs
+        :type name: str
+
+        :param func: The backend method
+        :type func: callable
+
+        :param args: Keyword arguments of the call
+        :type args: dict
+
+        :returns: The result of the call
+
+        :raises: :class:`burpui.exceptions.BUIagentBusy` if every worker is
+                 busy and the queue is full
+        """
+        args = args or {}
+        if self.pool is None:
+            return func(**args)
+        if self.pending >= self.workers + self.queue:
+            self._logger('warning', 'Too many calls in progress, rejecting {}'.format(name))
+            raise BUIagentBusy('Agent busy: {} calls in progress'.format(self.pending))
+        times = [time.time()]
+
+        def _run():
+            times.append(time.time())
+            try:
+                return func(**args)
+            finally:
+                times.append(time.time())
+
+        self.pending += 1
+        try:
+            return self.pool.spawn(_run).get()
+        finally:
+            self.pending -= 1
+            if len(times) == 3:
+                self._logger(
+                    'info',
+                    '{}: waited {:.3f}s, ran in {:.3f}s'.format(
+                        name,
+                        times[1] - times[0],
+                        times[2] - times[1]
+                    )
+                )
+
+    def serve(self, sock, codec=None, serializer='json'):
+        """Serves the calls of a multiplexed connection until it is closed.
+        Every call runs in its own greenlet and its reply is sent as soon as
+        it is ready.
+
+        :param sock: The client connection
+        :type sock: :class:`socket.socket`
+
+        :param codec: Compression codec negotiated with the client
+        :type codec: str
+
+        :param serializer: Serializer negotiated with the client
+        :type serializer: str
+        """
+        lock = Semaphore()
+
+        def _reply(reqid, kind, res):
+            kind, payload = compress(kind, res, codec)
+            with lock:
+                sock.sendall(pack_frame(reqid, kind, payload))
+
+        def _run(reqid, payload):
+            try:
+                j = loads(payload, serializer)
+                self._logger('info', 'recv: {}'.format(j))
+                if j['func'] == 'subscribe':
+                    res = self._subscribe(
+                        sock,
+                        lambda msg: _reply(reqid, FRAME_EV, dumps(msg, serializer))
+                    )
+                else:
+                    res = self._call(j)
+                self._logger('info', 'result: {}'.format(res))
+                _reply(reqid, FRAME_OK, dumps(res, serializer))
+            except BUIagentBusy as e:
+                _reply(reqid, FRAME_BY, str(e).encode('UTF-8'))
+            except BUIserverException as e:
+                _reply(reqid, FRAME_ER, str(e).encode('UTF-8'))
+            except AttributeError as e:
+                self._logger('warning', '{}\nWrong method => {}'.format(traceback.format_exc(), str(e)))
+                _reply(reqid, FRAME_KO, str(e).encode('UTF-8'))
+            except Exception as e:
+                self._logger('error', '!!! {} !!!\n{}'.format(str(e), traceback.format_exc()))
+                try:
+                    _reply(reqid, FRAME_KO, str(e).encode('UTF-8'))
+                except Exception:
+                    pass
+
+        try:
+            while True:
+                frame = read_frame(sock)
+                if not frame:
+                    break
+                reqid, kind, payload = frame
+                kind, payload = decompress(kind, payload, codec)
+                if kind != FRAME_CALL:
+                    self._logger('warning', 'Unexpected frame type: {}'.format(kind))
+                    continue
+                gevent.spawn(_run, reqid, payload)
+        finally:
+            self.subscribers.pop(sock, None)
+
+    def _subscribe(self, sock, send):
+        """Registers a subscriber to the state events of the clients
+
+        :param sock: The client connection
+        :type sock: :class:`socket.socket`
+
+        :param send: Function pushing a message to the subscriber
+        :type send: callable
+
+        :returns: How often the messages are sent
+        """
+        if self.events <= 0:
+            raise BUIserverException('Events are disabled on this agent')
+        self.subscribers[sock] = {'send': send, 'new': True}
+        if not self.publisher:
+            self.publisher = gevent.spawn(self._publish)
+        return {'interval': self.events}
+
+    def _collect(self):
+        """Returns the state of the clients and the counters of the running
+        backups"""
+        # refreshes the list of running clients the counters rely on
+        self.cli.is_one_backup_running()
+        clients = dict((x['name'], x) for x in self.cli.get_all_clients())
+        counters = {}
+        for name, cli in clients.items():
+            if is_running(cli['state']):
+                counters[name] = self.cli.get_counters(name)
+        return clients, counters
+
+    def _publish(self):
+        """Pushes the state transitions of the clients and the changes of
+        the counters to the subscribers until there are none left. A message
+        is sent at every check so the subscribers know the agent is alive."""
+        clients = None
+        counters = {}
+        try:
+            while self.subscribers:
+                try:
+                    current, running = self._submit('events', self._collect)
+                except Exception as exp:
+                    self._logger('warning', 'Unable to collect the clients state: {}'.format(str(exp)))
+                    gevent.sleep(self.events)
+                    continue
+                events = []
+                if clients is not None:
+                    events = client_events(clients, current)
+                events += counter_events(counters, running)
+                clients = current
+                counters = running
+                msg = {'time': time.time(), 'events': events}
+                for sock, sub in list(self.subscribers.items()):
+                    try:
+                        if sub['new']:
+                            sub['new'] = False
+                            sub['send'](dict(
+                                msg,
+                                clients=list(clients.values()),
+                                counters=counters
+                            ))
+                        else:
+                            sub['send'](msg)
+                    except Exception as exp:
+                        self._logger('info', 'Subscriber lost: {}'.format(str(exp)))
+                        self.subscribers.pop(sock, None)
+                gevent.sleep(self.events)
+        finally:
+            self.publisher = None
 
     def _logger(self, level, message):
         # hide password from logs
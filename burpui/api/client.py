@@ -12,7 +12,7 @@ import os
 from . import api, cache_key
 from .custom import fields, Resource
 from .custom.inputs import boolean
-from ..exceptions import BUIserverException
+from ..exceptions import BUIserverException, BUIagentUnsupported
 from ..utils import NOTIF_ERROR
 
 from flask_restplus.marshalling import marshal
@@ -623,25 +623,38 @@ class ClientReport(Resource):
                 self.abort(500, str(e))
         else:
             try:
-                cl = bui.cli.get_client(name, agent=server)
+                j = bui.cli.get_client_report(name, agent=server)
+            except BUIagentUnsupported:
+                # the agent is too old, ask for the backups one by one
+                j = self._get_backups_logs(name, server)
             except BUIserverException as e:
                 self.abort(500, str(e))
-            err = []
-            for c in cl:
-                try:
-                    j.append(
-                        bui.cli.get_backup_logs(
-                            c['number'],
-                            name,
-                            agent=server
-                        )
+        return j
+
+    def _get_backups_logs(self, name, server=None):
+        """Returns the logs of every backup of a client with one call per
+        backup"""
+        j = []
+        try:
+            cl = bui.cli.get_client(name, agent=server)
+        except BUIserverException as e:
+            self.abort(500, str(e))
+        err = []
+        for c in cl:
+            try:
+                j.append(
+                    bui.cli.get_backup_logs(
+                        c['number'],
+                        name,
+                        agent=server
                     )
-                except BUIserverException as e:
-                    temp = [NOTIF_ERROR, str(e)]
-                    if temp not in err:
-                        err.append(temp)
-            if err:
-                self.abort(500, err)
+                )
+            except BUIserverException as e:
+                temp = [NOTIF_ERROR, str(e)]
+                if temp not in err:
+                    err.append(temp)
+        if err:
+            self.abort(500, err)
         return j
 
 
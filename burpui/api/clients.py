@@ -449,9 +449,15 @@ class AllClients(Resource):
             else:
                 for serv in bui.cli.servers:
                     grants[serv] = 'all'
+            # the agents are queried at the same time, the ones that did not
+            # answer are left out
+            listed = bui.cli.fanout(
+                lambda name, agent: [x['name'] for x in agent.get_all_clients()],
+                [x for x, y in iteritems(grants) if not isinstance(y, list)]
+            )
             for (serv, clients) in iteritems(grants):
                 if not isinstance(clients, list):
-                    clients = [x['name'] for x in bui.cli.get_all_clients(agent=serv)]
+                    clients = listed[serv]['result'] or []
                 ret += [{'name': x, 'agent': serv} for x in clients]
 
         return ret
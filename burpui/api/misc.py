@@ -287,6 +287,12 @@ class Alert(Resource):
         return {'message': message, 'level': level}, 201
 
 
+@api.cache.memoize(timeout=3600)
+def _get_burp_versions(server=None):
+    """Burp versions do not change often so we cache them"""
+    return bui.cli.get_client_version(server), bui.cli.get_server_version(server)
+
+
 @ns.route('/about',
           '/<server>/about',
           endpoint='about')
@@ -300,10 +306,17 @@ class About(Resource):
     api.LOGIN_NOT_REQUIRED.append('about')
     parser = ns.parser()
     parser.add_argument('serverName', help='Which server to collect data from when in multi-agent mode')
+    breaker_fields = ns.model('Breaker', {
+        'state': fields.String(description='State of the circuit breaker (closed, open or half-open)'),
+        'failures': fields.Integer(description='Number of consecutive failures'),
+        'retry': fields.Integer(description='Seconds before the next attempt to reach the burp server'),
+        'error': fields.String(description='Last error'),
+    })
     burp_fields = ns.model('Burp', {
         'name': fields.String(required=True, description='Instance name', default='Burp'),
         'client': fields.String(description='Burp client version'),
         'server': fields.String(description='Burp server version'),
+        'breaker': fields.Nested(breaker_fields, description='Burp server availability'),
     })
     about_fields = ns.model('About', {
         'version': fields.String(required=True, description='Burp-UI version'),
@@ -312,7 +325,6 @@ class About(Resource):
         'burp': fields.Nested(burp_fields, as_list=True, description='Burp version'),
     })
 
-    @api.cache.cached(timeout=3600, key_prefix=cache_key)
     @ns.marshal_with(about_fields, code=200, description='Success')
     @ns.expect(parser)
     @ns.doc(
@@ -329,8 +341,9 @@ class About(Resource):
         r['release'] = api.release
         r['api'] = url_for('api.doc')
         r['burp'] = []
-        cli = bui.cli.get_client_version(server)
-        srv = bui.cli.get_server_version(server)
+        cli, srv = _get_burp_versions(server)
+        # the breaker state is not cached since it changes quickly
+        breaker = bui.cli.get_breaker_state(server)
         multi = {}
         if isinstance(cli, dict):
             for (name, v) in iteritems(cli):
@@ -338,8 +351,11 @@ class About(Resource):
         if isinstance(srv, dict):
             for (name, v) in iteritems(srv):
                 multi[name]['server'] = v
+        if multi and isinstance(breaker, dict):
+            for (name, v) in iteritems(breaker):
+                multi[name]['breaker'] = v
         if not multi:
-            r['burp'].append({'client': cli, 'server': srv})
+            r['burp'].append({'client': cli, 'server': srv, 'breaker': breaker})
         else:
             for (name, v) in iteritems(multi):
                 a = v
@@ -478,48 +494,19 @@ class History(Resource):
             self.abort(403, "You are not allowed to view this client infos")
 
         if client:
-            (color, text) = self.gen_colors(client, server)
-            feed = {
-                'color': color,
-                'textColor': text,
-                'events': self.gen_events(client, server),
-            }
-            name = client
-            if server:
-                name += ' on {}'.format(server)
-            feed['name'] = name
-            ret.append(feed)
-            return ret
+            return self.gen_feeds([client], server)
         elif server:
             clients = bui.cli.get_all_clients(agent=server)
             if bui.acl and not self.is_admin:
                 clients = [x for x in clients if x['name'] in bui.acl.clients(self.username, server)]
-            for cl in clients:
-                (color, text) = self.gen_colors(cl['name'], server)
-                feed = {
-                    'events': self.gen_events(cl['name'], server),
-                    'textColor': text,
-                    'color': color,
-                    'name': '{} on {}'.format(cl['name'], server),
-                }
-                ret.append(feed)
-            return ret
+            return self.gen_feeds([x['name'] for x in clients], server)
 
         if bui.standalone:
             if bui.acl and not self.is_admin:
                 clients_list = bui.acl.clients(self.username)
             else:
                 clients_list = [x['name'] for x in bui.cli.get_all_clients()]
-            for cl in clients_list:
-                (color, text) = self.gen_colors(cl)
-                feed = {
-                    'events': self.gen_events(cl),
-                    'textColor': text,
-                    'color': color,
-                    'name': cl,
-                }
-                ret.append(feed)
-            return ret
+            return self.gen_feeds(clients_list)
         else:
             grants = {}
             if bui.acl and not self.is_admin:
@@ -528,24 +515,61 @@ class History(Resource):
             else:
                 for serv in bui.cli.servers:
                     grants[serv] = 'all'
-            for (serv, clients) in iteritems(grants):
+
+            def _fetch(name, agent):
+                # the agents are queried at the same time, outside of the
+                # application context
+                clients = grants[name]
                 if not isinstance(clients, list):
-                    clients = [x['name'] for x in bui.cli.get_all_clients(agent=serv)]
-                for cl in clients:
-                    (color, text) = self.gen_colors(cl, serv)
-                    feed = {
-                        'events': self.gen_events(cl, serv),
-                        'textColor': text,
-                        'color': color,
-                        'name': '{} on {}'.format(cl, serv),
-                    }
-                    ret.append(feed)
+                    clients = [x['name'] for x in agent.get_all_clients()]
+                return clients, agent.multi_call(self.feed_calls(clients))
+
+            # the agents that did not answer are left out
+            feeds = bui.cli.fanout(_fetch, list(grants))
+            for serv in grants:
+                if feeds[serv]['error']:
+                    continue
+                clients, res = feeds[serv]['result']
+                ret += self.gen_feeds(clients, serv, res)
 
         return ret
 
-    def gen_colors(self, client=None, agent=None):
+    @staticmethod
+    def feed_calls(clients):
+        """Lists the backend calls needed to create the events feeds of the
+        given clients"""
+        calls = []
+        for cl in clients:
+            calls.append(('get_client_labels', {'client': cl}))
+            calls.append(('get_client', {'name': cl}))
+        return calls
+
+    def gen_feeds(self, clients, server=None, res=None):
+        """Creates the events feeds of the given clients. The data of all the
+        clients is retrieved in a single call to the backend unless the
+        results of :func:`feed_calls` are given"""
+        if res is None:
+            res = bui.cli.multi_call(self.feed_calls(clients), agent=server)
+        ret = []
+        for idx, cl in enumerate(clients):
+            labels, events = res[idx * 2:idx * 2 + 2]
+            for call in (labels, events):
+                if call['error']:
+                    raise BUIserverException(call['error'])
+            (color, text) = self.gen_colors(cl, server, labels['result'])
+            feed = {
+                'events': self.gen_events(cl, server, events['result']),
+                'textColor': text,
+                'color': color,
+                'name': '{} on {}'.format(cl, server) if server else cl,
+            }
+            ret.append(feed)
+        return ret
+
+    def gen_colors(self, client=None, agent=None, labels=None):
         """Generates color for an events feed"""
-        labels = bui.cli.get_client_labels(client, agent)
+        if labels is None:
+            labels = bui.cli.get_client_labels(client, agent)
         HTML_COLOR = r'((?P<hex>#(?P<red_hex>[0-9a-f]{1,2})(?P<green_hex>[0-9a-f]{1,2})(?P<blue_hex>[0-9a-f]{1,2}))|(?P<rgb>rgb\s*\(\s*(?P<red>2[0-5]{2}|2[0-4]\d|[0-1]?\d\d?)\s*,\s*(?P<green>2[0-5]{2}|2[0-4]\d|[0-1]?\d\d?)\s*,\s*(?P<blue>2[0-5]{2}|2[0-4]\d|[0-1]?\d\d?)\s*\))|(?P<plain>[\w-]+$))'
         color_found = False
         color = None
@@ -609,9 +633,10 @@ class History(Resource):
         yiq = ((red * 299) + (green * 587) + (blue * 114)) / 1000
         return 'black' if yiq >= 128 else 'white'
 
-    def gen_events(self, client, server=None):
+    def gen_events(self, client, server=None, events=None):
         """Creates events for a given client"""
-        events = bui.cli.get_client(client, agent=server)
+        if events is None:
+            events = bui.cli.get_client(client, agent=server)
         for ev in events:
             ev['title'] = 'Client: {0}, Backup n°{1:07d}'.format(client, int(ev['number']))
             if server:
@@ -7,24 +7,117 @@
 .. moduleauthor:: Ziirish <hi+burpui@ziirish.me>
 
 """
-import select
-import struct
-
 # This is a submodule we can also use "from ..api import api"
 from . import api
 from .custom import fields, Resource
 from .custom.inputs import boolean
 from ..exceptions import BUIserverException
+from ..misc.protocol import RELAY_SIZE
+from ..misc.restore import backup_timestamp
+from ..utils import ARCHIVE_FORMATS
+
+import os
 
 from zlib import adler32
 from time import gmtime, strftime, time
-from flask import Response, send_file, make_response, after_this_request, current_app as bui
+from flask import Response, make_response, request, current_app as bui
 from werkzeug.datastructures import Headers
-from werkzeug.exceptions import HTTPException
+from werkzeug.wsgi import wrap_file
 
 ns = api.namespace('restore', 'Restore methods')
 
 
+def _read_range(fileobj, length, chunk=RELAY_SIZE):
+    """Reads up to length bytes of a file by chunks"""
+    try:
+        while length > 0:
+            buf = fileobj.read(min(chunk, length))
+            if not buf:
+                break
+            length -= len(buf)
+            yield buf
+    finally:
+        fileobj.close()
+
+
+def _abort_on_error(stream, name, logger):
+    """Relays the chunks of an archive generated on the fly. The headers are
+    already sent when the generation fails, the error is logged and raised
+    again so the WSGI server drops the connection instead of ending the
+    archive as if it was complete.
+
+    :param stream: Generator of the archive chunks
+    :type stream: generator
+
+    :param name: Name of the archive
+    :type name: str
+
+    :param logger: Logger to use, the generator runs outside of the
+                   application context
+    :type logger: :class:`logging.Logger`
+    """
+    try:
+        for chunk in stream:
+            yield chunk
+    except Exception as exp:
+        logger.error('Restoration of {} failed: {}'.format(name, str(exp)))
+        raise
+    finally:
+        if hasattr(stream, 'close'):
+            stream.close()
+
+
+def _send_archive(path, headers, etag):
+    """Sends an archive already on disk, honoring the Range requests so interrupted
+    downloads can be resumed
+
+    :param path: Path of the archive
+    :type path: str
+
+    :param headers: Headers of the response
+    :type headers: :class:`werkzeug.datastructures.Headers`
+
+    :param etag: ETag of the archive
+    :type etag: str
+
+    :returns: A :mod:`flask.Response` object
+    """
+    fileobj = open(path, 'rb')
+    size = os.fstat(fileobj.fileno()).st_size
+    start, stop = 0, size
+    status = 200
+    headers.add('Accept-Ranges', 'bytes')
+    rng = request.range
+    if_range = request.if_range
+    if (rng and len(rng.ranges) == 1 and
+            (not if_range.etag and not if_range.date or
+             if_range.etag == etag)):
+        bounds = rng.range_for_length(size)
+        if not bounds:
+            fileobj.close()
+            headers.add('Content-Range', 'bytes */{}'.format(size))
+            return Response(status=416, headers=headers)
+        start, stop = bounds
+        status = 206
+        headers.add('Content-Range', 'bytes {}-{}/{}'.format(start, stop - 1, size))
+        fileobj.seek(start)
+
+    if status == 200:
+        # the WSGI server may send the whole file with sendfile
+        data = wrap_file(request.environ, fileobj, RELAY_SIZE)
+    else:
+        data = _read_range(fileobj, stop - start)
+    resp = Response(data,
+                    status,
+                    mimetype='application/zip',
+                    headers=headers,
+                    direct_passthrough=True)
+    resp.content_length = stop - start
+    resp.set_cookie('fileDownload', 'true')
+    resp.set_etag(etag)
+    return resp
+
+
 @ns.route('/archive/<name>/<int:backup>',
           '/<server>/archive/<name>/<int:backup>',
           endpoint='restore')
@@ -42,7 +135,7 @@ class Restore(Resource):
     """
     parser = ns.parser()
     parser.add_argument('pass', help='Password to use for encrypted backups', nullable=True)
-    parser.add_argument('format', required=False, help='Returning archive format', choices=('zip', 'tar.gz', 'tar.bz2'), default='zip', nullable=True)
+    parser.add_argument('format', required=False, help='Returning archive format', choices=ARCHIVE_FORMATS, default='zip', nullable=True)
     parser.add_argument('strip', type=int, help='Number of elements to strip in the path', default=0, nullable=True)
     parser.add_argument('list', required=True, help='List of files/directories to restore', nullable=False)
     # FIXME: the example json seems interpreted during the raise of the exception
@@ -84,7 +177,6 @@ class Restore(Resource):
         s = args['strip']
         f = args['format'] or 'zip'
         p = args['pass']
-        resp = None
         # Check params
         if not l or not name or not backup:
             self.abort(400, 'missing arguments')
@@ -108,106 +200,270 @@ class Restore(Resource):
                 name,
                 strftime("%Y-%m-%d_%H_%M_%S", gmtime()),
                 f)
-        if not server:
-            # Standalone mode, we can just return the file unless there were errors
-            archive, err = bui.cli.restore_files(name, backup, l, s, f, p)
-            if not archive:
-                if err:
-                    return make_response(err, 500)
-                self.abort(500)
-            try:
-                # Trick to delete the file while sending it to the client.
-                # First, we open the file in reading mode so that a file handler
-                # is open on the file. Then we delete it as soon as the request
-                # ended. Because the fh is open, the file will be actually removed
-                # when the transfer is done and the send_file method has closed
-                # the fh. Only tested on Linux systems.
-                fh = open(archive, 'r')
-
-                @after_this_request
-                def remove_file(response):
-                    """Callback function to run after the client has handled
-                    the request to remove temporary files.
-                    """
-                    import os
-                    os.remove(archive)
-                    return response
-
-                resp = send_file(fh,
-                                 as_attachment=True,
-                                 attachment_filename=filename,
-                                 mimetype='application/zip')
-                resp.set_cookie('fileDownload', 'true')
-            except Exception as e:
-                bui.cli.logger.error(str(e))
-                self.abort(500, str(e))
-        else:
-            # Multi-agent mode
-            socket = None
-            try:
-                socket, length, err = bui.cli.restore_files(name,
-                                                            backup,
-                                                            l,
-                                                            s,
-                                                            f,
-                                                            p,
-                                                            server)
-                bui.cli.logger.debug('Need to get {} Bytes : {}'.format(length, socket))
-
-                if err:
-                    bui.cli.logger.debug('Something went wrong: {}'.format(err))
-                    socket.sendall(struct.pack('!Q', 2))
-                    socket.sendall(b'RE')
-                    socket.close()
-                    return make_response(err, 500)
-
-                def stream_file(sock, l):
-                    """The restoration took place on another server so we need
-                    to stream the file that is not present on the current
-                    machine.
-                    """
-                    bsize = 1024
-                    received = 0
-                    if l < bsize:
-                        bsize = l
-                    while received < l:
-                        buf = b''
-                        r, _, _ = select.select([sock], [], [], 5)
-                        if not r:
-                            raise Exception('Socket timed-out')
-                        buf += sock.recv(bsize)
-                        if not buf:
-                            continue
-                        received += len(buf)
-                        bui.cli.logger.debug('{}/{}'.format(received, l))
-                        yield buf
-                    sock.sendall(struct.pack('!Q', 2))
-                    sock.sendall(b'RE')
-                    sock.close()
-
-                headers = Headers()
-                headers.add('Content-Disposition',
-                            'attachment',
-                            filename=filename)
-                headers['Content-Length'] = length
-
-                resp = Response(stream_file(socket, length),
-                                mimetype='application/zip',
-                                headers=headers,
-                                direct_passthrough=True)
-                resp.set_cookie('fileDownload', 'true')
-                resp.set_etag('flask-%s-%s-%s' % (
-                    time(),
-                    length,
-                    adler32(filename.encode('utf-8')) & 0xffffffff))
-            except HTTPException as e:
-                raise e
-            except Exception as e:
-                bui.cli.logger.error(str(e))
-                self.abort(500, str(e))
+        headers = Headers()
+        headers.add('Content-Disposition',
+                    'attachment',
+                    filename=filename)
+
+        # Restorations of encrypted backups are never cached
+        key = None
+        if not p and bui.restorecache.size:
+            key = bui.restorecache.key(
+                name, backup, l, s, f, server,
+                backup_timestamp(bui.cli, name, backup, server)
+            )
+        cached = bui.restorecache.get(key)
+        if cached:
+            return _send_archive(cached, headers, 'restore-{}'.format(key))
+
+        # The archive is generated on the fly while we send it, whether the
+        # restoration took place locally or on an agent
+        try:
+            stream, err = bui.cli.restore_files_stream(name,
+                                                       backup,
+                                                       l,
+                                                       s,
+                                                       f,
+                                                       p,
+                                                       server)
+        except BUIserverException as e:
+            self.abort(500, str(e))
+        if not stream:
+            if err:
+                bui.cli.logger.debug('Something went wrong: {}'.format(err))
+                return make_response(err, 500)
+            self.abort(500)
+        if key:
+            stream = bui.restorecache.store(key, stream)
+
+        resp = Response(_abort_on_error(stream, filename, bui.cli.logger),
+                        mimetype='application/zip',
+                        headers=headers,
+                        direct_passthrough=True)
+        resp.set_cookie('fileDownload', 'true')
+        resp.set_etag('flask-%s-%s' % (
+            time(),
+            adler32(filename.encode('utf-8')) & 0xffffffff))
         return resp
 
 
+@ns.route('/jobs/<name>/<int:backup>',
+          '/<server>/jobs/<name>/<int:backup>',
+          methods=['POST'],
+          endpoint='restore_job')
+@ns.route('/jobs',
+          methods=['GET'],
+          endpoint='restore_jobs')
+class RestoreJobs(Resource):
+    """The :class:`burpui.api.restore.RestoreJobs` resource allows you to
+    perform a file restoration in background.
+
+    This resource is part of the :mod:`burpui.api.restore` module.
+
+    The following parameters are supported:
+    - ``list``: list of files/directories to restore
+    - ``strip``: number of elements to strip in the path
+    - ``format``: returning archive format
+    - ``pass``: password to use for encrypted backups
+    """
+    parser = Restore.parser
+
+    job_fields = ns.model('RestoreJob', {
+        'id': fields.String(required=True, description='Job ID'),
+        'user': fields.String(description='User who requested the restoration'),
+        'server': fields.String(description='Server hosting the client'),
+        'client': fields.String(required=True, description='Client name'),
+        'backup': fields.Integer(required=True, description='Backup number'),
+        'format': fields.String(description='Archive format'),
+        'status': fields.String(
+            required=True,
+            description='Job status (queued, running, done, failed or cancelled)'
+        ),
+        'restored': fields.Integer(description='Bytes restored so far'),
+        'archived': fields.Integer(description='Files archived so far'),
+        'size': fields.Integer(description='Size of the archive so far'),
+        'error': fields.String(description='Error message if the job failed'),
+        'created': fields.Float(description='Submission time'),
+        'started': fields.Float(description='Start time'),
+        'finished': fields.Float(description='End time'),
+    })
+
+    @ns.marshal_list_with(job_fields, code=200, description='Success')
+    def get(self):
+        """Returns the restoration jobs of the current user
+
+        **GET** method provided by the webservice.
+
+        :returns: The restoration jobs
+        """
+        return bui.jobs.list(None if self.is_admin else self.username)
+
+    @ns.expect(parser, validate=True)
+    @ns.marshal_with(job_fields, code=202, description='Accepted')
+    @ns.doc(
+        params={
+            'server': 'Which server to collect data from when in multi-agent mode',
+            'name': 'Client name',
+            'backup': 'Backup number',
+        },
+        responses={
+            400: 'Missing parameter',
+            403: 'Insufficient permissions',
+            429: 'Too many restorations in progress',
+        },
+    )
+    def post(self, server=None, name=None, backup=None):
+        """Queues an online restoration
+
+        **POST** method provided by the webservice.
+
+        :param server: Which server to collect data from when in multi-agent mode
+        :type server: str
+
+        :param name: The client we are working on
+        :type name: str
+
+        :param backup: The backup we are working on
+        :type backup: int
+
+        :returns: The newly created job
+        """
+        args = self.parser.parse_args()
+        l = args['list']
+        s = args['strip']
+        f = args['format'] or 'zip'
+        p = args['pass']
+        # Check params
+        if not l or not name or not backup:
+            self.abort(400, 'missing arguments')
+        # Manage ACL
+        if (bui.acl and
+                (not bui.acl.is_client_allowed(self.username,
+                                               name,
+                                               server) and not
+                 self.is_admin)):
+            self.abort(403, 'You are not allowed to perform a restoration for this client')
+        try:
+            return bui.jobs.submit(self.username, name, backup, l, s, f, p, server), 202
+        except BUIserverException as e:
+            self.abort(429, str(e))
+
+
+def _get_job(resource, job):
+    """Returns a restoration job if the current user is allowed to see it"""
+    data = bui.jobs.get(job)
+    # do not disclose the jobs of other users
+    if not data or (data['user'] != resource.username and not resource.is_admin):
+        resource.abort(404, 'No such job')
+    return data
+
+
+@ns.route('/jobs/<job>', endpoint='restore_job_status')
+class RestoreJob(Resource):
+    """The :class:`burpui.api.restore.RestoreJob` resource allows you to
+    follow or cancel a background restoration.
+
+    This resource is part of the :mod:`burpui.api.restore` module.
+    """
+
+    @ns.marshal_with(RestoreJobs.job_fields, code=200, description='Success')
+    @ns.doc(
+        params={
+            'job': 'Job ID',
+        },
+        responses={
+            404: 'No such job',
+        },
+    )
+    def get(self, job=None):
+        """Returns the status of a job
+
+        **GET** method provided by the webservice.
+
+        :param job: Job ID
+        :type job: str
+
+        :returns: The job
+        """
+        return _get_job(self, job)
+
+    @ns.doc(
+        params={
+            'job': 'Job ID',
+        },
+        responses={
+            200: 'Success',
+            404: 'No such job',
+        },
+    )
+    def delete(self, job=None):
+        """Cancels a pending job or removes a finished one
+
+        **DELETE** method provided by the webservice.
+
+        :param job: Job ID
+        :type job: str
+
+        :returns: Status message
+        """
+        _get_job(self, job)
+        bui.jobs.cancel(job)
+        return {'message': 'Job {} removed'.format(job)}
+
+
+@ns.route('/jobs/<job>/download', endpoint='restore_job_download')
+class RestoreJobDownload(Resource):
+    """The :class:`burpui.api.restore.RestoreJobDownload` resource allows
+    you to download the archive of a background restoration.
+
+    This resource is part of the :mod:`burpui.api.restore` module.
+    """
+
+    @ns.doc(
+        params={
+            'job': 'Job ID',
+        },
+        responses={
+            200: 'Success',
+            404: 'No such job',
+            409: 'Archive not ready',
+        },
+    )
+    def get(self, job=None):
+        """Downloads the archive generated by a job
+
+        **GET** method provided by the webservice.
+        This method returns a :mod:`flask.Response` object.
+
+        :param job: Job ID
+        :type job: str
+
+        :returns: A :mod:`flask.Response` object representing the archive
+        """
+        data = _get_job(self, job)
+        path = bui.jobs.archive(job)
+        if not path:
+            self.abort(409, 'The archive is not ready ({})'.format(data['status']))
+        if data['server']:
+            filename = 'restoration_%d_%s_on_%s_at_%s.%s' % (
+                data['backup'],
+                data['client'],
+                data['server'],
+                strftime("%Y-%m-%d_%H_%M_%S", gmtime(data['finished'])),
+                data['format'])
+        else:
+            filename = 'restoration_%d_%s_at_%s.%s' % (
+                data['backup'],
+                data['client'],
+                strftime("%Y-%m-%d_%H_%M_%S", gmtime(data['finished'])),
+                data['format'])
+        headers = Headers()
+        headers.add('Content-Disposition',
+                    'attachment',
+                    filename=filename)
+        return _send_archive(path, headers, 'restore-job-{}'.format(job))
+
+
 @ns.route('/server-restore/<name>',
           '/<server>/server-restore/<name>',
           methods=['GET', 'DELETE'],
@@ -67,19 +67,30 @@ class ServersStats(Resource):
             restrict = bui.acl.servers(self.username)
 
         try:
-            for serv in bui.cli.servers:
-                if check and serv in restrict:
-                    r.append({
-                        'name': serv,
-                        'clients': len(bui.acl.clients(self.username, serv)),
-                        'alive': bui.cli.servers[serv].ping()
-                    })
-                elif not check:
-                    r.append({
-                        'name': serv,
-                        'clients': len(bui.cli.servers[serv].get_all_clients(serv)),
-                        'alive': bui.cli.servers[serv].ping()
-                    })
+            agents = [x for x in bui.cli.servers if not check or x in restrict]
+            granted = {}
+            if check:
+                for serv in agents:
+                    granted[serv] = len(bui.acl.clients(self.username, serv))
+
+            def _stats(name, agent):
+                # the agents are queried at the same time, outside of the
+                # application context
+                if check:
+                    clients = granted[name]
+                else:
+                    clients = len(agent.get_all_clients(name))
+                return {'clients': clients, 'alive': agent.ping()}
+
+            stats = bui.cli.fanout(_stats, agents)
+            for serv in agents:
+                # an agent that did not answer is reported as dead
+                res = stats[serv]['result'] or {'clients': granted.get(serv, 0), 'alive': False}
+                r.append({
+                    'name': serv,
+                    'clients': res['clients'],
+                    'alive': res['alive']
+                })
 
         except BUIserverException as e:
             self.abort(500, str(e))
@@ -166,7 +177,21 @@ class ServersReport(Resource):
         backups = []
         servers = []
         try:
-            for serv in bui.cli.servers:
+            agents = [x for x in bui.cli.servers if not check or x in restrict]
+            granted = {}
+            if bui.acl and not self.is_admin:
+                for serv in agents:
+                    granted[serv] = [{'name': x} for x in bui.acl.clients(self.username, serv)]
+
+            def _report(name, agent):
+                clients = granted.get(name)
+                if clients is None:
+                    clients = agent.get_all_clients()
+                return agent.get_clients_report(clients)
+
+            # the agents that did not answer are left out of the report
+            reports = bui.cli.fanout(_report, agents)
+            for serv in agents:
                 out = {
                     'name': serv,
                     'stats': {
@@ -178,15 +203,7 @@ class ServersReport(Resource):
                     },
                     'number': 0
                 }
-                if check and serv not in restrict:
-                    continue
-                clients = []
-                if bui.acl and not self.is_admin:
-                    clients = [{'name': x} for x in bui.acl.clients(self.username, serv)]
-                else:
-                    clients = bui.cli.get_all_clients(agent=serv)
-
-                j = bui.cli.get_clients_report(clients, serv)
+                j = reports[serv]['result'] or {}
                 if 'clients' not in j or 'backups' not in j:
                     continue
                 for stats in j['clients']:
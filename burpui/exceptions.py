@@ -25,3 +25,15 @@ class BUIserverException(HTTPException):
 
     def __str__(self):
         return self.description
+
+
+class BUIagentBusy(BUIserverException):
+    """Raised when an agent has no room left to queue a call.
+    """
+    code = 503
+
+
+class BUIagentUnsupported(BUIserverException):
+    """Raised when an agent does not know the method it was asked to run.
+    """
+    code = 501
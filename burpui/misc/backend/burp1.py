@@ -12,17 +12,21 @@ import os
 import socket
 import time
 import datetime
-import json
 import shutil
 import subprocess
 import tempfile
 
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 from pipes import quote
-from six import iteritems, viewkeys
+from six import viewkeys
 
 from .interface import BUIbackend
+from .utils import BackupStatsStore, SnapshotCollector, CircuitBreaker, \
+    SingleFlight, has_vss_headers, is_running, restore_regex, run_calls
 from ..parser.burp1 import Parser
-from ...utils import human_readable as _hr, BUIcompress
+from ...utils import human_readable as _hr, BUIcompress, BUIcompressStream, \
+    BUIprogressStream
 from ...exceptions import BUIserverException
 from ..._compat import unquote, PY3
 
@@ -30,14 +34,50 @@ G_BURPPORT = 4972
 G_BURPHOST = u'::1'
 G_BURPBIN = u'/usr/sbin/burp'
 G_STRIPBIN = u'/usr/sbin/vss_strip'
+G_STRIPJOBS = 0
+G_COMPLEVEL = -1
+G_COMPJOBS = 0
 G_BURPCONFCLI = u''
 G_BURPCONFSRV = u'/etc/burp/burp-server.conf'
 G_TMPDIR = u'/tmp/bui'
+G_SNAPSHOT = 0
+G_QUERYTTL = 0
 G_ZIP64 = False
 G_INCLUDES = [u'/etc/burp']
 G_ENFORCE = False
 G_REVOKE = False
 
+# log.gz parsing
+LOG_COUNTERS = {
+    'Files': 'files',
+    'Files (encrypted)': 'files_enc',
+    'Directories': 'dir',
+    'Soft links': 'softlink',
+    'Hard links': 'hardlink',
+    'Meta data': 'meta',
+    'Meta data(enc)': 'meta_enc',
+    'Special files': 'special',
+    'EFS files': 'efs',
+    'VSS headers': 'vssheader',
+    'VSS headers (enc)': 'vssheader_enc',
+    'VSS footers': 'vssfooter',
+    'VSS footers (enc)': 'vssfooter_enc',
+    'Grand total': 'total',
+}
+# a single pass over each line: the last matching group tells us what we found
+LOG_LINE = re.compile(
+    r'(?:Start time: (?P<start>.+)$'
+    r'|\s*End time: (?P<end>.+)$'
+    r'|Time taken: (?P<duration>.+)$'
+    r'|\s*Bytes in backup:\s+(?P<totsize>\d+)'
+    r'|\s*Bytes received:\s+(?P<received>\d+)'
+    r'|\s*(?P<counter>' +
+    r'|'.join(re.escape(x) for x in LOG_COUNTERS) +
+    r'):?\s+(?P<counts>[\d\s]+)\s+\|\s+(?P<scanned>\d+)$)'
+)
+LOG_SEPARATOR = re.compile(r'-+$')
+LOG_WINDOWS = re.compile(r'\d{4}-\d{2}-\d{2} (\d{2}:){3} \w+\[\d+\] Client is Windows$')
+
 
 class Burp(BUIbackend):
     """The :class:`burpui.misc.backend.burp1.Burp` class provides a consistent
@@ -117,6 +157,7 @@ class Burp(BUIbackend):
         """
         if dummy:
             return
+        self.breaker = CircuitBreaker(self.logger)
         self.client_version = None
         self.server_version = None
         self.app = None
@@ -125,9 +166,14 @@ class Burp(BUIbackend):
         self.port = G_BURPPORT
         self.burpbin = G_BURPBIN
         self.stripbin = G_STRIPBIN
+        self.stripjobs = G_STRIPJOBS
+        self.complevel = G_COMPLEVEL
+        self.compjobs = G_COMPJOBS
         self.burpconfcli = G_BURPCONFCLI
         self.burpconfsrv = G_BURPCONFSRV
         self.tmpdir = G_TMPDIR
+        self.snapshot = G_SNAPSHOT
+        self.queryttl = G_QUERYTTL
         self.includes = G_INCLUDES
         self.revoke = G_REVOKE
         self.enforce = G_ENFORCE
@@ -138,9 +184,14 @@ class Burp(BUIbackend):
                 'bhost': G_BURPHOST,
                 'burpbin': G_BURPBIN,
                 'stripbin': G_STRIPBIN,
+                'stripjobs': G_STRIPJOBS,
+                'complevel': G_COMPLEVEL,
+                'compjobs': G_COMPJOBS,
                 'bconfcli': G_BURPCONFCLI,
                 'bconfsrv': G_BURPCONFSRV,
                 'tmpdir': G_TMPDIR,
+                'snapshot': G_SNAPSHOT,
+                'queryttl': G_QUERYTTL,
             },
             'Experimental': {
                 'zip64': G_ZIP64,
@@ -166,9 +217,14 @@ class Burp(BUIbackend):
                 'stripbin',
                 G_STRIPBIN
             )
+            self.stripjobs = conf.safe_get('stripjobs', 'integer')
+            self.complevel = conf.safe_get('complevel', 'integer')
+            self.compjobs = conf.safe_get('compjobs', 'integer')
             confcli = conf.safe_get('bconfcli')
             confsrv = conf.safe_get('bconfsrv')
             tmpdir = conf.safe_get('tmpdir')
+            self.snapshot = conf.safe_get('snapshot', 'integer')
+            self.queryttl = conf.safe_get('queryttl', 'float')
 
             # Experimental options
             self.zip64 = conf.safe_get(
@@ -221,6 +277,9 @@ class Burp(BUIbackend):
             self.tmpdir = tmpdir
 
         self.parser = Parser(self)
+        self.store = self._get_stats_store()
+        self.flight = SingleFlight(self.queryttl)
+        self.collector = SnapshotCollector(self, self.snapshot)
 
         self.family = Burp._get_inet_family(self.host)
         self._test_burp_server_address(self.host)
@@ -247,9 +306,14 @@ class Burp(BUIbackend):
         self.logger.info('burp host: {}'.format(self.host))
         self.logger.info('burp binary: {}'.format(self.burpbin))
         self.logger.info('strip binary: {}'.format(self.stripbin))
+        self.logger.info('strip jobs: {}'.format(self.stripjobs))
+        self.logger.info('compression level: {}'.format(self.complevel))
+        self.logger.info('compression jobs: {}'.format(self.compjobs))
         self.logger.info('burp conf cli: {}'.format(self.burpconfcli))
         self.logger.info('burp conf srv: {}'.format(self.burpconfsrv))
         self.logger.info('tmpdir: {}'.format(self.tmpdir))
+        self.logger.info('snapshot interval: {}'.format(self.snapshot))
+        self.logger.info('query ttl: {}'.format(self.queryttl))
         self.logger.info('zip64: {}'.format(self.zip64))
         self.logger.info('includes: {}'.format(self.includes))
         self.logger.info('enforce: {}'.format(self.enforce))
@@ -259,6 +323,11 @@ class Burp(BUIbackend):
             self.status()
         except BUIserverException:
             pass
+        self.collector.start()
+
+    def __exit__(self, typ, value, traceback):
+        """Stops the background snapshot of the clients state"""
+        self.collector.stop()
 
     # Utilities functions
     def _get_binary_path(self, config, field, default=None, sect='Burp1'):
@@ -288,6 +357,30 @@ class Burp(BUIbackend):
 
         return temp
 
+    def _get_stats_store(self):
+        """Opens the store of the stats of completed backups"""
+        path = None
+        if self.tmpdir and os.path.isdir(self.tmpdir):
+            path = os.path.join(self.tmpdir, 'stats.db')
+        return BackupStatsStore(path, self.logger)
+
+    def _get_stored_stats(self, number, client, timestamp, forward=False):
+        """Returns the stats of a backup from the store or None"""
+        if timestamp is None:
+            return None
+        stats = self.store.get(client, number, timestamp)
+        if stats is not None and forward:
+            stats['name'] = client
+        return stats
+
+    def _store_stats(self, number, client, timestamp, stats):
+        """Stores the stats of a backup if it is completed"""
+        if not stats or 'end' not in stats:
+            return
+        data = dict(stats)
+        data.pop('name', None)
+        self.store.put(client, number, timestamp, data)
+
     @staticmethod
     def _get_inet_family(addr):
         """The :func:`burpui.misc.backend.burp1.Burp._get_inet_family` function
@@ -341,42 +434,83 @@ class Burp(BUIbackend):
 
     def status(self, query='\n', agent=None):
         """See :func:`burpui.misc.backend.interface.BUIbackend.status`"""
+        if not query.endswith('\n'):
+            query = '{0}\n'.format(query)
+        # identical concurrent queries are only sent once
+        return self.flight.do(query, self._status, query)
+
+    def _status(self, query):
+        """Sends a query to the status port"""
         result = []
         try:
-            self.logger.info("query: '{}'".format(query.rstrip()))
-            qry = b''
-            if not query.endswith('\n'):  # pragma: no cover
-                qry += '{0}\n'.format(query).encode('utf-8')
-            else:
-                qry += query.encode('utf-8')
-            sock = socket.socket(self.family, socket.SOCK_STREAM)
-            sock.connect((self.host, self.port))
-            sock.send(qry)
-            sock.shutdown(socket.SHUT_WR)
-            fileobj = sock.makefile()
-            sock.close()
-            for line in fileobj.readlines():
-                line = line.rstrip('\n')
-                if not line:
-                    continue
+            with self.breaker:
                 try:
-                    if not PY3:
-                        line = line.decode('utf-8', 'replace')
-                except UnicodeDecodeError:  # pragma: no cover
-                    pass
-                result.append(line)
-            fileobj.close()
-            self.logger.debug('=> {}'.format(result))
-            return result
-        except socket.error:
-            self.logger.error('Cannot contact burp server at %s:%s', self.host, self.port)
-            raise BUIserverException('Cannot contact burp server at {0}:{1}'.format(self.host, self.port))
+                    self.logger.info("query: '{}'".format(query.rstrip()))
+                    qry = b''
+                    if not query.endswith('\n'):  # pragma: no cover
+                        qry += '{0}\n'.format(query).encode('utf-8')
+                    else:
+                        qry += query.encode('utf-8')
+                    sock = socket.socket(self.family, socket.SOCK_STREAM)
+                    sock.connect((self.host, self.port))
+                    sock.send(qry)
+                    sock.shutdown(socket.SHUT_WR)
+                    fileobj = sock.makefile()
+                    sock.close()
+                    for line in fileobj.readlines():
+                        line = line.rstrip('\n')
+                        if not line:
+                            continue
+                        try:
+                            if not PY3:
+                                line = line.decode('utf-8', 'replace')
+                        except UnicodeDecodeError:  # pragma: no cover
+                            pass
+                        result.append(line)
+                    fileobj.close()
+                    self.logger.debug('=> {}'.format(result))
+                    return result
+                except socket.error:
+                    # the circuit breaker keeps this message
+                    raise IOError('Cannot contact burp server at {0}:{1}'.format(self.host, self.port))
+        except IOError as exp:
+            self.logger.error(str(exp))
+            raise BUIserverException(str(exp))
 
     def get_backup_logs(self, number, client, forward=False, agent=None):
         """See :func:`burpui.misc.backend.interface.BUIbackend.get_backup_logs`"""
         if not client or not number:
             return {}
 
+        timestamp = None
+        for spl in self._get_backups(client):
+            if spl[0] == str(number):
+                timestamp = int(spl[2])
+                break
+        return self._get_backup_logs(number, client, timestamp, forward)
+
+    def _get_backup_logs(self, number, client, timestamp, forward=False):
+        """Returns the logs of a backup out of the store, they are parsed
+        and stored if needed.
+
+        :param number: Backup number to work on
+        :type number: int
+
+        :param client: Client name to work on
+        :type client: str
+
+        :param timestamp: Backup timestamp, the store is not used if None
+        :type timestamp: int
+
+        :param forward: Is the client name needed in later process
+        :type forward: bool
+
+        :returns: Dict containing the backup log
+        """
+        ret = self._get_stored_stats(number, client, timestamp, forward)
+        if ret is not None:
+            return ret
+
         filemap = self.status('c:{0}:b:{1}\n'.format(client, number))
         found = False
         ret = {}
@@ -398,6 +532,8 @@ class Burp(BUIbackend):
         ret['encrypted'] = False
         if 'files_enc' in ret and ret['files_enc']['total'] > 0:
             ret['encrypted'] = True
+        if timestamp is not None:
+            self._store_stats(number, client, timestamp, ret)
         return ret
 
     def _parse_backup_stats(self, number, client, forward=False, stats=None, agent=None):
@@ -562,91 +698,53 @@ class Burp(BUIbackend):
 
         :returns: Dict containing the backup log
         """
-        lookup_easy = {
-            'start': r'^Start time: (.+)$',
-            'end': r'^\s*End time: (.+)$',
-            'duration': r'^Time taken: (.+)$',
-            'totsize': r'^\s*Bytes in backup:\s+(\d+)',
-            'received': r'^\s*Bytes received:\s+(\d+)'
-        }
-        lookup_complex = {
-            'files': r'^\s*Files:?\s+([\d\s]+)\s+\|\s+(\d+)$',
-            'files_enc': r'^\s*Files \(encrypted\):?\s+([\d\s]+)\s+\|\s+(\d+)$',
-            'dir': r'^\s*Directories:?\s+([\d\s]+)\s+\|\s+(\d+)$',
-            'softlink': r'^\s*Soft links:?\s+([\d\s]+)\s+\|\s+(\d+)$',
-            'hardlink': r'^\s*Hard links:?\s+([\d\s]+)\s+\|\s+(\d+)$',
-            'meta': r'^\s*Meta data:?\s+([\d\s]+)\s+\|\s+(\d+)$',
-            'meta_enc': r'^\s*Meta data\(enc\):?\s+([\d\s]+)\s+\|\s+(\d+)$',
-            'special': r'^\s*Special files:?\s+([\d\s]+)\s+\|\s+(\d+)$',
-            'efs': r'^\s*EFS files:?\s+([\d\s]+)\s+\|\s+(\d+)$',
-            'vssheader': r'^\s*VSS headers:?\s+([\d\s]+)\s+\|\s+(\d+)$',
-            'vssheader_enc': r'^\s*VSS headers \(enc\):?\s+([\d\s]+)\s+\|\s+(\d+)$',
-            'vssfooter': r'^\s*VSS footers:?\s+([\d\s]+)\s+\|\s+(\d+)$',
-            'vssfooter_enc': r'^\s*VSS footers \(enc\):?\s+([\d\s]+)\s+\|\s+(\d+)$',
-            'total': r'^\s*Grand total:?\s+([\d\s]+)\s+\|\s+(\d+)$'
-        }
         _ = agent  # noqa
         backup = {'windows': 'false', 'number': int(number)}
         if client is not None:
             backup['name'] = client
         useful = False
         for line in filemap:
-            if re.match(r'^\d{4}-\d{2}-\d{2} (\d{2}:){3} \w+\[\d+\] Client is Windows$', line):
+            if line.endswith(' Client is Windows') and LOG_WINDOWS.match(line):
                 backup['windows'] = 'true'
-            elif not useful and not re.match(r'^-+$', line):
+            elif LOG_SEPARATOR.match(line):
+                useful = not useful
                 continue
-            elif useful and re.match(r'^-+$', line):
-                useful = False
+            elif not useful:
                 continue
-            elif re.match(r'^-+$', line):
-                useful = True
-                continue
-
-            found = False
-            # this method is not optimal, but it is easy to read and to maintain
-            for (key, regex) in iteritems(lookup_easy):
-                reg = re.search(regex, line)
-                if reg:
-                    found = True
-                    if key in ['start', 'end']:
-                        backup[key] = int(time.mktime(datetime.datetime.strptime(reg.group(1), '%Y-%m-%d %H:%M:%S').timetuple()))
-                    elif key == 'duration':
-                        tmp = reg.group(1).split(':')
-                        tmp.reverse()
-                        fields = [0] * 4
-                        for (i, val) in enumerate(tmp):
-                            fields[i] = int(val)
-                        seconds = 0
-                        seconds += fields[0]
-                        seconds += fields[1] * 60
-                        seconds += fields[2] * (60 * 60)
-                        seconds += fields[3] * (60 * 60 * 24)
-                        backup[key] = seconds
-                    else:
-                        backup[key] = int(reg.group(1))
-                    # break the loop as soon as we find a match
-                    break
 
-            # if found is True, we already parsed the line so we can jump to the next one
-            if found:
+            reg = LOG_LINE.match(line)
+            if not reg:
                 continue
-
-            for (key, regex) in iteritems(lookup_complex):
-                reg = re.search(regex, line)
-                if reg:
-                    # self.logger.debug("match[1]: '{0}'".format(reg.group(1)))
-                    spl = re.split(r'\s+', reg.group(1))
-                    if len(spl) < 5:
-                        return {}
-                    backup[key] = {
-                        'new': int(spl[0]),
-                        'changed': int(spl[1]),
-                        'unchanged': int(spl[2]),
-                        'deleted': int(spl[3]),
-                        'total': int(spl[4]),
-                        'scanned': int(reg.group(2))
-                    }
-                    break
+            key = reg.lastgroup
+            val = reg.group(key)
+            if key in ['start', 'end']:
+                backup[key] = int(time.mktime(datetime.datetime.strptime(val, '%Y-%m-%d %H:%M:%S').timetuple()))
+            elif key == 'duration':
+                tmp = val.split(':')
+                tmp.reverse()
+                fields = [0] * 4
+                for (i, num) in enumerate(tmp):
+                    fields[i] = int(num)
+                seconds = 0
+                seconds += fields[0]
+                seconds += fields[1] * 60
+                seconds += fields[2] * (60 * 60)
+                seconds += fields[3] * (60 * 60 * 24)
+                backup[key] = seconds
+            elif key == 'scanned':
+                spl = re.split(r'\s+', reg.group('counts'))
+                if len(spl) < 5:
+                    return {}
+                backup[LOG_COUNTERS[reg.group('counter')]] = {
+                    'new': int(spl[0]),
+                    'changed': int(spl[1]),
+                    'unchanged': int(spl[2]),
+                    'deleted': int(spl[3]),
+                    'total': int(spl[4]),
+                    'scanned': int(val)
+                }
+            else:
+                backup[key] = int(val)
         return backup
 
     def get_clients_report(self, clients, agent=None):
@@ -658,7 +756,7 @@ class Burp(BUIbackend):
             client = self.get_client(cli['name'])
             if not client:
                 continue
-            stats = self.get_backup_logs(client[-1]['number'], cli['name'])
+            stats = self._get_backup_logs(client[-1]['number'], cli['name'], client[-1]['date'])
             windows = stats['windows'] if 'windows' in stats else "unknown"
             totsize = stats['totsize'] if 'totsize' in stats else 0
             total = stats['total']['total'] if \
@@ -675,6 +773,15 @@ class Burp(BUIbackend):
         ret = {'clients': cls, 'backups': bkp}
         return ret
 
+    def get_client_report(self, name=None, agent=None):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.get_client_report`"""
+        if not name:
+            return []
+        return [
+            self._get_backup_logs(x['number'], name, x['date'])
+            for x in self.get_client(name)
+        ]
+
     def get_counters(self, name=None, agent=None):  # pragma: no cover (hard to test, requires a running backup)
         """See :func:`burpui.misc.backend.interface.BUIbackend.get_counters`"""
         res = {}
@@ -741,32 +848,46 @@ class Burp(BUIbackend):
         """See :func:`burpui.misc.backend.interface.BUIbackend.is_backup_running`"""
         if not name:
             return False
+        snap = self.collector.get()
+        if snap:
+            return name in snap.running
         try:
             filemap = self.status('c:{0}\n'.format(name))
         except BUIserverException:
             return False
         for line in filemap:
             reg = re.search(r'^{0}\s+\d\s+(\w)'.format(name), line)
-            if reg and reg.group(1) not in ['i', 'c', 'C']:
+            if reg and is_running(self.states.get(reg.group(1), reg.group(1))):
                 return True
         return False
 
     def is_one_backup_running(self, agent=None):
         """See :func:`burpui.misc.backend.interface.BUIbackend.is_one_backup_running`"""
         res = []
+        snap = self.collector.get()
+        if snap:
+            self.running = sorted(snap.running)
+            self.refresh = snap.time
+            return self.running
+        # a single status query gives us the state of every client, no need
+        # to ask for each of them
         try:
-            cls = self.get_all_clients()
+            clients = self._get_clients_state()
         except BUIserverException:
             return res
-        for cli in cls:
-            if self.is_backup_running(cli['name']):
+        for cli in clients:
+            if is_running(cli['state']):
                 res.append(cli['name'])
         self.running = res
         self.refresh = time.time()
         return res
 
-    def get_all_clients(self, agent=None):
-        """See :func:`burpui.misc.backend.interface.BUIbackend.get_all_clients`"""
+    def _get_clients_state(self):
+        """Returns the name, state, phase and last backup of every client
+        with a single status query
+
+        :returns: A list of dict
+        """
         res = []
         filemap = self.status()
         for line in filemap:
@@ -785,11 +906,6 @@ class Burp(BUIbackend):
                 else:
                     cli['phase'] = 'unknown'
                 cli['last'] = 'now'
-                counters = self.get_counters(cli['name'])
-                if 'percent' in counters:
-                    cli['percent'] = counters['percent']
-                else:
-                    cli['percent'] = 0
             elif infos == "0":
                 cli['last'] = 'never'
             elif re.match(r'^\d+\s\d+\s\d+$', infos):
@@ -801,34 +917,65 @@ class Burp(BUIbackend):
             res.append(cli)
         return res
 
-    def get_client(self, name=None, agent=None):
-        """See :func:`burpui.misc.backend.interface.BUIbackend.get_client`"""
+    def get_all_clients(self, agent=None):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.get_all_clients`"""
         res = []
-        if not name:
-            return res
-        cli = name
-        filemap = self.status('c:{0}\n'.format(cli))
+        snap = self.collector.get()
+        if snap:
+            clients = snap.clients
+        else:
+            clients = self._get_clients_state()
+        for cli in clients:
+            cli = dict(cli)
+            cli.pop('labels', None)
+            if is_running(cli['state']):
+                counters = self.get_counters(cli['name'])
+                if 'percent' in counters:
+                    cli['percent'] = counters['percent']
+                else:
+                    cli['percent'] = 0
+            res.append(cli)
+        return res
+
+    def _get_backups(self, name):
+        """Returns the backups of a client as a list of
+        ``[number, deletable, timestamp]`` lists, most recent first, or an
+        empty list if the client is unknown or running.
+
+        :param name: Client name
+        :type name: str
+        """
+        filemap = self.status('c:{0}\n'.format(name))
         for line in filemap:
-            if not re.match('^{0}\t'.format(cli), line):
+            if not re.match('^{0}\t'.format(name), line):
                 continue
             # self.logger.debug("line: '{0}'".format(line))
             regex = re.compile(r'\s*(\S+)\s+\d\s+(\S)\s+(.+)')
             match = regex.search(line)
             if match.group(3) == "0" or match.group(2) not in ['i', 'c', 'C']:
                 continue
-            backups = match.group(3).split('\t')
-            for backup in backups:
-                bkp = {}
-                spl = backup.split()
-                bkp['number'] = spl[0]
-                bkp['deletable'] = (spl[1] == '1')
-                bkp['date'] = int(spl[2])
-                log = self.get_backup_logs(spl[0], name)
-                bkp['encrypted'] = log['encrypted']
-                bkp['received'] = log['received']
-                bkp['size'] = log['totsize']
-                bkp['end'] = log['end']
-                res.append(bkp)
+            return [x.split() for x in match.group(3).split('\t')]
+        return []
+
+    def get_client(self, name=None, agent=None):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.get_client`"""
+        res = []
+        if not name:
+            return res
+        backups = self._get_backups(name)
+        # forget about the backups that do not exist anymore
+        self.store.prune(name, dict((x[0], x[2]) for x in backups))
+        for spl in backups:
+            bkp = {}
+            bkp['number'] = spl[0]
+            bkp['deletable'] = (spl[1] == '1')
+            bkp['date'] = int(spl[2])
+            log = self._get_backup_logs(spl[0], name, bkp['date'])
+            bkp['encrypted'] = log['encrypted']
+            bkp['received'] = log['received']
+            bkp['size'] = log['totsize']
+            bkp['end'] = log['end']
+            res.append(bkp)
         # Here we need to reverse the array so the backups are sorted by date ASC
         res.reverse()
         return res
@@ -907,32 +1054,43 @@ class Burp(BUIbackend):
         """See :func:`burpui.misc.backend.interface.BUIbackend.server_backup`"""
         return self.parser.server_initiated_backup(client)
 
-    def restore_files(self, name=None, backup=None, files=None, strip=None, archive='zip', password=None, agent=None):
-        """See :func:`burpui.misc.backend.interface.BUIbackend.restore_files`"""
+    def _restore(self, name=None, backup=None, files=None, strip=None, password=None):
+        """Restores the requested files in a temporary directory
+
+        :param name: Client name
+        :type name: str
+
+        :param backup: Backup number
+        :type backup: int
+
+        :param files: A string representing a list of files to restore
+        :type files: str
+
+        :param strip: Number of parent directories to strip while restoring
+                      files
+        :type strip: int
+
+        :param password: Password for encrypted backups
+        :type password: str
+
+        :returns: A tuple with the temporary directory and/or an error message
+        """
         if not name or not backup or not files:
             return None, 'At least one argument is missing'
         if not self.stripbin:
             return None, 'Missing \'strip\' binary'
         if not self.burpbin:
             return None, 'Missing \'burp\' binary'
-        flist = json.loads(files)
+        full_reg = restore_regex(files)
         if password:
             tmphandler, tmpfile = tempfile.mkstemp()
         tmpdir = tempfile.mkdtemp(prefix=self.tmpdir)
-        if 'restore' not in flist:
+        if full_reg is None:
             return None, 'Wrong call'
         if os.path.isdir(tmpdir):
             shutil.rmtree(tmpdir)
-        full_reg = u''
-        for restore in flist['restore']:
-            reg = u''
-            if restore['folder'] and restore['key'] != '/':
-                reg += '^' + re.escape(restore['key']) + '/|'
-            else:
-                reg += '^' + re.escape(restore['key']) + '$|'
-            full_reg += reg
 
-        cmd = [self.burpbin, '-C', quote(name), '-a', 'r', '-b', quote(str(backup)), '-r', full_reg.rstrip('|'), '-d', tmpdir]
+        cmd = [self.burpbin, '-C', quote(name), '-a', 'r', '-b', quote(str(backup)), '-r', full_reg, '-d', tmpdir]
         if password:
             if not self.burpconfcli:
                 return None, 'No client configuration file specified'
@@ -954,6 +1112,8 @@ class Burp(BUIbackend):
         proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         out, _ = proc.communicate()
         status = proc.wait()
+        if PY3:
+            out = out.decode('utf-8', 'replace')
         if password:
             os.remove(tmpfile)
         self.logger.debug(out)
@@ -967,49 +1127,111 @@ class Burp(BUIbackend):
         # a return code of 2 means there were some warnings during restoration
         # so we can assume the restoration was successful anyway
         if status not in [0, 2]:
+            if os.path.isdir(tmpdir):
+                shutil.rmtree(tmpdir)
             return None, out
 
-        zip_dir = tmpdir.rstrip(os.sep)
+        return tmpdir.rstrip(os.sep), None
+
+    def _strip_file(self, path):
+        """Removes the VSS headers of a restored file if it embeds some
+
+        :param path: Path of the file to strip
+        :type path: str
+
+        :returns: The path of the file
+        """
+        if os.path.islink(path) or not os.path.isfile(path) or \
+                not has_vss_headers(path):
+            return path
+        self.logger.debug("stripping file: %s", path)
+        shutil.move(path, path + '.tmp')
+        status = subprocess.call([self.stripbin, '-i', path + '.tmp', '-o', path])
+        if status != 0:
+            self.logger.debug("Stripping failed on '%s', keeping the file as is", path)
+            if os.path.exists(path):
+                os.remove(path)
+            shutil.move(path + '.tmp', path)
+        else:
+            os.remove(path + '.tmp')
+        return path
+
+    def _walk_restored(self, tmpdir):
+        """Walks through the restored files and strips their VSS headers if
+        needed. Up to ``stripjobs`` files (one per CPU by default) are stripped
+        at the same time and they are returned as soon as they are ready.
+
+        :param tmpdir: Directory containing the restored files
+        :type tmpdir: str
+
+        :returns: A generator of tuples with the path of the file and its name
+                  within the archive
+        """
+        zip_len = len(tmpdir) + 1
+
+        def _files():
+            for dirname, _, files in os.walk(tmpdir):
+                for filename in files:
+                    yield os.path.join(dirname, filename)
+
+        jobs = self.stripjobs or cpu_count()
+        if jobs <= 1:
+            for path in _files():
+                yield self._strip_file(path), path[zip_len:]
+            return
+
+        # the work is done by the vss_strip processes, threads are enough
+        pool = ThreadPool(jobs)
+        try:
+            for path in pool.imap_unordered(self._strip_file, _files()):
+                yield path, path[zip_len:]
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def restore_files(self, name=None, backup=None, files=None, strip=None, archive='zip', password=None, agent=None):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.restore_files`"""
+        zip_dir, err = self._restore(name, backup, files, strip, password)
+        if err:
+            return None, err
+
         zip_file = zip_dir + '.zip'
         if os.path.isfile(zip_file):
             os.remove(zip_file)
-        zip_len = len(zip_dir) + 1
-        stripping = True
-        test_strip = True
-        with BUIcompress(zip_file, archive, self.zip64) as zfh:
-            for dirname, _, files in os.walk(zip_dir):
-                for filename in files:
-                    path = os.path.join(dirname, filename)
-                    # try to detect if the file contains vss headers
-                    if test_strip:
-                        test_strip = False
-                        otp = None
-                        try:
-                            with open(os.devnull, 'w') as devnul:
-                                otp = subprocess.check_output([self.stripbin, '-p', '-i', path], stderr=devnul)
-                        except subprocess.CalledProcessError as exc:
-                            self.logger.debug("Stripping failed on '{}': {}".format(path, str(exc)))
-                        if not otp:
-                            stripping = False
-
-                    if stripping and os.path.isfile(path):
-                        self.logger.debug("stripping file: %s", path)
-                        shutil.move(path, path + '.tmp')
-                        status = subprocess.call([self.stripbin, '-i', path + '.tmp', '-o', path])
-                        if status != 0:
-                            os.remove(path)
-                            shutil.move(path + '.tmp', path)
-                            stripping = False
-                            self.logger.debug("Disable stripping since this file does not seem to embed VSS headers")
-                        else:
-                            os.remove(path + '.tmp')
+        with BUIcompress(zip_file, archive, self.zip64, self.complevel,
+                         self.compjobs or cpu_count()) as zfh:
+            for path, entry in self._walk_restored(zip_dir):
+                zfh.append(path, entry)
 
-                    entry = path[zip_len:]
-                    zfh.append(path, entry)
-
-        shutil.rmtree(tmpdir)
+        shutil.rmtree(zip_dir)
         return zip_file, None
 
+    def restore_files_stream(self, name=None, backup=None, files=None, strip=None, archive='zip', password=None, agent=None):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.restore_files_stream`"""
+        try:
+            arch = BUIcompressStream(archive, self.zip64,
+                                     level=self.complevel,
+                                     jobs=self.compjobs or cpu_count())
+        except ValueError as exp:
+            return None, str(exp)
+        tmpdir, err = self._restore(name, backup, files, strip, password)
+        if err:
+            arch.terminate()
+            return None, err
+
+        def _stream():
+            try:
+                for path, entry in self._walk_restored(tmpdir):
+                    for chunk in arch.append(path, entry):
+                        yield chunk
+                for chunk in arch.close():
+                    yield chunk
+            finally:
+                arch.terminate()
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+        return BUIprogressStream(_stream(), arch), None
+
     def read_conf_cli(self, client=None, conf=None, agent=None):
         """See :func:`burpui.misc.backend.interface.BUIbackend.read_conf_cli`"""
         if not self.parser:
@@ -1085,3 +1307,11 @@ class Burp(BUIbackend):
         """See :func:`burpui.misc.backend.interface.BUIbackend.get_client_labels`"""
         # Not supported with Burp 1.x.x so we just return an empty list
         return []
+
+    def get_breaker_state(self, agent=None):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.get_breaker_state`"""
+        return self.breaker.get_state()
+
+    def multi_call(self, calls, agent=None):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.multi_call`"""
+        return run_calls(self, calls, self.logger)
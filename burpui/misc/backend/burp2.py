@@ -15,9 +15,14 @@ import sys
 import json
 
 from select import select
+from threading import Lock
+from contextlib import contextmanager
 from six import iteritems, viewkeys
+from six.moves.queue import LifoQueue, Empty
 
 from .burp1 import Burp as Burp1
+from .utils import JSONFrameDecoder, SnapshotCollector, CircuitBreaker, \
+    SingleFlight, is_running
 from ..parser.burp2 import Parser
 from ...utils import human_readable as _hr
 from ...exceptions import BUIserverException
@@ -29,15 +34,207 @@ BURP_MINIMAL_VERSION = 'burp-2.0.18'
 
 G_BURPBIN = u'/usr/sbin/burp'
 G_STRIPBIN = u'/usr/sbin/vss_strip'
+G_STRIPJOBS = 0
+G_COMPLEVEL = -1
+G_COMPJOBS = 0
 G_BURPCONFCLI = u'/etc/burp/burp.conf'
 G_BURPCONFSRV = u'/etc/burp/burp-server.conf'
 G_TMPDIR = u'/tmp/bui'
 G_TIMEOUT = 15
+G_POOL = 5
+# maximum number of queries sent at once to a monitor
+G_PIPELINE = 100
+G_SNAPSHOT = 0
+G_QUERYTTL = 0
 G_ZIP64 = False
 G_INCLUDES = [u'/etc/burp']
 G_ENFORCE = False
 G_REVOKE = False
 
+# loglines can be dropped without being parsed once we know the server version
+LOGLINE = re.compile(br'^\s*\{\s*"logline"\s*:')
+
+
+class Monitor(object):
+    """The :class:`burpui.misc.backend.burp2.Monitor` class wraps a single
+    ``burp -a m`` child process.
+
+    :param backend: The backend owning this monitor
+    :type backend: :class:`burpui.misc.backend.burp2.Burp`
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.logger = backend.logger
+        self.proc = None
+        self.decoder = JSONFrameDecoder(skip=self._skip)
+
+    def _skip(self, raw):
+        return self.backend.server_version and LOGLINE.match(raw)
+
+    def spawn(self):
+        """Launch the burp client process"""
+        cmd = [
+            self.backend.burpbin,
+            '-c',
+            self.backend.burpconfcli,
+            '-a',
+            'm'
+        ]
+        self.proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            shell=False,
+            bufsize=0
+        )
+        self.decoder.clear()
+        # wait a little bit in case the process dies on a network error
+        time.sleep(0.5)
+        if not self.is_alive():
+            raise OSError('Unable to spawn burp process')
+        _, write, _ = select([], [self.proc.stdin], [], self.backend.timeout)
+        if self.proc.stdin not in write:
+            self.kill()
+            raise OSError('Unable to setup burp client')
+        self.proc.stdin.write(b'j:pretty-print-off\n')
+        jso = self.read()
+        if not self.is_alive():
+            raise OSError('Unable to setup burp client')
+        if self.backend._is_warning(jso):
+            self.logger.info(jso['warning'])
+
+    def revive(self):
+        """Respawns the process if it is dead"""
+        if not self.is_alive():
+            self.spawn()
+
+    def is_alive(self):
+        """Check if the burp client process is still alive"""
+        if self.proc:
+            return self.proc.poll() is None
+        return False
+
+    def kill(self):
+        """Terminate the process"""
+        if self.is_alive():
+            try:
+                self.proc.terminate()
+            except Exception:
+                pass
+        if self.is_alive():
+            try:
+                self.proc.kill()
+                # reap the process so we don't consider it alive anymore
+                self.proc.wait()
+            except Exception:
+                pass
+
+    def terminate(self):
+        """Terminate cleanly the process"""
+        if self.is_alive():
+            # communicate closes stdin for us
+            self.proc.communicate()
+
+    def write(self, query):
+        """Send a query to the burp process"""
+        _, write, _ = select([], [self.proc.stdin], [], self.backend.timeout)
+        if self.proc.stdin not in write:
+            raise TimeoutError('Write operation timed out')
+        if not isinstance(query, bytes):
+            query = query.encode('utf-8')
+        self.proc.stdin.write(query)
+
+    def read(self):
+        """reads the burp process stdout and returns a document or None"""
+        try:
+            while True:
+                # a previous read may already have buffered the document
+                for jso in self.decoder:
+                    # if the document looks like a logline, we simply ignore it
+                    if self.backend._is_ignored(jso):
+                        continue
+                    return jso
+                if not self.is_alive():
+                    raise Exception('process died while reading its output')
+                read, _, _ = select(
+                    [self.proc.stdout],
+                    [],
+                    [],
+                    self.backend.timeout
+                )
+                if self.proc.stdout not in read:
+                    raise TimeoutError('Read operation timed out')
+                if not self.decoder.read(self.proc.stdout):
+                    raise Exception('process died while reading its output')
+        except (TimeoutError, IOError, Exception) as exp:
+            # the os throws an exception if there is no data or timeout
+            self.logger.warning(str(exp))
+            self.kill()
+        return None
+
+
+class MonitorPool(object):
+    """The :class:`burpui.misc.backend.burp2.MonitorPool` class provides a
+    bounded pool of :class:`burpui.misc.backend.burp2.Monitor` so concurrent
+    requests do not have to share the same pipe.
+
+    Monitors are spawned lazily, up to ``size`` processes.
+
+    :param backend: The backend owning this pool
+    :type backend: :class:`burpui.misc.backend.burp2.Burp`
+
+    :param size: Maximum number of monitor processes
+    :type size: int
+    """
+
+    def __init__(self, backend, size=G_POOL):
+        self.backend = backend
+        self.size = max(1, size or 1)
+        self.monitors = []
+        # LIFO so we reuse the "hot" processes first
+        self.idle = LifoQueue()
+        self.lock = Lock()
+
+    def _get(self):
+        """Returns an idle monitor, creating a new one if the pool is not full
+        yet, or waits for one to be checked in"""
+        try:
+            return self.idle.get_nowait()
+        except Empty:
+            pass
+        with self.lock:
+            if len(self.monitors) < self.size:
+                monitor = Monitor(self.backend)
+                self.monitors.append(monitor)
+                return monitor
+        try:
+            return self.idle.get(timeout=self.backend.timeout)
+        except Empty:
+            raise TimeoutError('No burp monitor available')
+
+    @contextmanager
+    def checkout(self):
+        """Context manager that lends a monitor.
+
+        Its process may be dead, see
+        :func:`burpui.misc.backend.burp2.Monitor.revive`. Waiting for a
+        monitor is not a failure of burp so it is done before entering the
+        circuit breaker.
+        """
+        monitor = self._get()
+        try:
+            yield monitor
+        finally:
+            self.idle.put(monitor)
+
+    def close(self):
+        """Terminate every process of the pool"""
+        for monitor in self.monitors:
+            monitor.terminate()
+            monitor.kill()
+
 
 # Some functions are the same as in Burp1 backend
 class Burp(Burp1):
@@ -64,14 +261,21 @@ class Burp(Burp1):
         :param conf: Configuration to use
         :type conf: :class:`burpui.utils.BUIConfig`
         """
-        self.proc = None
         self.app = server
+        self.breaker = CircuitBreaker(self.logger)
         self.client_version = None
         self.server_version = None
         self.zip64 = G_ZIP64
         self.timeout = G_TIMEOUT
+        self.poolsize = G_POOL
+        self.tmpdir = G_TMPDIR
+        self.snapshot = G_SNAPSHOT
+        self.queryttl = G_QUERYTTL
         self.burpbin = G_BURPBIN
         self.stripbin = G_STRIPBIN
+        self.stripjobs = G_STRIPJOBS
+        self.complevel = G_COMPLEVEL
+        self.compjobs = G_COMPJOBS
         self.burpconfcli = G_BURPCONFCLI
         self.burpconfsrv = G_BURPCONFSRV
         self.includes = G_INCLUDES
@@ -81,10 +285,16 @@ class Burp(Burp1):
             'Burp2': {
                 'burpbin': G_BURPBIN,
                 'stripbin': G_STRIPBIN,
+                'stripjobs': G_STRIPJOBS,
+                'complevel': G_COMPLEVEL,
+                'compjobs': G_COMPJOBS,
                 'bconfcli': G_BURPCONFCLI,
                 'bconfsrv': G_BURPCONFSRV,
                 'timeout': G_TIMEOUT,
+                'pool': G_POOL,
                 'tmpdir': G_TMPDIR,
+                'snapshot': G_SNAPSHOT,
+                'queryttl': G_QUERYTTL,
             },
             'Experimental': {
                 'zip64': G_ZIP64,
@@ -112,6 +322,18 @@ class Burp(Burp1):
                 G_STRIPBIN,
                 sect='Burp2'
             )
+            self.stripjobs = conf.safe_get(
+                'stripjobs',
+                'integer'
+            )
+            self.complevel = conf.safe_get(
+                'complevel',
+                'integer'
+            )
+            self.compjobs = conf.safe_get(
+                'compjobs',
+                'integer'
+            )
             confcli = conf.safe_get(
                 'bconfcli'
             )
@@ -122,9 +344,21 @@ class Burp(Burp1):
                 'timeout',
                 'integer'
             )
+            self.poolsize = conf.safe_get(
+                'pool',
+                'integer'
+            )
             tmpdir = conf.safe_get(
                 'tmpdir'
             )
+            self.snapshot = conf.safe_get(
+                'snapshot',
+                'integer'
+            )
+            self.queryttl = conf.safe_get(
+                'queryttl',
+                'float'
+            )
 
             # Experimental options
             self.zip64 = conf.safe_get(
@@ -213,14 +447,24 @@ class Burp(Burp1):
         self.client_version = version.replace('burp-', '')
 
         self.parser = Parser(self)
+        self.pool = MonitorPool(self, self.poolsize)
+        self.store = self._get_stats_store()
+        self.flight = SingleFlight(self.queryttl)
+        self.collector = SnapshotCollector(self, self.snapshot)
 
         self.logger.info('burp binary: {}'.format(self.burpbin))
         self.logger.info('strip binary: {}'.format(self.stripbin))
+        self.logger.info('strip jobs: {}'.format(self.stripjobs))
+        self.logger.info('compression level: {}'.format(self.complevel))
+        self.logger.info('compression jobs: {}'.format(self.compjobs))
         self.logger.info('burp conf cli: {}'.format(self.burpconfcli))
         self.logger.info('burp conf srv: {}'.format(self.burpconfsrv))
         self.logger.info('command timeout: {}'.format(self.timeout))
+        self.logger.info('monitor pool size: {}'.format(self.pool.size))
         self.logger.info('burp version: {}'.format(self.client_version))
         self.logger.info('tmpdir: {}'.format(self.tmpdir))
+        self.logger.info('snapshot interval: {}'.format(self.snapshot))
+        self.logger.info('query ttl: {}'.format(self.queryttl))
         self.logger.info('zip64: {}'.format(self.zip64))
         self.logger.info('includes: {}'.format(self.includes))
         self.logger.info('enforce: {}'.format(self.enforce))
@@ -230,62 +474,12 @@ class Burp(Burp1):
             self.status()
         except BUIserverException:
             pass
+        self.collector.start()
 
     def __exit__(self, typ, value, traceback):
         """try not to leave child process server side"""
-        self._terminate_burp()
-        self._kill_burp()
-
-    def _kill_burp(self):
-        """Terminate the process"""
-        if self._proc_is_alive():
-            try:
-                self.proc.terminate()
-            except Exception:
-                pass
-        if self._proc_is_alive():
-            try:
-                self.proc.kill()
-            except Exception:
-                pass
-
-    def _terminate_burp(self):
-        """Terminate cleanly the process"""
-        if self._proc_is_alive():
-            self.proc.stdin.close()
-            self.proc.communicate()
-            self.proc.wait()
-
-    def _spawn_burp(self):
-        """Launch the burp client process"""
-        cmd = [self.burpbin, '-c', self.burpconfcli, '-a', 'm']
-        self.proc = subprocess.Popen(
-            cmd,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            shell=False,
-            universal_newlines=True,
-            bufsize=0
-        )
-        # wait a little bit in case the process dies on a network error
-        time.sleep(0.5)
-        if not self._proc_is_alive():
-            raise Exception('Unable to spawn burp process')
-        _, write, _ = select([], [self.proc.stdin], [], self.timeout)
-        if self.proc.stdin not in write:
-            self._kill_burp()
-            raise OSError('Unable to setup burp client')
-        self.proc.stdin.write('j:pretty-print-off\n')
-        jso = self._read_proc_stdout()
-        if self._is_warning(jso):
-            self.logger.info(jso['warning'])
-
-    def _proc_is_alive(self):
-        """Check if the burp client process is still alive"""
-        if self.proc:
-            return self.proc.poll() is None
-        return False
+        self.collector.stop()
+        self.pool.close()
 
     def _is_ignored(self, jso):
         """We ignore the 'logline' lines"""
@@ -349,47 +543,28 @@ class Burp(Burp1):
 
         return hur
 
-    def _read_proc_stdout(self):
-        """reads the burp process stdout and returns a document or None"""
-        doc = u''
-        jso = None
-        while True:
-            try:
-                if not self._proc_is_alive():
-                    raise Exception('process died while reading its output')
-                read, _, _ = select([self.proc.stdout], [], [], self.timeout)
-                if self.proc.stdout not in read:
-                    raise TimeoutError('Read operation timed out')
-                doc += self.proc.stdout.readline().rstrip('\n')
-                jso = self._is_valid_json(doc)
-                # if the string is a valid json and looks like a logline, we
-                # simply ignore it
-                if jso and self._is_ignored(jso):
-                    doc = u''
-                    continue
-                elif jso:
-                    break
-            except (TimeoutError, IOError, Exception) as exp:
-                # the os throws an exception if there is no data or timeout
-                self.logger.warning(str(exp))
-                self._kill_burp()
-                break
-        return jso
-
     def status(self, query='c:\n', agent=None):
         """See :func:`burpui.misc.backend.interface.BUIbackend.status`"""
+        if not query.endswith('\n'):
+            query = '{0}\n'.format(query)
+        # identical concurrent queries are only sent once
+        return self.flight.do(query, self._status, query)
+
+    def _status(self, query):
+        """Sends a query to a monitor"""
         try:
-            self.logger.info("query: '{}'".format(query.rstrip()))
-            if not query.endswith('\n'):
-                query = '{0}\n'.format(query)
-            if not self._proc_is_alive():
-                self._spawn_burp()
-
-            _, write, _ = select([], [self.proc.stdin], [], self.timeout)
-            if self.proc.stdin not in write:
-                raise TimeoutError('Write operation timed out')
-            self.proc.stdin.write(query)
-            jso = self._read_proc_stdout()
+            with self.pool.checkout() as monitor, self.breaker:
+                self.logger.info("query: '{}'".format(query.rstrip()))
+                with self._monitor_errors():
+                    monitor.revive()
+                    try:
+                        monitor.write(query)
+                    except TimeoutError:
+                        monitor.kill()
+                        raise
+                    jso = monitor.read()
+                    if jso is None:
+                        raise TimeoutError('burp did not answer')
             if self._is_warning(jso):
                 self.logger.warning(jso['warning'])
                 self.logger.debug('Nothing interesting to return')
@@ -397,15 +572,75 @@ class Burp(Burp1):
 
             self.logger.debug('=> {}'.format(jso))
             return jso
+        except BUIserverException:
+            # the circuit is open
+            raise
+        except Exception as exp:
+            self.logger.error(str(exp))
+            raise BUIserverException(str(exp))
+
+    @contextmanager
+    def _monitor_errors(self):
+        """Rewords the errors of the monitors, the connection errors and the
+        timeouts are kept as such so the circuit breaker counts them"""
+        try:
+            yield
         except TimeoutError as exp:
-            msg = 'Cannot send command: {}'.format(str(exp))
-            self.logger.error(msg)
-            self._kill_burp()
-            raise BUIserverException(msg)
-        except (OSError, Exception) as exp:
-            msg = 'Cannot launch burp process: {}'.format(str(exp))
-            self.logger.error(msg)
-            raise BUIserverException(msg)
+            raise TimeoutError('Cannot send command: {}'.format(str(exp)))
+        except (IOError, OSError) as exp:
+            raise OSError('Cannot launch burp process: {}'.format(str(exp)))
+        except Exception as exp:
+            raise Exception('Cannot launch burp process: {}'.format(str(exp)))
+
+    def status_pipeline(self, queries, agent=None):
+        """The :func:`burpui.misc.backend.burp2.Burp.status_pipeline` function
+        sends several queries to the same monitor in a row and then reads the
+        replies in order, saving a round trip per query.
+
+        :param queries: The queries to send
+        :type queries: list
+
+        :param agent: What server to ask (only in multi-agent mode)
+        :type agent: str
+
+        :returns: The list of the replies in the same order as the queries. A
+                  reply is None if there is nothing interesting to return
+        """
+        ret = []
+        queries = [
+            x if x.endswith('\n') else '{0}\n'.format(x) for x in queries
+        ]
+        try:
+            with self.pool.checkout() as monitor, self.breaker:
+                with self._monitor_errors():
+                    monitor.revive()
+                    for idx in range(0, len(queries), G_PIPELINE):
+                        batch = queries[idx:idx + G_PIPELINE]
+                        self.logger.info(
+                            "pipelined queries: {}".format(len(batch))
+                        )
+                        try:
+                            monitor.write(''.join(batch))
+                        except TimeoutError:
+                            monitor.kill()
+                            raise
+                        for query in batch:
+                            jso = monitor.read()
+                            if jso is None:
+                                # the monitor has been killed, the remaining
+                                # replies are lost
+                                raise TimeoutError('burp did not answer')
+                            if self._is_warning(jso):
+                                self.logger.warning(jso['warning'])
+                                jso = None
+                            ret.append(jso)
+        except BUIserverException:
+            # the circuit is open
+            raise
+        except Exception as exp:
+            self.logger.error(str(exp))
+            raise BUIserverException(str(exp))
+        return ret
 
     def get_backup_logs(self, number, client, forward=False, agent=None):
         """See
@@ -415,16 +650,59 @@ class Burp(Burp1):
         if not client or not number:
             return ret
 
-        query = self.status('c:{0}:b:{1}\n'.format(client, number))
+        # the store is keyed on the backup timestamp
+        timestamp = self._get_backup_timestamp(client, number)
+        return self._get_backups_logs([(client, number, timestamp)], forward)[0]
+
+    def _get_backup_timestamp(self, client, number):
+        """Returns the timestamp of a backup or None if it cannot be found
+
+        :param client: Client name to work on
+        :type client: str
+
+        :param number: Backup number to work on
+        :type number: int
+        """
+        query = self.status('c:{0}\n'.format(client))
+        try:
+            backups = query['clients'][0]['backups']
+        except (KeyError, IndexError, TypeError):
+            return None
+        for backup in backups:
+            if str(backup['number']) == str(number):
+                return backup['timestamp']
+        return None
+
+    def _get_backup_logs_from_query(self, number, client, query, forward=False):
+        """Computes the result of
+        :func:`burpui.misc.backend.burp2.Burp.get_backup_logs` out of the reply
+        to a ``c:<client>:b:<number>:l:backup_stats`` query and stores it.
+
+        :param number: Backup number to work on
+        :type number: int
+
+        :param client: Client name to work on
+        :type client: str
+
+        :param query: The reply of the monitor
+        :type query: dict
+
+        :param forward: Is the client name needed in later process
+        :type forward: bool
+
+        :returns: Dict containing the backup log
+        """
+        ret = {}
         if not query:
             return ret
         try:
-            logs = query['clients'][0]['backups'][0]['logs']['list']
-        except KeyError:
+            backup = query['clients'][0]['backups'][0]
+            logs = backup['logs']
+        except (KeyError, IndexError):
             self.logger.warning('No logs found')
             return ret
-        if 'backup_stats' in logs:
-            ret = self._parse_backup_stats(number, client, forward)
+        if 'backup_stats' in logs.get('list', []) or 'backup_stats' in logs:
+            ret = self._parse_backup_stats(number, client, forward, query=query)
         # TODO: support clients that were upgraded to 2.x
         # else:
         #    cl = None
@@ -437,6 +715,42 @@ class Burp(Burp1):
         ret['encrypted'] = False
         if 'files_enc' in ret and ret['files_enc']['total'] > 0:
             ret['encrypted'] = True
+        self._store_stats(number, client, backup['timestamp'], ret)
+        return ret
+
+    def _get_backups_logs(self, backups, forward=False):
+        """Returns the logs of several backups, the ones that are not stored
+        yet are fetched with a single pipelined burst.
+
+        :param backups: List of (client, number, timestamp) tuples
+        :type backups: list
+
+        :param forward: Is the client name needed in later process
+        :type forward: bool
+
+        :returns: The list of logs in the same order as the backups
+        """
+        ret = []
+        missing = []
+        for (client, number, timestamp) in backups:
+            log = self._get_stored_stats(number, client, timestamp, forward)
+            if log is None:
+                missing.append(len(ret))
+            ret.append(log)
+        if not missing:
+            return ret
+        replies = self.status_pipeline([
+            'c:{0}:b:{1}:l:backup_stats\n'.format(*backups[idx][:2])
+            for idx in missing
+        ])
+        for idx, query in zip(missing, replies):
+            client, number, _ = backups[idx]
+            ret[idx] = self._get_backup_logs_from_query(
+                number,
+                client,
+                query,
+                forward
+            )
         return ret
 
     def _guess_backup_protocol(self, number, client):
@@ -462,7 +776,7 @@ class Burp(Burp1):
             return 1
         return 1
 
-    def _parse_backup_stats(self, number, client, forward=False, agent=None):
+    def _parse_backup_stats(self, number, client, forward=False, agent=None, query=None):
         """The :func:`burpui.misc.backend.burp2.Burp._parse_backup_stats`
         function is used to parse the burp logs.
 
@@ -478,6 +792,9 @@ class Burp(Burp1):
         :param agent: What server to ask (only in multi-agent mode)
         :type agent: str
 
+        :param query: Reply to the ``backup_stats`` query if already known
+        :type query: dict
+
         :returns: Dict containing the backup log
         """
         ret = {}
@@ -523,10 +840,11 @@ class Burp(Burp1):
             'bytes_estimated',
             'bytes'
         ]
-        query = self.status(
-            'c:{0}:b:{1}:l:backup_stats\n'.format(client, number),
-            agent=agent
-        )
+        if query is None:
+            query = self.status(
+                'c:{0}:b:{1}:l:backup_stats\n'.format(client, number),
+                agent=agent
+            )
         if not query:
             return ret
         try:
@@ -586,7 +904,65 @@ class Burp(Burp1):
     #    """
     #    return {}
 
-    # def get_clients_report(self, clients, agent=None):
+    def get_clients_report(self, clients, agent=None):
+        """See
+        :func:`burpui.misc.backend.interface.BUIbackend.get_clients_report`
+        """
+        names = [x['name'] for x in clients]
+        queries = self.status_pipeline(['c:{0}\n'.format(x) for x in names])
+        last = []
+        counts = []
+        for name, query in zip(names, queries):
+            try:
+                backups = [
+                    x for x in query['clients'][0]['backups']
+                    if 'flags' not in x or 'working' not in x['flags']
+                ]
+            except (KeyError, IndexError, TypeError):
+                continue
+            if not backups:
+                continue
+            # burp lists the most recent backup first
+            last.append((name, backups[0]['number'], backups[0]['timestamp']))
+            counts.append(len(backups))
+        cls = []
+        bkp = []
+        logs = self._get_backups_logs(last)
+        for (name, _, _), count, stats in zip(last, counts, logs):
+            windows = stats['windows'] if 'windows' in stats else "unknown"
+            totsize = stats['totsize'] if 'totsize' in stats else 0
+            total = stats['total']['total'] if \
+                'total' in stats and 'total' in stats['total'] else 0
+            cls.append({
+                'name': name,
+                'stats': {
+                    'windows': windows,
+                    'totsize': totsize,
+                    'total': total
+                }
+            })
+            bkp.append({'name': name, 'number': count})
+        return {'clients': cls, 'backups': bkp}
+
+    def get_client_report(self, name=None, agent=None):
+        """See
+        :func:`burpui.misc.backend.interface.BUIbackend.get_client_report`
+        """
+        if not name:
+            return []
+        query = self.status('c:{0}\n'.format(name))
+        try:
+            backups = [
+                x for x in query['clients'][0]['backups']
+                if 'flags' not in x or 'working' not in x['flags']
+            ]
+        except (KeyError, IndexError, TypeError):
+            return []
+        # sorted by date ASC like the result of get_client
+        backups.reverse()
+        return self._get_backups_logs(
+            [(name, x['number'], x['timestamp']) for x in backups]
+        )
 
     def get_counters(self, name=None, agent=None):
         """See :func:`burpui.misc.backend.interface.BUIbackend.get_counters`"""
@@ -688,6 +1064,9 @@ class Burp(Burp1):
         """
         if not name:
             return False
+        snap = self.collector.get()
+        if snap:
+            return name in snap.running
         try:
             query = self.status('c:{0}\n'.format(name))
         except BUIserverException:
@@ -695,28 +1074,14 @@ class Burp(Burp1):
         if not query:
             return False
         try:
-            return query['clients'][0]['run_status'] in ['running']
+            return is_running(
+                self._status_human_readable(query['clients'][0]['run_status'])
+            )
         except KeyError:
             self.logger.warning('Client not found')
             return False
         return False
 
-    def is_one_backup_running(self, agent=None):
-        """See
-        :func:`burpui.misc.backend.interface.BUIbackend.is_one_backup_running`
-        """
-        ret = []
-        try:
-            clients = self.get_all_clients()
-        except BUIserverException:
-            return ret
-        for client in clients:
-            if client['state'] in ['running']:
-                ret.append(client['name'])
-        self.running = ret
-        self.refresh = time.time()
-        return ret
-
     def _status_human_readable(self, status):
         """The label has changed in burp2, we override it to be compatible with
         burp1's format
@@ -734,10 +1099,8 @@ class Burp(Burp1):
             return 'server crashed'
         return status
 
-    def get_all_clients(self, agent=None):
-        """See
-        :func:`burpui.misc.backend.interface.BUIbackend.get_all_clients`
-        """
+    def _get_clients_state(self):
+        """See :func:`burpui.misc.backend.burp1.Burp._get_clients_state`"""
         ret = []
         query = self.status()
         if not query or 'clients' not in query:
@@ -751,19 +1114,19 @@ class Burp(Burp1):
             if cli['state'] in ['running']:
                 cli['phase'] = client['phase']
                 cli['last'] = 'now'
-                counters = self.get_counters(cli['name'])
-                if 'percent' in counters:
-                    cli['percent'] = counters['percent']
-                else:
-                    cli['percent'] = 0
             elif not infos:
                 cli['last'] = 'never'
             else:
                 infos = infos[0]
                 cli['last'] = infos['timestamp']
+            if 'labels' in client:
+                cli['labels'] = client['labels']
             ret.append(cli)
         return ret
 
+    # Same as in Burp1 backend
+    # def get_all_clients(self, agent=None):
+
     def get_client(self, name=None, agent=None):
         """See :func:`burpui.misc.backend.interface.BUIbackend.get_client`"""
         ret = []
@@ -777,18 +1140,27 @@ class Burp(Burp1):
         except KeyError:
             self.logger.warning('Client not found')
             return ret
-        for backup in backups:
+        # forget about the backups that do not exist anymore
+        self.store.prune(
+            name,
+            dict((x['number'], x['timestamp']) for x in backups)
+        )
+        # skip running backups since data will be inconsistent
+        backups = [
+            x for x in backups
+            if 'flags' not in x or 'working' not in x['flags']
+        ]
+        logs = self._get_backups_logs(
+            [(name, x['number'], x['timestamp']) for x in backups]
+        )
+        for backup, log in zip(backups, logs):
             back = {}
-            # skip running backups since data will be inconsistent
-            if 'flags' in backup and 'working' in backup['flags']:
-                continue
             back['number'] = backup['number']
             if 'flags' in backup and 'deletable' in backup['flags']:
                 back['deletable'] = True
             else:
                 back['deletable'] = False
             back['date'] = backup['timestamp']
-            log = self.get_backup_logs(backup['number'], name)
             try:
                 back['encrypted'] = log['encrypted']
                 try:
@@ -878,6 +1250,9 @@ class Burp(Burp1):
         ret = []
         if not client:
             return ret
+        snap = self.collector.get()
+        if snap and client in snap.labels:
+            return snap.labels[client]
         query = self.status('c:{0}\n'.format(client))
         if not query:
             return ret
@@ -897,6 +1272,16 @@ class Burp(Burp1):
     #     password=None,
     #     agent=None):
 
+    # def restore_files_stream(
+    #     self,
+    #     name=None,
+    #     backup=None,
+    #     files=None,
+    #     strip=None,
+    #     archive='zip',
+    #     password=None,
+    #     agent=None):
+
     # def read_conf_cli(self, agent=None):
 
     # def read_conf_srv(self, agent=None):
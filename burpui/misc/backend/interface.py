@@ -10,10 +10,12 @@
 import logging
 
 from abc import ABCMeta, abstractmethod
+from six import add_metaclass
 
 from ..._compat import ConfigParser
 
 
+@add_metaclass(ABCMeta)
 class BUIbackend(object):
     """The :class:`burpui.misc.backend.interface.BUIbackend` class provides
     a consistent interface backend for any ``burp`` server.
@@ -25,8 +27,6 @@ class BUIbackend(object):
     :param conf: Configuration file to use
     :type conf: str
     """
-    __metaclass__ = ABCMeta
-
     # cache the running clients
     running = []
     # do we need to refresh the cache?
@@ -263,6 +263,23 @@ class BUIbackend(object):
         """
         raise NotImplementedError("Sorry, the current Backend does not implement this method!")  # pragma: no cover
 
+    @abstractmethod
+    def get_client_report(self, name=None, agent=None):
+        """The :func:`burpui.misc.backend.interface.BUIbackend.get_client_report`
+        function returns the logs of every backup of a given client.
+
+        :param name: Name of the client
+        :type name: str
+
+        :param agent: What server to ask (only in multi-agent mode)
+        :type agent: str
+
+        :returns: A list of dict as returned by
+                  :func:`burpui.misc.backend.interface.BUIbackend.get_backup_logs`
+                  sorted by date ASC
+        """
+        raise NotImplementedError("Sorry, the current Backend does not implement this method!")  # pragma: no cover
+
     @abstractmethod
     def get_counters(self, name=None, agent=None):
         """The :func:`burpui.misc.backend.interface.BUIbackend.get_counters`
@@ -435,8 +452,8 @@ class BUIbackend(object):
                       files
         :type strip: int
 
-        :param archive: Format of the generated archive (may be zip, tar.gz or
-                        tar.bz2)
+        :param archive: Format of the generated archive (may be zip, tar,
+                        tar.gz, tar.bz2 or tar.zst)
         :type archive: str
 
         :param password: Password for encrypted backups
@@ -449,6 +466,41 @@ class BUIbackend(object):
         """
         raise NotImplementedError("Sorry, the current Backend does not implement this method!")  # pragma: no cover
 
+    @abstractmethod
+    def restore_files_stream(self, name=None, backup=None, files=None, strip=None, archive='zip', password=None, agent=None):
+        """The :func:`burpui.misc.backend.interface.BUIbackend.restore_files_stream`
+        function performs a restoration like
+        :func:`burpui.misc.backend.interface.BUIbackend.restore_files` but the
+        archive is generated on the fly instead of being written on disk.
+
+        :param name: Client name
+        :type name: str
+
+        :param backup: Backup number
+        :type backup: int
+
+        :param files: A string representing a list of files to restore
+        :type files: str
+
+        :param strip: Number of parent directories to strip while restoring
+                      files
+        :type strip: int
+
+        :param archive: Format of the generated archive (may be zip, tar,
+                        tar.gz, tar.bz2 or tar.zst)
+        :type archive: str
+
+        :param password: Password for encrypted backups
+        :type password: str
+
+        :param agent: What server to ask (only in multi-agent mode)
+        :type agent: str
+
+        :returns: A tuple with a generator of the archive chunks and/or an
+                  error message
+        """
+        raise NotImplementedError("Sorry, the current Backend does not implement this method!")  # pragma: no cover
+
     @abstractmethod
     def read_conf_srv(self, conf=None, agent=None):
         """The :func:`burpui.misc.backend.interface.BUIbackend.read_conf_srv`
@@ -817,6 +869,28 @@ class BUIbackend(object):
         """
         raise NotImplementedError("Sorry, the current Backend does not implement this method!")  # pragma: no cover
 
+    @abstractmethod
+    def get_breaker_state(self, agent=None):
+        """The :func:`burpui.misc.backend.interface.BUIbackend.get_breaker_state`
+        function returns the state of the circuit breaker protecting the calls
+        to the burp server.
+
+        :param agent: What server to ask (only in multi-agent mode)
+        :type agent: str
+
+        :returns: A dict
+
+        Example::
+
+            {
+                "state": "open",
+                "failures": 2,
+                "retry": 3,
+                "error": "Cannot contact burp server at ::1:4972"
+            }
+        """
+        raise NotImplementedError("Sorry, the current Backend does not implement this method!")  # pragma: no cover
+
     @abstractmethod
     def get_client_labels(self, client=None, agent=None):
         """The :func:`burpui.misc.backend.interface.BUIbackend.get_client_labels`
@@ -833,3 +907,38 @@ class BUIbackend(object):
         :returns: A list of labels or an empty list
         """
         raise NotImplementedError("Sorry, the current Backend does not implement this method!")  # pragma: no cover
+
+    @abstractmethod
+    def multi_call(self, calls, agent=None):
+        """The :func:`burpui.misc.backend.interface.BUIbackend.multi_call`
+        function runs several calls of this interface at once. In multi-agent
+        mode, they are all sent to the agent in a single request.
+
+        :param calls: Ordered list of ``(method, arguments)`` tuples, the
+                      arguments being a dict of named arguments
+        :type calls: list
+
+        :param agent: What server to ask (only in multi-agent mode)
+        :type agent: str
+
+        :returns: The list of the results in the same order as the calls
+
+        Example::
+
+            [
+                {
+                    "result": ["color: #42ff00"],
+                    "error": null
+                },
+                {
+                    "result": null,
+                    "error": "Cannot contact burp server at ::1:4972"
+                }
+            ]
+        """
+        raise NotImplementedError("Sorry, the current Backend does not implement this method!")  # pragma: no cover
+
+
+# the proxies (multi backend, agent) empty the abstract methods of the
+# interface so they can be instantiated, keep the original list for them
+INTERFACE_METHODS = BUIbackend.__abstractmethods__
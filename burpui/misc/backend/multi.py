@@ -5,17 +5,31 @@ import errno
 import time
 import json
 import struct
+import hashlib
+import threading
 import traceback
 
 from six import iteritems
 
-from .interface import BUIbackend
-from ...exceptions import BUIserverException
+from .interface import BUIbackend, INTERFACE_METHODS
+from .utils import LiveView
+from ..protocol import MuxClient, MUX_VERSION, FRAME_OK, FRAME_ER, FRAME_BY, \
+    LENGTH, RELAY_SIZE, read_message, read_chunk, recvall, choose_codec, supported_codecs, \
+    choose_serializer, supported_serializers, dumps, loads
+from ...exceptions import BUIserverException, BUIagentBusy, \
+    BUIagentUnsupported
 from ..._compat import pickle
 from ...utils import implement
 
 
-INTERFACE_METHODS = BUIbackend.__abstractmethods__
+# how long (in seconds) before asking again an agent that does not support the
+# multiplexed connections
+G_MUXRETRY = 300
+# how long (in seconds) before subscribing again to the events of an agent
+# after losing the connection
+G_EVENTSRETRY = 5
+# how long (in seconds) to wait for an agent when querying all of them
+G_DEADLINE = 30
 
 
 class ProxyCall(object):
@@ -61,7 +75,7 @@ class ProxyCall(object):
             data = {'func': self.method, 'args': encoded_args}
             if self.method == 'restore_files':
                 return self.proxy.do_command(data)
-            return json.loads(self.proxy.do_command(data))
+            return self.proxy.call(data)
         # normal case for "standard" interface
         if 'agent' not in encoded_args:
             raise AttributeError(str(encoded_args))
@@ -126,8 +140,13 @@ class Burp(BUIbackend):
                     password = conf.safe_get('password', section=sect)
                     ssl = conf.safe_get('ssl', 'boolean', section=sect) or False
                     timeout = conf.safe_get('timeout', 'integer', section=sect) or 5
+                    events = conf.safe_get('events', 'boolean', section=sect) or False
+                    fingerprint = conf.safe_get('sslfingerprint', section=sect)
+                    deadline = conf.safe_get('deadline', 'integer', section=sect)
+                    if deadline is None:
+                        deadline = G_DEADLINE
 
-                    self.servers[r.group(1)] = NClient(self.app, host, port, password, ssl, timeout)
+                    self.servers[r.group(1)] = NClient(self.app, host, port, password, ssl, timeout, events, fingerprint, deadline)
                     self.app.config['SERVERS'].append(r.group(1))
 
         if not self.servers:
@@ -157,6 +176,58 @@ class Burp(BUIbackend):
                 return func
         return object.__getattribute__(self, name)
 
+    def fanout(self, func, agents=None):
+        """Runs a function for several agents at the same time. The results
+        of an agent are given up once its deadline is over so a dead agent
+        does not delay the others.
+
+        :param func: Function called with the name of the agent and its
+                     :class:`burpui.misc.backend.multi.NClient`
+        :type func: callable
+
+        :param agents: Names of the agents, all of them by default
+        :type agents: list
+
+        :returns: A dict indexed by agent name of dict with the ``result`` or
+                  the ``error`` of each agent
+        """
+        if agents is None:
+            agents = list(self.servers)
+        done = {}
+
+        def _run(name):
+            try:
+                if name not in self.servers:
+                    raise BUIserverException("Agent '{}' not found".format(name))
+                done[name] = {'result': func(name, self.servers[name]), 'error': None}
+            except Exception as exp:
+                done[name] = {'result': None, 'error': str(exp)}
+
+        start = time.time()
+        threads = []
+        for name in agents:
+            thread = threading.Thread(target=_run, args=(name,), name='burp-ui-fanout')
+            thread.daemon = True
+            thread.start()
+            threads.append((name, thread))
+        ret = {}
+        for name, thread in threads:
+            deadline = getattr(self.servers.get(name), 'deadline', 0)
+            if deadline:
+                thread.join(max(start + deadline - time.time(), 0))
+            else:
+                thread.join()
+            res = done.get(name)
+            if res is None:
+                res = {
+                    'result': None,
+                    'error': 'Agent {} did not answer within {}s'.format(name, deadline)
+                }
+            if res['error']:
+                self.logger.warning('Agent %s: %s', name, res['error'])
+            ret[name] = res
+        return ret
+
     @implement
     def is_one_backup_running(self, agent=None):
         """See :func:`burpui.misc.backend.interface.BUIbackend.is_one_backup_running`"""
@@ -166,8 +237,9 @@ class Burp(BUIbackend):
             self.running[agent] = r
         else:
             r = {}
-            for name, serv in iteritems(self.servers):
-                r[name] = serv.is_one_backup_running()
+            res = self.fanout(lambda name, serv: serv.is_one_backup_running())
+            for name, call in iteritems(res):
+                r[name] = call['result'] or []
 
             self.running = r
         self.refresh = time.time()
@@ -181,9 +253,9 @@ class Burp(BUIbackend):
 
         r = {}
 
-        for name, serv in iteritems(self.servers):
-            func = getattr(serv, method)
-            r[name] = func()
+        res = self.fanout(lambda name, serv: getattr(serv, method)())
+        for name, call in iteritems(res):
+            r[name] = call['result']
 
         return r
 
@@ -201,6 +273,13 @@ class Burp(BUIbackend):
             return self._get_version('get_server_version')
         return self.servers[agent].get_server_version()
 
+    @implement
+    def get_breaker_state(self, agent=None):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.get_breaker_state`"""
+        if not agent:
+            return self._get_version('get_breaker_state')
+        return self.servers[agent].get_breaker_state()
+
 
 class NClient(BUIbackend):
     """The :class:`burpui.misc.backend.multi.NClient` class provides a
@@ -223,6 +302,21 @@ class NClient(BUIbackend):
 
     :param ssl: Use SSL to communicate with the agent
     :type ssl: bool
+
+    :param timeout: How long to wait for the agent in seconds
+    :type timeout: int
+
+    :param events: Subscribe to the state events pushed by the agent instead
+                   of polling it for the live calls
+    :type events: bool
+
+    :param fingerprint: SHA-256 fingerprint of the certificate of the agent,
+                        the connection is refused if it does not match
+    :type fingerprint: str
+
+    :param deadline: How long to wait for the agent when all the agents are
+                     queried at the same time, 0 to wait for its answer
+    :type deadline: int
     """
     # These functions MUST be implemented because we inherit an abstract class.
     # The hack here is to get the list of the functions and let the interpreter
@@ -231,7 +325,7 @@ class NClient(BUIbackend):
     foreign = INTERFACE_METHODS
     BUIbackend.__abstractmethods__ = frozenset()
 
-    def __init__(self, app=None, host=None, port=None, password=None, ssl=None, timeout=5):
+    def __init__(self, app=None, host=None, port=None, password=None, ssl=None, timeout=5, events=False, fingerprint=None, deadline=G_DEADLINE):
         self.host = host
         self.port = port
         self.password = password
@@ -239,6 +333,22 @@ class NClient(BUIbackend):
         self.connected = False
         self.app = app
         self.timeout = timeout or 5
+        self.mux = None
+        self.legacy = 0
+        # last time the agent told it does not know multi_call
+        self.nobatch = 0
+        self.muxlock = threading.Lock()
+        self.events = events
+        self.view = LiveView()
+        self.listener = None
+        self.fingerprint = (fingerprint or '').replace(':', '').lower() or None
+        # the SSL context and the last TLS session are kept so the next
+        # connections resume the session instead of a full handshake
+        self.sslctx = None
+        self.session = None
+        self.handshakes = 0
+        self.resumed = 0
+        self.deadline = deadline
 
     def __getattribute__(self, name):
         # always return this value because we need it and if we don't do that
@@ -278,17 +388,34 @@ class NClient(BUIbackend):
         """Do the actual connection to the agent"""
         ret = None
         if self.ssl:
-            import ssl
             s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             if not notimeout:
                 s.settimeout(self.timeout)
             s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-            ret = ssl.wrap_socket(s, cert_reqs=ssl.CERT_NONE, ssl_version=ssl.PROTOCOL_SSLv23)
+            kwargs = {}
+            if self.session is not None:
+                kwargs['session'] = self.session
+            ret = self._ssl_context().wrap_socket(s, **kwargs)
+            start = time.time()
             try:
                 ret.connect((self.host, self.port))
+                self._check_fingerprint(ret)
             except Exception as e:
                 self.logger.error('ERROR: %s', str(e))
+                ret.close()
                 raise e
+            self.handshakes += 1
+            if getattr(ret, 'session_reused', False):
+                self.resumed += 1
+            self.logger.debug(
+                'TLS handshake with %s:%s in %.1fms (resumed %s/%s)',
+                self.host,
+                self.port,
+                (time.time() - start) * 1000,
+                self.resumed,
+                self.handshakes
+            )
+            self._save_session(ret)
         else:
             if not notimeout:
                 ret = socket.create_connection((self.host, self.port), timeout=self.timeout)
@@ -297,6 +424,36 @@ class NClient(BUIbackend):
             ret.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         return ret
 
+    def _ssl_context(self):
+        """Returns the SSL context used for every connection to the agent"""
+        if self.sslctx is None:
+            import ssl
+            ctx = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            ctx.verify_mode = ssl.CERT_NONE
+            self.sslctx = ctx
+        return self.sslctx
+
+    def _save_session(self, sock):
+        """Keeps the TLS session of a connection to resume it later. With
+        TLS 1.3 the session tickets come after the handshake so this is done
+        again once the agent answered."""
+        session = getattr(sock, 'session', None)
+        if session is not None:
+            self.session = session
+
+    def _check_fingerprint(self, sock):
+        """Makes sure the certificate of the agent is the pinned one"""
+        if not self.fingerprint:
+            return
+        der = sock.getpeercert(True) or b''
+        if hashlib.sha256(der).hexdigest() != self.fingerprint:
+            raise socket.error(
+                'Certificate of agent {}:{} does not match its fingerprint'.format(
+                    self.host,
+                    self.port
+                )
+            )
+
     def ping(self):
         """Check if we are connected to the agent"""
         self.conn()
@@ -312,40 +469,193 @@ class NClient(BUIbackend):
             self.sock.close()
             self.connected = False
 
-    def do_command(self, data=None, restarted=False):
+    def _get_mux(self):
+        """Returns the multiplexed connection to the agent, opening it if
+        needed
+
+        :returns: The connection or None if the agent does not support it
+        """
+        mux = self.mux
+        if mux and not mux.closed:
+            return mux
+        if self.legacy and time.time() - self.legacy < G_MUXRETRY:
+            return None
+        with self.muxlock:
+            if self.mux and not self.mux.closed:
+                return self.mux
+            if self.legacy and time.time() - self.legacy < G_MUXRETRY:
+                return None
+            sock = self.do_conn()
+            try:
+                raw = json.dumps({
+                    'func': 'hello',
+                    'password': self.password,
+                    'args': {
+                        'version': MUX_VERSION,
+                        'compress': supported_codecs(),
+                        'serializers': supported_serializers()
+                    }
+                }).encode('UTF-8')
+                sock.sendall(LENGTH.pack(len(raw)) + raw)
+                if self.recvall(2, sock) != b'OK':
+                    self.logger.info(
+                        'Agent %s:%s does not support multiplexed connections',
+                        self.host,
+                        self.port
+                    )
+                    self.legacy = time.time()
+                    sock.close()
+                    return None
+                hello = json.loads(read_message(sock).decode('UTF-8'))
+                if self.ssl:
+                    self._save_session(sock)
+            except Exception:
+                sock.close()
+                raise
+            codec = choose_codec([hello.get('compress')])
+            serializer = choose_serializer([hello.get('serializer')])
+            self.logger.debug(
+                'Agent %s:%s speaks protocol %s (compression: %s, serialization: %s)',
+                self.host,
+                self.port,
+                hello.get('version'),
+                codec,
+                serializer
+            )
+            self.mux = MuxClient(sock, self.logger, codec, serializer)
+            self.legacy = 0
+            return self.mux
+
+    def _mux_command(self, data, restarted=False, strict=False):
+        """Send a command through the multiplexed connection"""
+        res = []
+        try:
+            mux = self._get_mux()
+        except Exception as e:
+            self.logger.error('Could not connect to %s:%s => %s', self.host, self.port, str(e))
+            if strict:
+                raise BUIserverException(self._unreachable(e))
+            return res
+        if not mux:
+            return None
+        try:
+            self.logger.debug("Sending: %s", data)
+            kind, payload = mux.call(self._encode(data, mux.serializer), self.timeout)
+        except socket.timeout as e:
+            self.logger.error('!!! {} !!!\n{}'.format(str(e), traceback.format_exc()))
+            if strict:
+                raise BUIserverException(self._unreachable(e))
+            return res
+        except (socket.error, IOError) as e:
+            mux.close()
+            if not restarted:
+                return self._mux_command(data, True, strict)
+            self.logger.error('!!! {} !!!\n{}'.format(str(e), traceback.format_exc()))
+            if strict:
+                raise BUIserverException(self._unreachable(e))
+            return res
+        if kind == FRAME_ER:
+            raise BUIserverException(payload.decode('UTF-8'))
+        if kind == FRAME_BY:
+            raise BUIagentBusy(payload.decode('UTF-8'))
+        if kind != FRAME_OK:
+            self.logger.debug('Ooops, unsuccessful!')
+            if strict:
+                raise BUIagentUnsupported(payload.decode('UTF-8'))
+            return res
+        return loads(payload, mux.serializer)
+
+    def _unreachable(self, exp):
+        """Message of the error raised when the agent can't be reached"""
+        return 'Unable to reach agent {}:{}: {}'.format(
+            self.host,
+            self.port,
+            str(exp) or exp.__class__.__name__
+        )
+
+    def _encode(self, data, serializer='json'):
+        """Serialize a call. The arguments flagged as *pickled* are only
+        pickled when the serializer cannot handle them."""
+        if data.get('pickled'):
+            data = dict(data)
+            if serializer == 'json':
+                # TODO: secure the serialization
+                from base64 import b64encode
+                data['args'] = b64encode(pickle.dumps(data['args'], -1)).decode('ascii')
+            else:
+                del data['pickled']
+        return dumps(data, serializer)
+
+    def call(self, data, strict=False):
+        """Send a command to the remote agent and return its decoded answer
+
+        :param data: The call
+        :type data: dict
+
+        :param strict: Raise an error instead of returning an empty result
+                       when the agent does not know the call
+                       (:class:`burpui.exceptions.BUIagentUnsupported`) or
+                       can't be reached
+                       (:class:`burpui.exceptions.BUIserverException`)
+        :type strict: bool
+        """
+        # the restorations keep their own connection because of the size of
+        # the archives
+        if data['func'] not in ['restore_files', 'restore_files_stream']:
+            res = self._mux_command(data, strict=strict)
+            if res is not None:
+                return res
+        return json.loads(self.do_command(data, strict=strict))
+
+    def do_command(self, data=None, restarted=False, strict=False):
         """Send a command to the remote agent"""
         self.conn()
         res = '[]'
         toclose = False
-        if not data or not self.connected:
+        failure = None
+        if not data:
+            return res
+        if not self.connected:
+            if strict:
+                raise BUIserverException(self._unreachable(socket.error('not connected')))
             return res
         try:
             data['password'] = self.password
-            if data['func'] == 'restore_files':
+            if data['func'] in ['restore_files', 'restore_files_stream']:
                 self.close()
                 self.conn(True)
-            raw = json.dumps(data)
-            length = len(raw)
-            self.sock.sendall(struct.pack('!Q', length))
-            self.sock.sendall(raw.encode('UTF-8'))
+            raw = self._encode(data)
+            self.sock.sendall(LENGTH.pack(len(raw)))
+            self.sock.sendall(raw)
             self.logger.debug("Sending: %s", raw)
-            tmp = self.sock.recv(2).decode('UTF-8')
+            tmp = (self.recvall(2) or b'').decode('UTF-8')
             self.logger.debug("recv: '%s'", tmp)
+            if self.ssl:
+                self._save_session(self.sock)
             if 'ER' == tmp:
-                lengthbuf = self.sock.recv(8)
-                length, = struct.unpack('!Q', lengthbuf)
-                err = self.recvall(length).decode('UTF-8')
+                err = read_message(self.sock).decode('UTF-8')
                 raise BUIserverException(err)
+            if 'BY' == tmp:
+                err = read_message(self.sock).decode('UTF-8')
+                raise BUIagentBusy(err)
             if 'OK' != tmp:
                 self.logger.debug('Ooops, unsuccessful!')
+                if strict and 'KO' == tmp:
+                    raise BUIagentUnsupported('Unknown method {}'.format(data['func']))
+                if strict:
+                    raise BUIserverException(self._unreachable(socket.error('connection lost')))
                 return res
             self.logger.debug("Data sent successfully")
             tmp = 'OK'
-            if data['func'] == 'restore_files':
-                tmp = self.sock.recv(2)
-            lengthbuf = self.sock.recv(8)
-            length, = struct.unpack('!Q', lengthbuf)
-            if data['func'] == 'restore_files':
+            if data['func'] in ['restore_files', 'restore_files_stream']:
+                tmp = (self.recvall(2) or b'').decode('UTF-8')
+            if data['func'] == 'restore_files_stream' and tmp == 'OK':
+                # the archive follows by chunks, the caller will read them
+                res = (self.sock, None, None)
+                self.connected = False
+                return res
+            length, = LENGTH.unpack_from(self.recvall(LENGTH.size))
+            if data['func'] in ['restore_files', 'restore_files_stream']:
                 err = None
                 if tmp == 'KO':
                     err = self.recvall(length).decode('UTF-8')
@@ -356,9 +666,10 @@ class NClient(BUIbackend):
         except BUIserverException as e:
             raise e
         except IOError as e:
+            failure = e
             if not restarted and e.errno == errno.EPIPE:
                 self.connected = False
-                return self.do_command(data, True)
+                return self.do_command(data, True, strict)
             elif e.errno == errno.ECONNRESET:
                 self.connected = False
                 self.logger.error('!!! {} !!!\nPlease check your SSL configuration on both sides!'.format(str(e)))
@@ -366,52 +677,221 @@ class NClient(BUIbackend):
                 toclose = True
                 self.logger.error('!!! {} !!!\n{}'.format(str(e), traceback.format_exc()))
         except socket.timeout as e:
+            failure = e
             if self.app.gunicorn and not restarted:
                 self.connected = False
-                return self.do_command(data, True)
+                return self.do_command(data, True, strict)
             toclose = True
             self.logger.error('!!! {} !!!\n{}'.format(str(e), traceback.format_exc()))
         except Exception as e:
+            failure = e
             toclose = True
             self.logger.error('!!! {} !!!\n{}'.format(str(e), traceback.format_exc()))
         finally:
             self.close(toclose)
 
+        if strict and failure is not None:
+            raise BUIserverException(self._unreachable(failure))
         return res
 
-    def recvall(self, length=1024):
+    def recvall(self, length=1024, sock=None):
         """Read the answer of the agent"""
-        buf = b''
-        bsize = 1024
-        received = 0
-        if length < bsize:
-            bsize = length
-        while received < length:
-            newbuf = self.sock.recv(bsize)
-            if not newbuf:
-                return None
-            buf += newbuf
-            received += len(newbuf)
-        return buf
+        return recvall(sock or self.sock, length)
 
     """
     Utilities functions
     """
 
+    @implement
+    def restore_files_stream(self, name=None, backup=None, files=None, strip=None, archive='zip', password=None, agent=None):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.restore_files_stream`"""
+        args = {
+            'name': name,
+            'backup': backup,
+            'files': files,
+            'strip': strip,
+            'archive': archive,
+            'password': password
+        }
+        res = self.do_command({'func': 'restore_files_stream', 'args': args})
+        if not isinstance(res, tuple):
+            # the agent does not know how to stream the archive
+            self.logger.debug('Falling back to restore_files')
+            res = self.do_command({'func': 'restore_files', 'args': args})
+            if not isinstance(res, tuple):
+                return None, 'Unable to contact the agent'
+        sock, length, err = res
+        if err:
+            sock.sendall(struct.pack('!Q', 2))
+            sock.sendall(b'RE')
+            sock.close()
+            return None, err
+
+        def _stream():
+            try:
+                if length is not None:
+                    # old fashion: the whole archive follows
+                    received = 0
+                    while received < length:
+                        buf = sock.recv(min(RELAY_SIZE, length - received))
+                        if not buf:
+                            raise BUIserverException('Connection lost with the agent')
+                        received += len(buf)
+                        yield buf
+                    sock.sendall(struct.pack('!Q', 2))
+                    sock.sendall(b'RE')
+                    return
+                # the archive comes by chunks and ends with an empty one or
+                # with an error
+                while True:
+                    try:
+                        buf = read_chunk(sock)
+                    except (socket.error, IOError) as exp:
+                        raise BUIserverException('Agent {}:{}: {}'.format(self.host, self.port, str(exp)))
+                    if not buf:
+                        break
+                    yield bytes(buf)
+            finally:
+                sock.close()
+
+        return _stream(), None
+
     @implement
     def store_conf_cli(self, data, client=None, conf=None, agent=None):
         """See :func:`burpui.misc.backend.interface.BUIbackend.store_conf_cli`"""
-        # serialize data as it is a nested dict
-        # TODO: secure the serialization
-        from base64 import b64encode
-        data = {'func': 'store_conf_cli', 'args': b64encode(pickle.dumps({'data': data, 'conf': conf, 'client': client}, -1)), 'pickled': True}
-        return json.loads(self.do_command(data))
+        # data is a form, it is pickled unless the serializer supports it
+        data = {'func': 'store_conf_cli', 'args': {'data': data, 'conf': conf, 'client': client}, 'pickled': True}
+        return self.call(data)
 
     @implement
     def store_conf_srv(self, data, conf=None, agent=None):
         """See :func:`burpui.misc.backend.interface.BUIbackend.store_conf_srv`"""
-        # serialize data as it is a nested dict
-        # TODO: secure the serialization
-        from base64 import b64encode
-        data = {'func': 'store_conf_srv', 'args': b64encode(pickle.dumps({'data': data, 'conf': conf}, -1)), 'pickled': True}
-        return json.loads(self.do_command(data))
+        # data is a form, it is pickled unless the serializer supports it
+        data = {'func': 'store_conf_srv', 'args': {'data': data, 'conf': conf}, 'pickled': True}
+        return self.call(data)
+
+    def _live(self):
+        """Returns the live view of the agent if it is up to date. The
+        subscription to the events of the agent is started on first use.
+
+        :returns: A :class:`burpui.misc.backend.utils.LiveView` or None
+        """
+        if not self.events:
+            return None
+        if not self.listener:
+            with self.muxlock:
+                if not self.listener:
+                    self.listener = threading.Thread(
+                        target=self._listen,
+                        name='burp-ui-events'
+                    )
+                    self.listener.daemon = True
+                    self.listener.start()
+        if self.view.fresh():
+            return self.view
+        return None
+
+    def _listen(self):
+        """Keeps a subscription to the events of the agent and feeds the live
+        view with them"""
+        data = {'func': 'subscribe', 'args': {}}
+        while True:
+            delay = G_EVENTSRETRY
+            try:
+                mux = self._get_mux()
+                if mux:
+                    serializer = mux.serializer
+
+                    def _event(payload):
+                        try:
+                            self.view.apply(loads(payload, serializer))
+                        except Exception as exp:
+                            self.logger.error('Invalid event from %s:%s: %s', self.host, self.port, str(exp))
+
+                    kind, payload = mux.call(self._encode(data, serializer), self.timeout, _event)
+                    if kind == FRAME_OK:
+                        # the first snapshot may already be there, the view
+                        # was emptied when the previous subscription ended
+                        self.view.set_interval(loads(payload, serializer).get('interval'))
+                        self.logger.info('Subscribed to the events of %s:%s', self.host, self.port)
+                        # the events flow until the connection is lost
+                        mux.reader.join()
+                    else:
+                        self.logger.info('Agent %s:%s does not push events', self.host, self.port)
+                        delay = G_MUXRETRY
+                else:
+                    delay = G_MUXRETRY
+            except Exception as exp:
+                self.logger.warning('Unable to subscribe to the events of %s:%s: %s', self.host, self.port, str(exp))
+            self.view.reset()
+            time.sleep(delay)
+
+    @implement
+    def is_one_backup_running(self, agent=None):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.is_one_backup_running`"""
+        view = self._live()
+        if view:
+            return view.is_one_backup_running()
+        return self.call({'func': 'is_one_backup_running', 'args': {'agent': agent}})
+
+    @implement
+    def is_backup_running(self, name=None, agent=None):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.is_backup_running`"""
+        view = self._live()
+        if view:
+            return view.is_backup_running(name)
+        return self.call({'func': 'is_backup_running', 'args': {'name': name, 'agent': agent}})
+
+    @implement
+    def get_counters(self, name=None, agent=None):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.get_counters`"""
+        view = self._live()
+        if view:
+            return view.get_counters(name)
+        return self.call({'func': 'get_counters', 'args': {'name': name, 'agent': agent}})
+
+    @implement
+    def get_all_clients(self, agent=None):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.get_all_clients`"""
+        view = self._live()
+        if view:
+            return view.get_all_clients()
+        return self.call({'func': 'get_all_clients', 'args': {'agent': agent}})
+
+    @implement
+    def get_client_report(self, name=None, agent=None):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.get_client_report`
+
+        Raises :class:`burpui.exceptions.BUIagentUnsupported` if the agent is
+        too old to know this call.
+        """
+        return self.call({'func': 'get_client_report', 'args': {'name': name}}, strict=True)
+
+    @implement
+    def multi_call(self, calls, agent=None):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.multi_call`"""
+        calls = [[func, args] for func, args in calls]
+        if not calls:
+            return []
+        if not self.nobatch or time.time() - self.nobatch >= G_MUXRETRY:
+            try:
+                res = self.call({'func': 'multi_call', 'args': {'calls': calls}}, strict=True)
+                self.nobatch = 0
+                if isinstance(res, list) and len(res) == len(calls):
+                    return res
+                err = 'Unexpected answer from agent {}:{}'.format(self.host, self.port)
+                return [{'result': None, 'error': err} for _ in calls]
+            except BUIagentUnsupported:
+                # the agent does not know how to batch the calls
+                self.logger.debug('Agent %s:%s does not support multi_call', self.host, self.port)
+                self.nobatch = time.time()
+            except BUIserverException as exp:
+                # the agent can't be reached, the calls would fail the same way
+                return [{'result': None, 'error': str(exp)} for _ in calls]
+        ret = []
+        for func, args in calls:
+            try:
+                ret.append({'result': self.call({'func': func, 'args': args}, strict=True), 'error': None})
+            except BUIserverException as exp:
+                ret.append({'result': None, 'error': str(exp)})
+        return ret
@@ -0,0 +1,1012 @@
+# -*- coding: utf8 -*-
+"""
+.. module:: burpui.misc.backend.utils
+    :platform: Unix
+    :synopsis: Burp-UI backend utils module.
+
+.. moduleauthor:: Ziirish <hi+burpui@ziirish.me>
+
+"""
+import os
+import re
+import copy
+import json
+import time
+import struct
+import logging
+import sqlite3
+import threading
+
+from collections import OrderedDict
+from threading import Lock
+
+from .interface import BUIbackend
+from ...exceptions import BUIserverException
+
+G_CHUNK = 65536
+G_BACKOFF = 1
+G_MAXBACKOFF = 60
+G_CACHECHECK = 5
+
+# WIN32_STREAM_ID: stream id, attributes, size and name size
+VSS_HEADER = struct.Struct('<2LQL')
+# from BACKUP_DATA to BACKUP_TXFS_DATA
+VSS_STREAMS = range(1, 11)
+
+
+# states of the clients that are not running a backup
+IDLE_STATES = ('idle', 'client crashed', 'server crashed')
+
+
+def is_running(state):
+    """Tells if a client is running a backup, that is it is in any other
+    state than idle or crashed (see :attr:`burpui.misc.backend.burp1.Burp.states`)
+
+    :param state: Human readable state of the client
+    :type state: str
+    """
+    return bool(state) and state not in IDLE_STATES
+
+
+def has_vss_headers(path):
+    """Tells if a restored file embeds the VSS headers of a Windows backup
+    by looking at its first stream header instead of running ``vss_strip -p``.
+
+    :param path: Path of the file to check
+    :type path: str
+
+    :returns: True if the file starts with a VSS stream header
+    """
+    try:
+        with open(path, 'rb') as fileobj:
+            data = fileobj.read(VSS_HEADER.size)
+            fileobj.seek(0, 2)
+            size = fileobj.tell()
+    except (IOError, OSError):
+        return False
+    if len(data) < VSS_HEADER.size:
+        return False
+    stream, attributes, length, namesize = VSS_HEADER.unpack(data)
+    return (stream in VSS_STREAMS and attributes <= 0xf and
+            namesize % 2 == 0 and
+            VSS_HEADER.size + namesize + length <= size)
+
+
+def restore_regex(files):
+    """Builds the regex given to ``burp -a r`` out of a files selection.
+    The selection is normalized so the same files always give the same regex
+    whatever the order they were selected in.
+
+    :param files: A string representing a list of files to restore
+    :type files: str
+
+    :returns: The regex or None if the selection is invalid
+    """
+    flist = json.loads(files)
+    if not isinstance(flist, dict) or 'restore' not in flist:
+        return None
+    regs = set()
+    for restore in flist['restore']:
+        if restore['folder'] and restore['key'] != '/':
+            regs.add(u'^' + re.escape(restore['key']) + u'/')
+        else:
+            regs.add(u'^' + re.escape(restore['key']) + u'$')
+    return u'|'.join(sorted(regs))
+
+
+class JSONFrameDecoder(object):
+    """The :class:`burpui.misc.backend.utils.JSONFrameDecoder` class splits
+    a stream of bytes into JSON documents.
+
+    Burp outputs one document per line once the pretty-print mode is turned
+    off, so each complete line is parsed exactly once. Multi-line documents
+    (pretty-printed ones, or garbage) fall back to a structural scanner that
+    resumes where it stopped instead of re-parsing the whole buffer every time
+    new data comes in.
+
+    :param skip: Callable receiving the raw bytes of a document and returning
+                 True if the document must be dropped without being parsed
+    :type skip: callable
+
+    :param chunk: Size of the reads
+    :type chunk: int
+    """
+    # characters that matter to find the end of a document
+    _STRUCT = re.compile(br'[{}\[\]"\\]')
+    _BLANK = re.compile(br'\s*')
+
+    def __init__(self, skip=None, chunk=G_CHUNK):
+        self.skip = skip
+        self.buf = bytearray()
+        self.chunk = bytearray(chunk)
+        self.view = memoryview(self.chunk)
+        self._reset()
+
+    def _reset(self):
+        self.pos = 0
+        self.depth = 0
+        self.string = False
+        self.multiline = False
+
+    def read(self, fileobj):
+        """Reads a chunk from the given raw file object into the buffer
+
+        :param fileobj: Unbuffered binary file object to read from
+        :type fileobj: file
+
+        :returns: The number of bytes read, 0 means EOF
+        """
+        size = fileobj.readinto(self.chunk)
+        if size:
+            self.buf += self.view[:size]
+        return size or 0
+
+    def feed(self, data):
+        """Appends some data to the buffer
+
+        :param data: Raw data
+        :type data: bytes
+        """
+        self.buf += data
+
+    def clear(self):
+        """Drops any pending data"""
+        del self.buf[:]
+        self._reset()
+
+    def __iter__(self):
+        """Yields every complete document available in the buffer. A document
+        is removed from the buffer before being yielded so iteration may be
+        stopped at any time.
+        """
+        while True:
+            jso = self._next()
+            if jso is None:
+                return
+            yield jso
+
+    @staticmethod
+    def _loads(raw):
+        try:
+            return json.loads(raw.decode('utf-8'))
+        except ValueError:
+            return None
+
+    def _pop(self, end):
+        """Extracts the first ``end`` bytes of the buffer"""
+        raw = self.buf[:end]
+        del self.buf[:end]
+        self._reset()
+        return raw
+
+    def _next(self):
+        """Returns the next complete document or None"""
+        while True:
+            if not self.multiline and not self.pos:
+                blank = self._BLANK.match(self.buf).end()
+                if blank:
+                    del self.buf[:blank]
+            if not self.buf:
+                return None
+            if self.multiline:
+                raw = self._scan()
+                if raw is None:
+                    return None
+            else:
+                end = self.buf.find(b'\n', self.pos)
+                if end == -1:
+                    self.pos = len(self.buf)
+                    return None
+                raw = self._pop(end + 1)
+                if self.skip and self.skip(raw):
+                    continue
+                # fast path: most of the time a line is a whole document
+                jso = self._loads(raw)
+                if jso is not None:
+                    return jso
+                if raw[:1] not in (b'{', b'['):
+                    # not json at all, burp may print some errors on stdout
+                    continue
+                # put the line back and look for the end of the document
+                self.buf[:0] = raw
+                self.multiline = True
+                raw = self._scan()
+                if raw is None:
+                    return None
+            if self.skip and self.skip(raw):
+                continue
+            jso = self._loads(raw)
+            if jso is not None:
+                return jso
+
+    def _scan(self):
+        """Structural scan of a document spanning several lines"""
+        buf = self.buf
+        pos = self.pos
+        while True:
+            match = self._STRUCT.search(buf, pos)
+            if not match:
+                self.pos = len(buf)
+                return None
+            idx = match.start()
+            char = buf[idx:idx + 1]
+            if self.string:
+                if char == b'\\':
+                    if idx + 1 >= len(buf):
+                        # the escaped character is not there yet
+                        self.pos = idx
+                        return None
+                    pos = idx + 2
+                    continue
+                if char == b'"':
+                    self.string = False
+                pos = idx + 1
+                continue
+            if char == b'"':
+                self.string = True
+            elif char in (b'{', b'['):
+                self.depth += 1
+            elif char in (b'}', b']'):
+                self.depth -= 1
+                if self.depth <= 0:
+                    return self._pop(idx + 1)
+            pos = idx + 1
+
+
+class BackupStatsStore(object):
+    """The :class:`burpui.misc.backend.utils.BackupStatsStore` class keeps
+    the parsed stats of completed backups in a SQLite database so they are
+    computed only once, even across restarts.
+
+    Entries are keyed by client name and backup number, the backup timestamp
+    is kept alongside to detect a number being reused. The database is only
+    created on first use.
+
+    :param path: Path of the database, the store is disabled if None
+    :type path: str
+
+    :param logger: Logger to use
+    :type logger: :class:`logging.Logger`
+    """
+    # bump this whenever the format of the stored stats changes
+    VERSION = 1
+
+    def __init__(self, path, logger=None):
+        self.path = path
+        self.logger = logger or logging.getLogger('burp-ui')
+        self.lock = Lock()
+        self.conn = None
+        # the database is only created when it is first needed
+        self.opened = not path
+
+    def _open(self):
+        """Opens the database, called with the lock held"""
+        self.opened = True
+        try:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=5,
+                isolation_level=None,
+                check_same_thread=False
+            )
+            conn.execute('BEGIN IMMEDIATE')
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != self.VERSION:
+                conn.execute('DROP TABLE IF EXISTS stats')
+                conn.execute(
+                    'CREATE TABLE stats ('
+                    'client TEXT NOT NULL, '
+                    'number INTEGER NOT NULL, '
+                    'timestamp INTEGER, '
+                    'data TEXT NOT NULL, '
+                    'PRIMARY KEY (client, number))'
+                )
+                conn.execute('PRAGMA user_version = {}'.format(self.VERSION))
+            conn.execute('COMMIT')
+            self.conn = conn
+        except sqlite3.Error as exp:
+            self.logger.warning(
+                'Unable to open the backup stats store {}: {}'.format(
+                    self.path,
+                    str(exp)
+                )
+            )
+
+    def _execute(self, query, args=()):
+        """Runs a query and returns the matching rows, or None on error"""
+        try:
+            with self.lock:
+                if not self.opened:
+                    self._open()
+                if not self.conn:
+                    return None
+                return self.conn.execute(query, args).fetchall()
+        except sqlite3.Error as exp:
+            self.logger.warning('Backup stats store error: {}'.format(str(exp)))
+            return None
+
+    def get(self, client, number, timestamp):
+        """Returns the stats of a backup or None if unknown or if the backup
+        number was reused since the stats were stored
+
+        :param client: Client name
+        :type client: str
+
+        :param number: Backup number
+        :type number: int
+
+        :param timestamp: Backup timestamp
+        :type timestamp: int
+        """
+        rows = self._execute(
+            'SELECT data, timestamp FROM stats WHERE client = ? AND number = ?',
+            (client, int(number))
+        )
+        if not rows or rows[0][1] != int(timestamp):
+            return None
+        return json.loads(rows[0][0])
+
+    def put(self, client, number, timestamp, data):
+        """Stores the stats of a backup
+
+        :param client: Client name
+        :type client: str
+
+        :param number: Backup number
+        :type number: int
+
+        :param timestamp: Backup timestamp
+        :type timestamp: int
+
+        :param data: Stats of the backup
+        :type data: dict
+        """
+        self._execute(
+            'INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?)',
+            (client, int(number), int(timestamp), json.dumps(data))
+        )
+
+    def prune(self, client, backups):
+        """Evicts the stats of the backups of a client that do not exist
+        anymore
+
+        :param client: Client name
+        :type client: str
+
+        :param backups: Current backups of the client as a number ->
+                        timestamp mapping
+        :type backups: dict
+        """
+        rows = self._execute(
+            'SELECT number, timestamp FROM stats WHERE client = ?',
+            (client,)
+        )
+        current = dict((int(num), int(ts)) for num, ts in backups.items())
+        for number, timestamp in rows or []:
+            if current.get(number) != timestamp:
+                self._execute(
+                    'DELETE FROM stats WHERE client = ? AND number = ?',
+                    (client, number)
+                )
+
+
+class ClientsSnapshot(object):
+    """The :class:`burpui.misc.backend.utils.ClientsSnapshot` class is a
+    read-only view of the state of every client at a given time.
+
+    :param clients: Clients as returned by the backend ``_get_clients_state``
+                    method, the optional ``labels`` key is moved aside
+    :type clients: list
+    """
+
+    def __init__(self, clients):
+        self.time = time.time()
+        self.clients = []
+        self.index = {}
+        self.labels = {}
+        self.running = set()
+        for cli in clients:
+            labels = cli.pop('labels', None)
+            if labels is not None:
+                self.labels[cli['name']] = labels
+            self.clients.append(cli)
+            self.index[cli['name']] = cli
+            if is_running(cli['state']):
+                self.running.add(cli['name'])
+
+
+class SnapshotCollector(object):
+    """The :class:`burpui.misc.backend.utils.SnapshotCollector` class
+    refreshes a :class:`burpui.misc.backend.utils.ClientsSnapshot` in the
+    background so read-only calls do not need to query burp.
+
+    :param backend: The backend to collect the clients state from
+    :type backend: :class:`burpui.misc.backend.interface.BUIbackend`
+
+    :param interval: Refresh interval in seconds, 0 disables the collector
+    :type interval: int
+    """
+
+    def __init__(self, backend, interval=0):
+        self.backend = backend
+        self.logger = backend.logger
+        self.interval = interval or 0
+        self.snapshot = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        """Starts the collector thread (a greenlet when gevent patched the
+        threading module)"""
+        if self.interval <= 0 or self.thread:
+            return
+        self.thread = threading.Thread(
+            target=self._run,
+            name='burp-ui-snapshot'
+        )
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stops the collector thread"""
+        self.stopped.set()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.refresh()
+            self.stopped.wait(self.interval)
+
+    def refresh(self):
+        """Takes a new snapshot"""
+        try:
+            self.snapshot = ClientsSnapshot(self.backend._get_clients_state())
+        except Exception as exp:
+            self.logger.warning(
+                'Unable to refresh the clients snapshot: {}'.format(str(exp))
+            )
+        return self.snapshot
+
+    def get(self):
+        """Returns the current snapshot, or None if the collector is disabled
+        or the snapshot is outdated"""
+        snap = self.snapshot
+        if not snap or time.time() - snap.time > 2 * self.interval:
+            return None
+        return snap
+
+
+class CircuitBreaker(object):
+    """The :class:`burpui.misc.backend.utils.CircuitBreaker` class makes the
+    calls to an unreachable burp server fail fast.
+
+    After a failure the circuit is *open*: every call immediately raises the
+    last error. Once the backoff delay is over the circuit is *half-open*: a
+    single call is allowed to probe the server, the others still fail fast.
+    The circuit is *closed* again when a call succeeds, otherwise the delay
+    is doubled.
+
+    It is meant to be used as a context manager around the calls to burp.
+    Only the connection errors and the timeouts raised by burp count as
+    failures, any other error means burp answered.
+
+    :param logger: Logger to use
+    :type logger: :class:`logging.Logger`
+
+    :param backoff: Initial delay in seconds
+    :type backoff: int
+
+    :param maxbackoff: Maximum delay in seconds
+    :type maxbackoff: int
+
+    :param errors: Exception types counting as failures
+    :type errors: tuple
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, logger=None, backoff=G_BACKOFF, maxbackoff=G_MAXBACKOFF, errors=(IOError, OSError)):
+        self.logger = logger or logging.getLogger('burp-ui')
+        self.backoff = backoff
+        self.maxbackoff = maxbackoff
+        self.errors = errors
+        self.lock = Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.retry = 0
+        self.error = None
+
+    def __enter__(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return self
+            if self.state == self.OPEN and time.time() >= self.retry:
+                # let this call probe the server
+                self.state = self.HALF_OPEN
+                return self
+        raise BUIserverException(self.error)
+
+    def __exit__(self, typ, value, traceback):
+        if typ is not None and issubclass(typ, self.errors):
+            self.failure(str(value))
+        else:
+            self.success()
+        return False
+
+    def success(self):
+        """Closes the circuit"""
+        if self.state == self.CLOSED and not self.failures:
+            return
+        with self.lock:
+            if self.state != self.CLOSED:
+                self.logger.info('burp server is back, closing the circuit')
+            self.state = self.CLOSED
+            self.failures = 0
+            self.error = None
+
+    def failure(self, error):
+        """Opens the circuit
+
+        :param error: The error message returned while the circuit is open
+        :type error: str
+        """
+        with self.lock:
+            self.error = error
+            if self.state == self.OPEN:
+                return
+            delay = min(self.backoff * 2 ** self.failures, self.maxbackoff)
+            self.failures += 1
+            self.state = self.OPEN
+            self.retry = time.time() + delay
+            self.logger.warning(
+                'opening the circuit for {}s: {}'.format(delay, error)
+            )
+
+    def get_state(self):
+        """Returns the state of the circuit as a dict"""
+        retry = 0
+        if self.state != self.CLOSED:
+            retry = max(0, int(round(self.retry - time.time())))
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'retry': retry,
+            'error': self.error,
+        }
+
+
+class SingleFlight(object):
+    """The :class:`burpui.misc.backend.utils.SingleFlight` class coalesces
+    identical concurrent calls: while a call is in flight, the callers asking
+    for the same key wait for its result instead of issuing the call again.
+
+    Every caller gets its own copy of a shared or cached result so it can
+    modify it freely.
+
+    :param ttl: How long to keep the results in seconds, 0 disables the cache
+    :type ttl: float
+    """
+
+    class _Call(object):
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+            self.waiters = 0
+
+    def __init__(self, ttl=0):
+        self.ttl = ttl or 0
+        self.lock = Lock()
+        self.calls = {}
+        self.results = {}
+
+    def do(self, key, func, *args, **kwargs):
+        """Calls ``func`` unless a call with the same key is already in flight
+        or its result is still cached
+
+        :param key: Key identifying the call
+        :type key: str
+
+        :param func: Function to call
+        :type func: callable
+
+        :returns: The result of the call
+        """
+        with self.lock:
+            if self.ttl:
+                cached = self.results.get(key)
+                if cached and cached[0] > time.time():
+                    return copy.deepcopy(cached[1])
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = self._Call()
+            else:
+                call.waiters += 1
+        if not leader:
+            call.event.wait()
+            if call.error:
+                raise call.error
+            return copy.deepcopy(call.result)
+        try:
+            result = func(*args, **kwargs)
+        except Exception as exp:
+            call.error = exp
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+                if not call.error and (call.waiters or self.ttl):
+                    # the leader may modify its result while the others
+                    # copy it
+                    call.result = copy.deepcopy(result)
+                    if self.ttl:
+                        self._cache(key, call.result)
+            call.event.set()
+        return result
+
+    def _cache(self, key, result):
+        now = time.time()
+        for old in [x for x, y in self.results.items() if y[0] <= now]:
+            del self.results[old]
+        self.results[key] = (now + self.ttl, result)
+
+
+def run_calls(target, calls, logger=None):
+    """Runs several calls of the backend interface and collects their results
+    (see :func:`burpui.misc.backend.interface.BUIbackend.multi_call`)
+
+    :param target: The object answering the calls
+    :type target: :class:`burpui.misc.backend.interface.BUIbackend`
+
+    :param calls: List of (method name, keyword arguments) pairs
+    :type calls: list
+
+    :param logger: Logger to use
+    :type logger: :class:`logging.Logger`
+
+    :returns: A list of dict with the ``result`` or the ``error`` of each call
+    """
+    logger = logger or logging.getLogger('burp-ui')
+    ret = []
+    for func, args in calls:
+        proto = getattr(BUIbackend, func, None)
+        try:
+            # only the methods of the interface can be called
+            if (not getattr(proto, '__isabstractmethod__', False) or
+                    func in ['multi_call', 'restore_files', 'restore_files_stream']):
+                raise BUIserverException('Wrong method call: {}'.format(func))
+            ret.append({'result': getattr(target, func)(**(args or {})), 'error': None})
+        except BUIserverException as exp:
+            ret.append({'result': None, 'error': str(exp)})
+        except Exception as exp:
+            logger.error('{}: {}'.format(func, exp))
+            ret.append({'result': None, 'error': str(exp)})
+    return ret
+
+
+class ReadCache(object):
+    """The :class:`burpui.misc.backend.utils.ReadCache` class keeps the
+    results of the read-only calls of a backend. The entries of a client are
+    dropped as soon as its last backup or its state changes, so nothing is
+    cached while a backup is running. The labels of a client are also
+    dropped when its configuration file is modified.
+
+    The entries are copies of the results and every hit returns a new copy
+    of its entry, so altering an answer never leaks into the next ones.
+
+    :param backend: The backend answering the calls
+    :type backend: :class:`burpui.misc.backend.interface.BUIbackend`
+
+    :param size: Maximum number of entries, 0 disables the cache
+    :type size: int
+
+    :param check: How long to trust the clients state in seconds when the
+                  backend has no clients snapshot
+    :type check: float
+    """
+    # cached method: name of its client argument
+    methods = {
+        'get_client': 'name',
+        'get_client_report': 'name',
+        'get_tree': 'name',
+        'get_backup_logs': 'client',
+        'get_client_labels': 'client',
+    }
+    # methods changing what the cached ones return
+    writes = ['store_conf_srv', 'store_conf_cli', 'delete_client']
+
+    def __init__(self, backend, size=0, check=G_CACHECHECK):
+        self.backend = backend
+        self.logger = getattr(backend, 'logger', None) or logging.getLogger('burp-ui')
+        self.size = size or 0
+        self.check = check or 0
+        self.lock = Lock()
+        self.entries = OrderedDict()
+        self.states = {}
+        self.checked = 0
+        self.hits = 0
+        self.misses = 0
+
+    def wrap(self, method, func):
+        """Returns a version of ``func`` going through the cache
+
+        :param method: Name of the backend method
+        :type method: str
+
+        :param func: The backend method
+        :type func: callable
+
+        :returns: A callable
+        """
+        if not self.size:
+            return func
+        if method in self.writes:
+            def _write(*args, **kwargs):
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.clear()
+            return _write
+        if method not in self.methods:
+            return func
+
+        def _read(*args, **kwargs):
+            return self.call(method, func, *args, **kwargs)
+        return _read
+
+    def call(self, method, func, *args, **kwargs):
+        """Returns the cached result of the call if the state of its client
+        did not change, calls ``func`` otherwise
+
+        :param method: Name of the backend method
+        :type method: str
+
+        :param func: The backend method
+        :type func: callable
+
+        :returns: The result of the call
+        """
+        client = kwargs.get(self.methods[method])
+        # the agent always sends keyword arguments
+        if args or not client:
+            return func(*args, **kwargs)
+        version = self._version(client)
+        if version is None:
+            return func(**kwargs)
+        if method == 'get_client_labels':
+            # the labels are set in the configuration of the client
+            version += (self._conf_mtime(client),)
+        key = (method, repr(sorted(kwargs.items())))
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached and cached[0] == version:
+                self.entries[key] = self.entries.pop(key)
+                self.hits += 1
+                return copy.deepcopy(cached[1])
+            self.misses += 1
+        res = func(**kwargs)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (version, copy.deepcopy(res))
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return res
+
+    def clear(self):
+        """Drops every entry"""
+        with self.lock:
+            self.entries.clear()
+            self.checked = 0
+
+    def _version(self, client):
+        """Returns what identifies the current data of a client or None if
+        its results must not be cached"""
+        cli = self._states().get(client)
+        if not cli or is_running(cli.get('state')):
+            return None
+        return (cli.get('last'), cli.get('state'))
+
+    def _conf_mtime(self, client):
+        """Returns the modification time of the configuration file of a
+        client or None if it cannot be found"""
+        parser = getattr(self.backend, 'parser', None)
+        confdir = getattr(parser, 'clientconfdir', None)
+        if not confdir:
+            return None
+        try:
+            return os.path.getmtime(os.path.join(confdir, client))
+        except OSError:
+            return None
+
+    def _states(self):
+        collector = getattr(self.backend, 'collector', None)
+        snap = collector.get() if collector else None
+        if snap:
+            return snap.index
+        now = time.time()
+        if now - self.checked >= self.check:
+            try:
+                clients = self.backend._get_clients_state()
+                self.states = dict((x['name'], x) for x in clients)
+            except Exception as exp:
+                self.logger.warning(
+                    'Unable to check the clients state: {}'.format(str(exp))
+                )
+                self.states = {}
+            self.checked = time.time()
+        return self.states
+
+
+def client_events(old, new):
+    """Lists the state transitions of the clients between two views
+
+    :param old: Previous state of the clients, indexed by name
+    :type old: dict
+
+    :param new: Current state of the clients, indexed by name
+    :type new: dict
+
+    :returns: A list of events, each one is a dict with the ``event`` name
+              (``added``, ``removed``, ``started``, ``phase``, ``finished``,
+              ``crashed`` or ``state``) and the current state of the
+              ``client``
+    """
+    events = []
+    for name, cli in new.items():
+        prev = old.get(name)
+        event = None
+        if not prev:
+            event = 'added'
+        elif is_running(cli['state']):
+            if not is_running(prev['state']):
+                event = 'started'
+            elif cli.get('phase') != prev.get('phase'):
+                event = 'phase'
+        elif 'crashed' in cli['state'] and cli['state'] != prev['state']:
+            event = 'crashed'
+        elif is_running(prev['state']) or cli.get('last') != prev.get('last'):
+            # a short backup may start and finish between two checks
+            event = 'finished'
+        elif cli['state'] != prev['state']:
+            event = 'state'
+        if event:
+            events.append({'event': event, 'client': cli})
+    for name in old:
+        if name not in new:
+            events.append({'event': 'removed', 'client': {'name': name}})
+    return events
+
+
+def counter_events(old, new):
+    """Lists the counters of the running backups that changed between two
+    views
+
+    :param old: Previous counters, indexed by client name
+    :type old: dict
+
+    :param new: Current counters, indexed by client name
+    :type new: dict
+
+    :returns: A list of ``counters`` events holding only the values that
+              changed
+    """
+    events = []
+    for name, counters in new.items():
+        prev = old.get(name, {})
+        delta = dict(
+            (key, val) for key, val in counters.items() if prev.get(key) != val
+        )
+        if delta:
+            events.append({
+                'event': 'counters',
+                'client': {'name': name},
+                'counters': delta
+            })
+    return events
+
+
+class LiveView(object):
+    """The :class:`burpui.misc.backend.utils.LiveView` class keeps the state
+    of the clients of an agent up to date with the events the agent pushes,
+    so the live calls do not need to poll it.
+
+    The view is only trusted while the agent keeps sending its messages.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self, interval=0):
+        """Forgets everything until the next snapshot
+
+        :param interval: How often the agent sends its messages in seconds
+        :type interval: float
+        """
+        with self.lock:
+            self.interval = interval or 0
+            self.clients = {}
+            self.counters = {}
+            self.updated = 0
+
+    def set_interval(self, interval):
+        """Sets how often the agent sends its messages, keeping what the view
+        already received
+
+        :param interval: How often the agent sends its messages in seconds
+        :type interval: float
+        """
+        with self.lock:
+            self.interval = interval or 0
+
+    def apply(self, msg):
+        """Updates the view with a message of the agent
+
+        :param msg: The decoded message: the optional ``clients`` and
+                    ``counters`` snapshots followed by the ``events`` since
+                    the previous message
+        :type msg: dict
+        """
+        with self.lock:
+            if 'clients' in msg:
+                self.clients = dict((x['name'], x) for x in msg['clients'])
+                self.counters = dict(msg.get('counters') or {})
+                self.updated = time.time()
+            # the events are meaningless without a snapshot
+            if not self.updated:
+                return
+            for event in msg.get('events') or []:
+                name = event['client']['name']
+                if event['event'] == 'removed':
+                    self.clients.pop(name, None)
+                    self.counters.pop(name, None)
+                elif event['event'] == 'counters':
+                    self.counters.setdefault(name, {}).update(event['counters'])
+                else:
+                    self.clients[name] = event['client']
+                    if event['event'] != 'phase':
+                        self.counters.pop(name, None)
+            self.updated = time.time()
+
+    def fresh(self):
+        """Tells if the view is up to date"""
+        return bool(
+            self.updated and self.interval and
+            time.time() - self.updated < 3 * self.interval
+        )
+
+    def is_one_backup_running(self):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.is_one_backup_running`"""
+        with self.lock:
+            return sorted(
+                x for x, y in self.clients.items() if is_running(y['state'])
+            )
+
+    def is_backup_running(self, name=None):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.is_backup_running`"""
+        with self.lock:
+            cli = self.clients.get(name)
+            return bool(cli and is_running(cli['state']))
+
+    def get_counters(self, name=None):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.get_counters`"""
+        with self.lock:
+            cli = self.clients.get(name)
+            if not cli or not is_running(cli['state']):
+                return {}
+            return dict(self.counters.get(name, {}))
+
+    def get_all_clients(self):
+        """See :func:`burpui.misc.backend.interface.BUIbackend.get_all_clients`"""
+        res = []
+        with self.lock:
+            for name in sorted(self.clients):
+                cli = dict(self.clients[name])
+                if is_running(cli['state']):
+                    cli['percent'] = self.counters.get(name, {}).get(
+                        'percent',
+                        cli.get('percent', 0)
+                    )
+                res.append(cli)
+        return res
@@ -0,0 +1,519 @@
+# -*- coding: utf8 -*-
+"""
+.. module:: burpui.misc.protocol
+    :platform: Unix
+    :synopsis: Burp-UI agent protocol module.
+
+.. moduleauthor:: Ziirish <hi+burpui@ziirish.me>
+
+The historical protocol serves one call per connection: the request is an
+8 bytes length followed by the JSON encoded call, the answer is a 2 bytes
+status (``OK``, ``ER``, ``KO`` or ``BY`` when the agent is too busy to
+accept the call) followed by the length and the data.
+
+A client may open a connection with a ``hello`` call. Agents that know the
+multiplexed protocol answer ``OK`` followed by their protocol version and
+the connection is then kept open: every frame starts with a request ID, a
+frame type and a length so many calls can be in-flight at the same time and
+their replies can come in any order. Older agents answer ``KO`` and the
+client keeps using one connection per call.
+
+The ``hello`` call also negotiates the compression of the frames: the client
+lists the codecs it supports, the agent picks the first one it knows and the
+frames bigger than :data:`COMPRESS_MIN` are compressed with it. The
+serialization of the calls and their results is negotiated the same way.
+
+Once a ``subscribe`` call succeeded, the agent keeps pushing the state of its
+clients in event frames carrying the request ID of the subscription.
+"""
+import zlib
+import json
+import errno
+import socket
+import struct
+import logging
+import threading
+
+from six import integer_types, text_type
+from werkzeug.datastructures import ImmutableMultiDict, MultiDict
+
+try:
+    import lz4.frame as lz4
+except ImportError:  # pragma: no cover
+    lz4 = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+MUX_VERSION = 2
+
+# request ID, frame type, payload length
+FRAME = struct.Struct('!IBQ')
+LENGTH = struct.Struct('!Q')
+
+# size of the buffers used to relay the restoration archives
+RELAY_SIZE = 1024 * 1024
+
+# length announcing an error message instead of a chunk of a streamed archive
+STREAM_ERROR = 0xffffffffffffffff
+
+# frame types
+FRAME_CALL = 1
+FRAME_OK = 2
+FRAME_ER = 3
+FRAME_KO = 4
+# the agent has no room left to queue the call
+FRAME_BY = 5
+# message pushed by the agent to a subscriber
+FRAME_EV = 6
+# flag of the frame type telling the payload is compressed
+COMPRESSED = 0x80
+
+# smaller payloads are not worth compressing
+COMPRESS_MIN = 4096
+
+# name: (compress, decompress)
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 1), zlib.decompress),
+}
+if lz4:
+    CODECS['lz4'] = (lz4.compress, lz4.decompress)
+
+
+# msgpack extension type of the forms
+EXT_MULTIDICT = 1
+
+
+def _msgpack_default(obj):
+    # the sub-classes of the builtin types land here because we pack with
+    # strict_types so the forms are not taken for plain dicts
+    if isinstance(obj, MultiDict):
+        return msgpack.ExtType(
+            EXT_MULTIDICT,
+            _msgpack_dumps([list(x) for x in obj.items(multi=True)])
+        )
+    if isinstance(obj, dict):
+        return dict(obj)
+    if isinstance(obj, (list, tuple)):
+        return list(obj)
+    for kind in (text_type, bytes, bool, float) + integer_types:
+        if isinstance(obj, kind):
+            return kind(obj)
+    raise TypeError('Unable to serialize {!r}'.format(obj))
+
+
+def _msgpack_ext(code, data):
+    if code == EXT_MULTIDICT:
+        return ImmutableMultiDict([tuple(x) for x in _msgpack_loads(data)])
+    return msgpack.ExtType(code, data)
+
+
+def _msgpack_dumps(obj):
+    return msgpack.packb(
+        obj,
+        use_bin_type=True,
+        strict_types=True,
+        default=_msgpack_default
+    )
+
+
+def _msgpack_loads(payload):
+    return msgpack.unpackb(
+        bytes(payload),
+        raw=False,
+        strict_map_key=False,
+        ext_hook=_msgpack_ext
+    )
+
+
+def _json_loads(payload):
+    return json.loads(bytes(payload).decode('UTF-8'))
+
+
+# name: (dumps, loads)
+SERIALIZERS = {
+    'json': (lambda obj: json.dumps(obj).encode('UTF-8'), _json_loads),
+}
+if msgpack and msgpack.version >= (1, 0):
+    SERIALIZERS['msgpack'] = (_msgpack_dumps, _msgpack_loads)
+
+
+def supported_serializers():
+    """Returns the available serializers, the most compact first"""
+    return [x for x in ['msgpack', 'json'] if x in SERIALIZERS]
+
+
+def choose_serializer(offered):
+    """Returns the first serializer of the list we support
+
+    :param offered: Serializers supported by the other side
+    :type offered: list
+
+    :returns: The name of the serializer, ``json`` by default
+    """
+    for serializer in offered or []:
+        if serializer in SERIALIZERS:
+            return serializer
+    return 'json'
+
+
+def dumps(obj, serializer='json'):
+    """Serializes a call or its result
+
+    :param obj: The object to serialize
+    :type obj: object
+
+    :param serializer: Serializer negotiated for the connection
+    :type serializer: str
+
+    :returns: The serialized object
+    """
+    return SERIALIZERS[serializer][0](obj)
+
+
+def loads(payload, serializer='json'):
+    """De-serializes a call or its result
+
+    :param payload: The serialized object
+    :type payload: bytes
+
+    :param serializer: Serializer negotiated for the connection
+    :type serializer: str
+
+    :returns: The object
+    """
+    return SERIALIZERS[serializer][1](payload)
+
+
+def supported_codecs():
+    """Returns the available compression codecs, the fastest first"""
+    return [x for x in ['lz4', 'zlib'] if x in CODECS]
+
+
+def choose_codec(offered):
+    """Returns the first codec of the list we support
+
+    :param offered: Codecs supported by the other side
+    :type offered: list
+
+    :returns: The name of the codec or None
+    """
+    for codec in offered or []:
+        if codec in CODECS:
+            return codec
+    return None
+
+
+def compress(kind, payload, codec=None):
+    """Compresses the payload of a frame when it is worth it
+
+    :param kind: Frame type
+    :type kind: int
+
+    :param payload: Content of the frame
+    :type payload: bytes
+
+    :param codec: Codec negotiated for the connection
+    :type codec: str
+
+    :returns: A tuple with the frame type and the payload
+    """
+    if codec and len(payload) >= COMPRESS_MIN:
+        packed = CODECS[codec][0](bytes(payload))
+        if len(packed) < len(payload):
+            return kind | COMPRESSED, packed
+    return kind, payload
+
+
+def decompress(kind, payload, codec=None):
+    """Inflates the payload of a frame if needed
+
+    :param kind: Frame type
+    :type kind: int
+
+    :param payload: Content of the frame
+    :type payload: bytes
+
+    :param codec: Codec negotiated for the connection
+    :type codec: str
+
+    :returns: A tuple with the frame type and the payload
+    """
+    if kind & COMPRESSED:
+        return kind & ~COMPRESSED, CODECS[codec][1](bytes(payload))
+    return kind, payload
+
+
+def recvall(sock, length):
+    """Reads exactly length bytes from a socket. The data is received straight
+    into a buffer allocated once for all.
+
+    :param sock: The socket to read from
+    :type sock: :class:`socket.socket`
+
+    :param length: Number of bytes to read
+    :type length: int
+
+    :returns: A :class:`bytearray` holding the data or None if the connection
+              was closed before
+
+    :raises: :class:`socket.timeout` if the socket has a timeout and the data
+             does not come in time
+    """
+    buf = bytearray(length)
+    view = memoryview(buf)
+    received = 0
+    while received < length:
+        try:
+            count = sock.recv_into(view[received:], length - received)
+        except socket.error as exp:
+            if exp.args and exp.args[0] == errno.EINTR:
+                continue
+            raise
+        if not count:
+            return None
+        received += count
+    return buf
+
+
+def read_message(sock):
+    """Reads a message prefixed by its 8 bytes length
+
+    :param sock: The socket to read from
+    :type sock: :class:`socket.socket`
+
+    :returns: A :class:`bytearray` holding the message or None if the
+              connection was closed before
+    """
+    header = recvall(sock, LENGTH.size)
+    if header is None:
+        return None
+    length, = LENGTH.unpack_from(header)
+    return recvall(sock, length)
+
+
+def pack_stream_error(message):
+    """Packs the error ending a streamed archive in place of its final empty
+    chunk
+
+    :param message: The error message
+    :type message: str
+    """
+    data = message.encode('UTF-8')
+    return LENGTH.pack(STREAM_ERROR) + LENGTH.pack(len(data)) + data
+
+
+def read_chunk(sock):
+    """Reads a chunk of a streamed archive
+
+    :param sock: The socket to read from
+    :type sock: :class:`socket.socket`
+
+    :returns: A :class:`bytearray` holding the chunk, an empty one marks the
+              end of the archive
+
+    :raises: :class:`IOError` if the connection was lost or the sender failed
+             to generate the archive
+    """
+    header = recvall(sock, LENGTH.size)
+    if header is None:
+        raise IOError('Connection lost')
+    length, = LENGTH.unpack_from(header)
+    if length == STREAM_ERROR:
+        message = read_message(sock)
+        raise IOError(
+            message.decode('UTF-8') if message is not None else 'Connection lost'
+        )
+    data = recvall(sock, length)
+    if data is None:
+        raise IOError('Connection lost')
+    return data
+
+
+def sendfile(sock, fileobj):
+    """Sends the content of a file. The copy is done by the kernel with the
+    sendfile system call when the socket supports it.
+
+    :param sock: The socket to write to
+    :type sock: :class:`socket.socket`
+
+    :param fileobj: The file to send, opened in binary mode
+    :type fileobj: file
+
+    :returns: The number of bytes sent
+    """
+    if hasattr(sock, 'sendfile'):
+        return sock.sendfile(fileobj)
+    sent = 0
+    buf = fileobj.read(RELAY_SIZE)
+    while buf:
+        sock.sendall(buf)
+        sent += len(buf)
+        buf = fileobj.read(RELAY_SIZE)
+    return sent
+
+
+def pack_frame(reqid, kind, payload=b''):
+    """Builds a frame of the multiplexed protocol
+
+    :param reqid: Request ID
+    :type reqid: int
+
+    :param kind: Frame type
+    :type kind: int
+
+    :param payload: Content of the frame
+    :type payload: bytes
+
+    :returns: The frame
+    """
+    return FRAME.pack(reqid, kind, len(payload)) + payload
+
+
+def read_frame(sock):
+    """Reads a frame of the multiplexed protocol
+
+    :param sock: The socket to read from
+    :type sock: :class:`socket.socket`
+
+    :returns: A tuple with the request ID, the frame type and the payload or
+              None if the connection was closed
+    """
+    header = recvall(sock, FRAME.size)
+    if not header:
+        return None
+    reqid, kind, length = FRAME.unpack_from(header)
+    payload = recvall(sock, length)
+    if payload is None:
+        return None
+    return reqid, kind, payload
+
+
+class MuxClient(object):
+    """Client side of a multiplexed connection to an agent.
+
+    A reader thread dispatches the replies to the callers waiting for them so
+    the connection can be shared by all the threads (or greenlets) of the
+    application.
+
+    :param sock: Connection to the agent, once the ``hello`` call succeeded
+    :type sock: :class:`socket.socket`
+
+    :param logger: Logger to use
+    :type logger: :class:`logging.Logger`
+
+    :param codec: Compression codec negotiated with the agent
+    :type codec: str
+
+    :param serializer: Serializer negotiated with the agent
+    :type serializer: str
+    """
+    def __init__(self, sock, logger=None, codec=None, serializer='json'):
+        self.sock = sock
+        self.codec = codec
+        self.serializer = serializer
+        self.logger = logger or logging.getLogger('burp-ui')
+        self.lock = threading.Lock()
+        self.wlock = threading.Lock()
+        self.pending = {}
+        self.listeners = {}
+        self.reqid = 0
+        self.closed = False
+        # timeouts are handled per call
+        self.sock.settimeout(None)
+        self.reader = threading.Thread(target=self._read)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def _read(self):
+        try:
+            while True:
+                frame = read_frame(self.sock)
+                if not frame:
+                    break
+                reqid, kind, payload = frame
+                kind, payload = decompress(kind, payload, self.codec)
+                if kind == FRAME_EV:
+                    listener = self.listeners.get(reqid)
+                    if listener:
+                        listener(payload)
+                    continue
+                with self.lock:
+                    waiter = self.pending.pop(reqid, None)
+                if not waiter:
+                    # the caller gave up
+                    continue
+                waiter[1] = (kind, payload)
+                waiter[0].set()
+        except Exception as exp:
+            if not self.closed:
+                self.logger.error('Connection lost with the agent: {}'.format(exp))
+        finally:
+            self.close()
+
+    def call(self, payload, timeout=None, listener=None):
+        """Sends a call and waits for its reply
+
+        :param payload: The encoded call
+        :type payload: bytes
+
+        :param timeout: How long to wait for the reply
+        :type timeout: float
+
+        :param listener: Function receiving the payload of the event frames
+                         pushed for this call until the connection is closed
+        :type listener: callable
+
+        :returns: A tuple with the frame type and the payload of the reply
+
+        :raises: :class:`socket.error` if the connection is lost and
+                 :class:`socket.timeout` if the reply does not come in time
+        """
+        waiter = [threading.Event(), None]
+        kind, payload = compress(FRAME_CALL, payload, self.codec)
+        with self.lock:
+            if self.closed:
+                raise socket.error('Connection closed')
+            self.reqid = (self.reqid + 1) & 0xffffffff
+            reqid = self.reqid
+            self.pending[reqid] = waiter
+            if listener:
+                self.listeners[reqid] = listener
+        try:
+            with self.wlock:
+                self.sock.sendall(pack_frame(reqid, kind, payload))
+        except Exception:
+            with self.lock:
+                self.pending.pop(reqid, None)
+                self.listeners.pop(reqid, None)
+            raise
+        if not waiter[0].wait(timeout):
+            with self.lock:
+                self.pending.pop(reqid, None)
+                self.listeners.pop(reqid, None)
+            raise socket.timeout('No reply from the agent')
+        if waiter[1] is None:
+            raise socket.error('Connection lost')
+        if listener and waiter[1][0] != FRAME_OK:
+            with self.lock:
+                self.listeners.pop(reqid, None)
+        return waiter[1]
+
+    def close(self):
+        """Closes the connection and wakes up the pending callers"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            pending = list(self.pending.values())
+            self.pending.clear()
+            self.listeners.clear()
+        for waiter in pending:
+            waiter[0].set()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        self.sock.close()
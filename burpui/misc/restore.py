@@ -0,0 +1,643 @@
+# -*- coding: utf8 -*-
+"""
+.. module:: burpui.misc.restore
+    :platform: Unix
+    :synopsis: Burp-UI background restorations module.
+
+.. moduleauthor:: Ziirish <hi+burpui@ziirish.me>
+
+"""
+import os
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+from .backend.utils import restore_regex
+from ..exceptions import BUIserverException
+
+G_RESTOREJOBS = 2
+G_RESTOREUSERJOBS = 1
+G_RESTORETMPDIR = u''
+G_RESTORETTL = 3600
+G_RESTORECACHETTL = 3600
+G_RESTORECACHESIZE = 0
+
+# how often (in seconds) the state of a running job is written on disk
+G_RESTOREREFRESH = 1
+# how often (in seconds) the process running a job tells it is still alive
+G_RESTOREBEAT = 10
+# a pending job whose process did not tell it is alive for this long (in
+# seconds) is considered interrupted
+G_RESTORESTALE = 10 * G_RESTOREBEAT
+
+
+def default_spool():
+    """Returns the spool directory used when none is configured"""
+    return os.path.join(tempfile.gettempdir(), 'burpui-restore')
+
+
+def _mkdir(path):
+    """Creates a directory, and its missing parents, only readable by the
+    current user whatever the umask"""
+    if os.path.isdir(path):
+        return
+    parent = os.path.dirname(path)
+    if parent and not os.path.isdir(parent):
+        _mkdir(parent)
+    os.mkdir(path, 0o700)
+    os.chmod(path, 0o700)
+
+
+def backup_timestamp(backend, name, backup, server=None):
+    """Returns the timestamp of a backup
+
+    :param backend: Backend to ask
+    :type backend: :class:`burpui.misc.backend.interface.BUIbackend`
+
+    :param name: Client name
+    :type name: str
+
+    :param backup: Backup number
+    :type backup: int
+
+    :param server: What server to ask (only in multi-agent mode)
+    :type server: str
+
+    :returns: The timestamp or None if the backup cannot be found
+    """
+    try:
+        backups = backend.get_client(name, agent=server) or []
+    except BUIserverException:
+        return None
+    for bkp in backups:
+        if int(bkp['number']) == int(backup):
+            return bkp['date']
+    return None
+
+
+def _link(src, dst):
+    """Hard links a file, or copies it if the filesystem does not allow it"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class RestoreCache(object):
+    """The :class:`burpui.misc.restore.RestoreCache` class keeps the archives
+    generated by the online restorations so repeated downloads of the same
+    files do not run the whole restoration again.
+
+    The archives are identified by the client, the backup and its timestamp,
+    the regex of the selected files, the strip level and the archive format.
+    The timestamp makes sure a backup deleted then created again with the
+    same number does not reuse the archives of the former one. Backups never
+    change once they are completed so the archives stay valid until they
+    expire or the disk quota forces to evict the least recently used ones.
+    Restorations of encrypted backups must never be cached.
+
+    The cache is disabled unless a disk quota is configured.
+
+    :param directory: Where to store the archives
+    :type directory: str
+
+    :param ttl: Time in seconds the archives are kept
+    :type ttl: int
+
+    :param size: Disk quota of the cache in MB (0 disables the cache)
+    :type size: int
+    """
+    logger = logging.getLogger('burp-ui')
+
+    def __init__(self, directory, ttl=G_RESTORECACHETTL, size=G_RESTORECACHESIZE):
+        self.directory = directory
+        self.ttl = ttl
+        self.size = (size or 0) * 1024 * 1024
+        if self.size:
+            _mkdir(self.directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, '{}.archive'.format(key))
+
+    def key(self, name, backup, files, strip=0, archive='zip', server=None,
+            timestamp=None):
+        """Computes the key of a restoration
+
+        :param timestamp: Timestamp of the backup, see
+                          :func:`burpui.misc.restore.backup_timestamp`
+        :type timestamp: int
+
+        :returns: The key or None if the restoration cannot be cached
+        """
+        if not self.size or timestamp is None:
+            return None
+        try:
+            regex = restore_regex(files)
+        except (ValueError, TypeError, KeyError):
+            return None
+        if regex is None:
+            return None
+        data = json.dumps([server, name, int(backup), int(timestamp), regex,
+                           int(strip or 0), archive])
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns the path of a cached archive
+
+        :param key: Key of the restoration
+        :type key: str
+
+        :returns: The path of the archive or None if it is not cached
+        """
+        if not key:
+            return None
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            if stat.st_mtime + self.ttl < time.time():
+                os.remove(path)
+                return None
+            # the access time tracks the usage of the archive for the LRU
+            os.utime(path, (time.time(), stat.st_mtime))
+        except OSError:
+            return None
+        return path
+
+    def add(self, key, path):
+        """Adds an existing archive to the cache
+
+        :param key: Key of the restoration
+        :type key: str
+
+        :param path: Path of the archive
+        :type path: str
+        """
+        if not key or os.path.getsize(path) > self.size:
+            return
+        tmp = '{}.{}.part'.format(self._path(key), uuid.uuid4().hex)
+        _link(path, tmp)
+        os.rename(tmp, self._path(key))
+        self.evict()
+
+    def store(self, key, stream):
+        """Copies an archive in the cache while it is being sent
+
+        :param key: Key of the restoration
+        :type key: str
+
+        :param stream: Generator of the archive chunks
+        :type stream: generator
+
+        :returns: A generator of the archive chunks
+        """
+        tmp = '{}.{}.part'.format(self._path(key), uuid.uuid4().hex)
+        size = 0
+        complete = False
+        try:
+            with open(tmp, 'wb') as cache:
+                for chunk in stream:
+                    size += len(chunk)
+                    if cache and size > self.size:
+                        # too big to be cached
+                        cache.close()
+                        cache = None
+                    if cache:
+                        cache.write(chunk)
+                    yield chunk
+                complete = cache is not None
+            if complete:
+                os.rename(tmp, self._path(key))
+                self.evict()
+        finally:
+            if hasattr(stream, 'close'):
+                stream.close()
+            if not complete and os.path.exists(tmp):
+                os.remove(tmp)
+
+    def evict(self):
+        """Removes the expired archives then the least recently used ones
+        until the cache fits its quota"""
+        now = time.time()
+        entries = []
+        total = 0
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if filename.endswith('.part'):
+                # leftovers of interrupted downloads
+                if stat.st_mtime + self.ttl < now:
+                    os.remove(path)
+                continue
+            if stat.st_mtime + self.ttl < now:
+                os.remove(path)
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+            total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.size:
+                break
+            self.logger.debug('Evicting {} from the restore cache'.format(path))
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class RestoreJobs(object):
+    """The :class:`burpui.misc.restore.RestoreJobs` class runs the online
+    restorations in background so they do not hold the web workers.
+
+    Every job has its own state file within the spool directory so every
+    worker of the application can report it. The number of running
+    restorations is capped by a set of lock files shared by all the workers.
+    The process running a job touches its heartbeat file, the pending jobs
+    whose heartbeat stopped (the process died or was restarted) are marked as
+    failed so they do not count against the per-user limit forever.
+
+    :param backend: Backend performing the restorations
+    :type backend: :class:`burpui.misc.backend.interface.BUIbackend`
+
+    :param jobs: Maximum number of restorations running at the same time
+    :type jobs: int
+
+    :param userjobs: Maximum number of pending restorations per user
+    :type userjobs: int
+
+    :param tmpdir: Spool directory of the jobs
+    :type tmpdir: str
+
+    :param ttl: Time in seconds the archives are kept once generated
+    :type ttl: int
+
+    :param cache: Cache of the generated archives
+    :type cache: :class:`burpui.misc.restore.RestoreCache`
+    """
+    logger = logging.getLogger('burp-ui')
+    pending = ['queued', 'running']
+
+    def __init__(self, backend, jobs=G_RESTOREJOBS, userjobs=G_RESTOREUSERJOBS,
+                 tmpdir=G_RESTORETMPDIR, ttl=G_RESTORETTL, cache=None):
+        self.backend = backend
+        self.cache = cache
+        self.jobs = max(jobs or 1, 1)
+        self.userjobs = userjobs
+        self.tmpdir = tmpdir or default_spool()
+        self.ttl = ttl
+        self.pool = None
+        self.lock = threading.Lock()
+        # jobs run by this process
+        self.owned = set()
+        self.beat = None
+        _mkdir(self.tmpdir)
+
+    @contextmanager
+    def _locked(self):
+        """Serializes the changes of the jobs states between the threads and
+        the processes sharing the spool directory"""
+        with self.lock:
+            with open(os.path.join(self.tmpdir, 'jobs.lock'), 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _path(self, jobid, ext='json'):
+        return os.path.join(self.tmpdir, '{}.{}'.format(jobid, ext))
+
+    def _load(self, jobid):
+        try:
+            with open(self._path(jobid)) as state:
+                return json.load(state)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _save(self, job):
+        # write then rename so readers never see a partial state
+        tmp = self._path(job['id'], 'json.tmp')
+        with open(tmp, 'w') as state:
+            json.dump(job, state)
+        os.rename(tmp, self._path(job['id']))
+
+    def _remove(self, jobid):
+        for ext in ['json', 'part', 'archive', 'beat']:
+            path = self._path(jobid, ext)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _all(self):
+        jobs = []
+        for filename in os.listdir(self.tmpdir):
+            if not filename.endswith('.json'):
+                continue
+            job = self._load(filename[:-5])
+            if job:
+                jobs.append(job)
+        return jobs
+
+    def _prune(self):
+        """Removes the expired jobs and fails the interrupted ones, called
+        with the lock held"""
+        now = time.time()
+        for job in self._all():
+            if job['finished'] and job['finished'] + self.ttl < now:
+                self.logger.debug('Removing expired restore job {}'.format(job['id']))
+                self._remove(job['id'])
+            elif job['status'] in self.pending and job['id'] not in self.owned:
+                try:
+                    beat = os.path.getmtime(self._path(job['id'], 'beat'))
+                except OSError:
+                    beat = job['created']
+                if beat + G_RESTORESTALE < now:
+                    self.logger.warning('Restore job {} was interrupted'.format(job['id']))
+                    job['status'] = 'failed'
+                    job['error'] = 'The restoration was interrupted'
+                    job['finished'] = now
+                    self._save(job)
+
+    def _heartbeat(self):
+        """Tells the other processes the jobs of this one are still alive"""
+        while True:
+            time.sleep(G_RESTOREBEAT)
+            for jobid in list(self.owned):
+                try:
+                    os.utime(self._path(jobid, 'beat'), None)
+                except OSError:
+                    pass
+
+    def _update(self, job, final=False):
+        """Saves the state of a running job unless it was cancelled in the
+        meantime
+
+        :param job: The job
+        :type job: dict
+
+        :param final: The job is over
+        :type final: bool
+
+        :returns: False if the job was cancelled
+        """
+        with self._locked():
+            state = self._load(job['id'])
+            if not state or state['status'] == 'cancelled':
+                job['status'] = 'cancelled'
+                return False
+            if final:
+                job['finished'] = time.time()
+            self._save(job)
+            return True
+
+    def _slot(self, jobid):
+        """Waits for one of the restoration slots to be available
+
+        :returns: The file object holding the lock or None if the job was
+                  cancelled in the meantime
+        """
+        while True:
+            for num in range(self.jobs):
+                slot = open(os.path.join(self.tmpdir, 'slot-{}.lock'.format(num)), 'w')
+                try:
+                    fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return slot
+                except (IOError, OSError):
+                    slot.close()
+            if not self._queued(jobid):
+                return None
+            time.sleep(G_RESTOREREFRESH)
+
+    def _queued(self, jobid):
+        job = self._load(jobid)
+        return job and job['status'] == 'queued'
+
+    def _run(self, job, files, password):
+        """Performs the restoration of a job and writes its archive"""
+        try:
+            self._restore(job, files, password)
+        finally:
+            self.owned.discard(job['id'])
+
+    def _restore(self, job, files, password):
+        slot = self._slot(job['id'])
+        if not slot:
+            return
+        stream = None
+        try:
+            with self._locked():
+                if not self._queued(job['id']):
+                    return
+                job['status'] = 'running'
+                job['started'] = time.time()
+                self._save(job)
+            key = None
+            if self.cache and self.cache.size and not password:
+                key = self.cache.key(
+                    job['client'],
+                    job['backup'],
+                    files,
+                    job['strip'],
+                    job['format'],
+                    job['server'],
+                    backup_timestamp(self.backend, job['client'],
+                                     job['backup'], job['server'])
+                )
+                cached = self.cache.get(key)
+                if cached:
+                    _link(cached, self._path(job['id'], 'archive'))
+                    job['status'] = 'done'
+                    job['size'] = os.path.getsize(cached)
+                    return
+            stream, err = self.backend.restore_files_stream(
+                job['client'],
+                job['backup'],
+                files,
+                job['strip'],
+                job['format'],
+                password,
+                job['server']
+            )
+            if not stream:
+                raise BUIserverException(err or 'Unable to restore files')
+            last = time.time()
+            with open(self._path(job['id'], 'part'), 'wb') as archive:
+                for chunk in stream:
+                    archive.write(chunk)
+                    job['size'] += len(chunk)
+                    now = time.time()
+                    if now - last < G_RESTOREREFRESH:
+                        continue
+                    last = now
+                    job['archived'] = getattr(stream, 'files', None)
+                    job['restored'] = getattr(stream, 'restored', None)
+                    if not self._update(job):
+                        self.logger.info('Restore job {} cancelled'.format(job['id']))
+                        return
+            os.rename(self._path(job['id'], 'part'), self._path(job['id'], 'archive'))
+            job['status'] = 'done'
+            job['archived'] = getattr(stream, 'files', None)
+            job['restored'] = getattr(stream, 'restored', None)
+            if key:
+                self.cache.add(key, self._path(job['id'], 'archive'))
+        except Exception as exp:
+            self.logger.error('Restore job {} failed: {}'.format(job['id'], exp))
+            job['status'] = 'failed'
+            job['error'] = str(exp)
+        finally:
+            if stream is not None and hasattr(stream, 'close'):
+                stream.close()
+            part = self._path(job['id'], 'part')
+            if os.path.exists(part):
+                os.remove(part)
+            if job['status'] not in ['queued', 'cancelled']:
+                # a cancellation wins over the result of the job
+                self._update(job, True)
+            fcntl.flock(slot, fcntl.LOCK_UN)
+            slot.close()
+
+    def submit(self, username, name, backup, files, strip=0, archive='zip',
+               password=None, server=None):
+        """Queues a new restoration
+
+        :param username: User requesting the restoration
+        :type username: str
+
+        :param name: Client name
+        :type name: str
+
+        :param backup: Backup number
+        :type backup: int
+
+        :param files: A string representing a list of files to restore
+        :type files: str
+
+        :param strip: Number of parent directories to strip while restoring
+                      files
+        :type strip: int
+
+        :param archive: Format of the generated archive
+        :type archive: str
+
+        :param password: Password for encrypted backups (never stored)
+        :type password: str
+
+        :param server: What server to ask (only in multi-agent mode)
+        :type server: str
+
+        :returns: The newly created job
+        """
+        with self._locked():
+            self._prune()
+            running = [x for x in self._all()
+                       if x['user'] == username and x['status'] in self.pending]
+            if self.userjobs and len(running) >= self.userjobs:
+                raise BUIserverException(
+                    'Too many restorations in progress ({}), please wait for '
+                    'them to complete'.format(len(running))
+                )
+            job = {
+                'id': uuid.uuid4().hex,
+                'user': username,
+                'server': server,
+                'client': name,
+                'backup': backup,
+                'strip': strip,
+                'format': archive,
+                'status': 'queued',
+                'restored': None,
+                'archived': None,
+                'size': 0,
+                'error': None,
+                'created': time.time(),
+                'started': None,
+                'finished': None,
+            }
+            self._save(job)
+            open(self._path(job['id'], 'beat'), 'w').close()
+            self.owned.add(job['id'])
+            if not self.pool:
+                self.pool = ThreadPool(self.jobs)
+                self.beat = threading.Thread(
+                    target=self._heartbeat,
+                    name='burp-ui-restore-jobs'
+                )
+                self.beat.daemon = True
+                self.beat.start()
+        self.pool.apply_async(self._run, (dict(job), files, password))
+        return job
+
+    def get(self, jobid):
+        """Returns a job
+
+        :param jobid: Job ID
+        :type jobid: str
+
+        :returns: The job or None if it does not exist
+        """
+        if not jobid.isalnum():
+            return None
+        return self._load(jobid)
+
+    def list(self, username=None):
+        """Returns the jobs of a given user
+
+        :param username: Only return the jobs of this user (all the jobs when
+                         None)
+        :type username: str
+
+        :returns: A list of jobs
+        """
+        with self._locked():
+            self._prune()
+        jobs = self._all()
+        if username is not None:
+            jobs = [x for x in jobs if x['user'] == username]
+        return sorted(jobs, key=lambda x: x['created'])
+
+    def archive(self, jobid):
+        """Returns the path of the archive generated by a job
+
+        :param jobid: Job ID
+        :type jobid: str
+
+        :returns: The path of the archive or None if it is not ready
+        """
+        job = self.get(jobid)
+        if not job or job['status'] != 'done':
+            return None
+        path = self._path(jobid, 'archive')
+        if not os.path.isfile(path):
+            return None
+        return path
+
+    def cancel(self, jobid):
+        """Cancels a pending job or removes a finished one along with its
+        archive
+
+        :param jobid: Job ID
+        :type jobid: str
+
+        :returns: True if the job existed
+        """
+        with self._locked():
+            job = self.get(jobid)
+            if not job:
+                return False
+            if job['status'] in self.pending:
+                job['status'] = 'cancelled'
+                job['finished'] = time.time()
+                self._save(job)
+            else:
+                self._remove(jobid)
+            return True
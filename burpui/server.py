@@ -13,6 +13,9 @@ import logging
 import traceback
 
 from .misc.auth.handler import UserAuthHandler
+from .misc.restore import RestoreJobs, RestoreCache, default_spool, \
+    G_RESTOREJOBS, G_RESTOREUSERJOBS, G_RESTORETMPDIR, G_RESTORETTL, \
+    G_RESTORECACHETTL, G_RESTORECACHESIZE
 from .utils import BUIConfig
 from datetime import timedelta
 
@@ -69,6 +72,14 @@ class BUIServer(Flask):
         'Production': {
             'storage': G_STORAGE,
             'redis': G_REDIS,
+        },
+        'Restore': {
+            'jobs': G_RESTOREJOBS,
+            'userjobs': G_RESTOREUSERJOBS,
+            'spool': G_RESTORETMPDIR,
+            'ttl': G_RESTORETTL,
+            'cachettl': G_RESTORECACHETTL,
+            'cachesize': G_RESTORECACHESIZE,
         }
     }
 
@@ -220,6 +231,37 @@ class BUIServer(Flask):
             section='Production'
         )
 
+        # Restore options
+        self.restorejobs = self.conf.safe_get(
+            'jobs',
+            'integer',
+            section='Restore'
+        )
+        self.restoreuserjobs = self.conf.safe_get(
+            'userjobs',
+            'integer',
+            section='Restore'
+        )
+        self.restorespool = self.conf.safe_get(
+            'spool',
+            section='Restore'
+        )
+        self.restorettl = self.conf.safe_get(
+            'ttl',
+            'integer',
+            section='Restore'
+        )
+        self.restorecachettl = self.conf.safe_get(
+            'cachettl',
+            'integer',
+            section='Restore'
+        )
+        self.restorecachesize = self.conf.safe_get(
+            'cachesize',
+            'integer',
+            section='Restore'
+        )
+
         # Security options
         self.scookie = self.conf.safe_get(
             'scookie',
@@ -255,6 +297,12 @@ class BUIServer(Flask):
         self.logger.info('liverefresh: {}'.format(self.config['LIVEREFRESH']))
         self.logger.info('auth: {}'.format(self.auth))
         self.logger.info('acl: {}'.format(self.acl_engine))
+        self.logger.info('restore jobs: {}'.format(self.restorejobs))
+        self.logger.info('restore jobs per user: {}'.format(self.restoreuserjobs))
+        self.logger.info('restore spool: {}'.format(self.restorespool))
+        self.logger.info('restore ttl: {}'.format(self.restorettl))
+        self.logger.info('restore cache ttl: {}'.format(self.restorecachettl))
+        self.logger.info('restore cache size: {}'.format(self.restorecachesize))
 
         if self.standalone:
             module = 'burpui.misc.backend.burp{0}'.format(self.vers)
@@ -281,6 +329,20 @@ class BUIServer(Flask):
             )
             sys.exit(2)
 
+        self.restorecache = RestoreCache(
+            os.path.join(self.restorespool or default_spool(), 'cache'),
+            self.restorecachettl,
+            self.restorecachesize
+        )
+        self.jobs = RestoreJobs(
+            self.cli,
+            self.restorejobs,
+            self.restoreuserjobs,
+            self.restorespool,
+            self.restorettl,
+            self.restorecache
+        )
+
         self.init = True
 
     def manual_run(self):
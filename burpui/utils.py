@@ -9,7 +9,11 @@
 """
 import os
 import re
+import bz2
 import math
+import time
+import zlib
+import struct
 import string
 import sys
 import codecs
@@ -22,10 +26,17 @@ import logging
 import configobj
 import validate
 
+from collections import Counter, deque
 from inspect import currentframe, getouterframes
+from multiprocessing.pool import ThreadPool
 from ._compat import PY3
 from . import __version__, __release__
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 NOTIF_OK = 0
 NOTIF_WARN = 1
 NOTIF_ERROR = 2
@@ -35,6 +46,19 @@ if PY3:
     long = int  # pragma: no cover
     basestring = str  # pragma: no cover
 
+# archive formats supported by BUIcompress and BUIcompressStream
+ARCHIVE_FORMATS = ['zip', 'tar', 'tar.gz', 'tar.bz2', 'tar.zst']
+
+# files we do not try to compress again
+INCOMPRESSIBLE = [
+    '7z', 'apk', 'avi', 'bz2', 'deb', 'docx', 'flac', 'gif', 'gz', 'heic',
+    'jar', 'jpeg', 'jpg', 'lz4', 'lzma', 'mkv', 'mov', 'mp3', 'mp4', 'odp',
+    'ods', 'odt', 'ogg', 'png', 'pptx', 'rar', 'rpm', 'tgz', 'webm', 'webp',
+    'xlsx', 'xz', 'zip', 'zst',
+]
+# above this number of bits per byte, the data is considered random
+ENTROPY_LIMIT = 7.5
+
 
 class human_readable(long):
     """define a human_readable class to allow custom formatting
@@ -159,41 +183,582 @@ class BUIlogging(object):
             self.logger.makeRecord = sav
 
 
+def incompressible(path, sample=65536):
+    """Tells if compressing a file is worthless, either because of its
+    extension or because a sample of its content looks random.
+
+    :param path: Path of the file
+    :type path: str
+
+    :param sample: Size of the sample to analyse
+    :type sample: int
+
+    :returns: True if the file is not worth compressing
+    """
+    ext = os.path.splitext(path)[1].lstrip('.').lower()
+    if ext in INCOMPRESSIBLE:
+        return True
+    try:
+        with open(path, 'rb') as fileobj:
+            data = bytearray(fileobj.read(sample))
+    except (IOError, OSError):
+        return False
+    # small files are cheap to compress anyway
+    if len(data) < 4096:
+        return False
+    size = float(len(data))
+    entropy = -sum(
+        count / size * math.log(count / size, 2)
+        for count in Counter(data).values()
+    )
+    return entropy > ENTROPY_LIMIT
+
+
+class BUIdeflate(object):
+    """Raw deflate compressor splitting the data in blocks that are compressed
+    in parallel, the same way pigz does.
+
+    Every block but the last one ends with a sync flush so the compressed
+    blocks can simply be concatenated. When zlib supports it, the end of each
+    block primes the compression of the next one to keep the same ratio.
+
+    :param level: Compression level
+    :type level: int
+
+    :param pool: Threads compressing the blocks (inline when None)
+    :type pool: :class:`multiprocessing.pool.ThreadPool` or
+                :class:`gevent.threadpool.ThreadPool`
+
+    :param jobs: Number of threads of the pool
+    :type jobs: int
+
+    :param block: Size of the blocks
+    :type block: int
+    """
+    WINDOW = 32768
+    # zdict appeared in python 3.3
+    ZDICT = sys.version_info >= (3, 3)
+
+    def __init__(self, level=zlib.Z_DEFAULT_COMPRESSION, pool=None, jobs=1,
+                 block=131072):
+        self.level = level
+        self.pool = pool
+        self.jobs = jobs
+        self.block = block
+        self.buf = []
+        self.buflen = 0
+        self.store = True
+        self.dictionary = None
+        self.pending = deque()
+
+    @staticmethod
+    def _deflate(level, data, zdict, last):
+        if zdict:
+            comp = zlib.compressobj(level, zlib.DEFLATED, -15, 8,
+                                    zlib.Z_DEFAULT_STRATEGY, zdict)
+        else:
+            comp = zlib.compressobj(level, zlib.DEFLATED, -15)
+        return comp.compress(data) + comp.flush(
+            zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+        )
+
+    def _submit(self, data, last=False):
+        # incompressible blocks are stored as is
+        level = 0 if self.store and data else self.level
+        zdict = self.dictionary if self.ZDICT else None
+        self.dictionary = data[-self.WINDOW:]
+        if self.pool:
+            self.pending.append(
+                self.pool.apply_async(self._deflate, (level, data, zdict, last))
+            )
+        else:
+            self.pending.append(self._deflate(level, data, zdict, last))
+
+    def _collect(self, wait=False):
+        out = []
+        while self.pending:
+            res = self.pending[0]
+            if not isinstance(res, bytes):
+                # do not let too many blocks wait in memory
+                if not wait and not res.ready() and \
+                        len(self.pending) <= self.jobs * 2:
+                    break
+                res = res.get()
+            out.append(res)
+            self.pending.popleft()
+        return b''.join(out)
+
+    def compress(self, data, store=False):
+        """Compresses some data
+
+        :param data: Data to compress
+        :type data: bytes
+
+        :param store: Whether the data is known to be incompressible
+        :type store: bool
+
+        :returns: The compressed data available so far
+        """
+        self.store = self.store and store
+        self.buf.append(data)
+        self.buflen += len(data)
+        if self.buflen >= self.block:
+            data = b''.join(self.buf)
+            pos = 0
+            while len(data) - pos >= self.block:
+                self._submit(data[pos:pos + self.block])
+                pos += self.block
+                self.store = store
+            self.buf = [data[pos:]]
+            self.buflen = len(data) - pos
+        return self._collect()
+
+    def flush(self):
+        """Terminates the compressed stream
+
+        :returns: The remaining compressed data
+        """
+        self._submit(b''.join(self.buf), True)
+        self.buf = []
+        self.buflen = 0
+        self.store = True
+        return self._collect(True)
+
+
+class BUIgzip(object):
+    """Gzip compressor based on :class:`burpui.utils.BUIdeflate`
+
+    :param level: Compression level
+    :type level: int
+
+    :param pool: Threads compressing the blocks (inline when None)
+    :type pool: :class:`multiprocessing.pool.ThreadPool` or
+                :class:`gevent.threadpool.ThreadPool`
+
+    :param jobs: Number of threads of the pool
+    :type jobs: int
+    """
+    def __init__(self, level=zlib.Z_DEFAULT_COMPRESSION, pool=None, jobs=1):
+        self.deflate = BUIdeflate(level, pool, jobs)
+        self.crc = 0
+        self.size = 0
+        # magic, deflate, no flags, mtime, no extra flags, unix
+        self.header = struct.pack('<2BBBLBB', 0x1f, 0x8b, 8, 0, int(time.time()), 0, 3)
+
+    def compress(self, data, store=False):
+        """See :func:`burpui.utils.BUIdeflate.compress`"""
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        data = self.header + self.deflate.compress(data, store)
+        self.header = b''
+        return data
+
+    def flush(self):
+        """See :func:`burpui.utils.BUIdeflate.flush`"""
+        data = self.header + self.deflate.flush()
+        self.header = b''
+        return data + struct.pack('<2L', self.crc & 0xffffffff, self.size & 0xffffffff)
+
+
+class BUIcompressor(object):
+    """Gives the bz2 and zstd compressors the interface of
+    :class:`burpui.utils.BUIdeflate`
+
+    :param compressor: The actual compressor
+    :type compressor: object
+    """
+    def __init__(self, compressor):
+        self.compressor = compressor
+
+    def compress(self, data, store=False):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+
 class BUIcompress():
-    """Provides a context to generate any kind of archive supported by burp-ui"""
-    def __init__(self, name, archive, zip64=False):  # pragma: no cover
+    """Provides a context to generate any kind of archive supported by burp-ui
+
+    The archive is written in the given file by a
+    :class:`burpui.utils.BUIcompressStream` so both produce the same archives.
+    """
+    def __init__(self, name, archive, zip64=False, level=zlib.Z_DEFAULT_COMPRESSION, jobs=1):
         self.name = name
         self.archive = archive
         self.zip64 = zip64
+        self.level = level
+        self.jobs = jobs
 
     def __enter__(self):
-        self.arch = None
-        if self.archive == 'zip':
-            self.arch = zipfile.ZipFile(self.name, mode='w', compression=zipfile.ZIP_DEFLATED, allowZip64=self.zip64)
-        elif self.archive == 'tar.gz':
-            self.arch = tarfile.open(self.name, 'w:gz')
-        elif self.archive == 'tar.bz2':
-            self.arch = tarfile.open(self.name, 'w:bz2')
+        self.arch = BUIcompressStream(self.archive, self.zip64, level=self.level, jobs=self.jobs)
+        self.fileobj = open(self.name, 'wb')
         return self
 
     def __exit__(self, type, value, traceback):
-        self.arch.close()
+        try:
+            if type is None:
+                for data in self.arch.close():
+                    self.fileobj.write(data)
+        finally:
+            self.arch.terminate()
+            self.fileobj.close()
+
+    def append(self, path, arcname):
+        for data in self.arch.append(path, arcname):
+            self.fileobj.write(data)
+
+
+class BUIcompressStream(object):
+    """Generates any kind of archive supported by burp-ui on the fly.
+
+    Unlike :class:`burpui.utils.BUIcompress`, nothing is written on disk: the
+    :func:`append` and :func:`close` generators yield the archive by chunks so
+    it can be sent as soon as the files are read.
+    Zip archives use data descriptors (and zip64 extensions when allowed) since
+    we cannot seek back to fill the local headers.
+    Files that look incompressible are stored as is in zip archives and in
+    uncompressed blocks in gzip streams.
+
+    :param archive: Format of the archive (zip, tar, tar.gz, tar.bz2 or
+                    tar.zst)
+    :type archive: str
+
+    :param zip64: Allow zip64 extensions
+    :type zip64: bool
+
+    :param chunk: Size of the chunks read from the files
+    :type chunk: int
+
+    :param level: Compression level (0 stores the files in zip archives, -1
+                  uses the default level of the format)
+    :type level: int
+
+    :param jobs: Number of threads compressing the deflate (zip and tar.gz)
+                 and zstd streams
+    :type jobs: int
+    """
+    # zip structures
+    LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+    DATA_DESCRIPTOR = struct.Struct('<4sL2L')
+    DATA_DESCRIPTOR64 = struct.Struct('<4sL2Q')
+    CENTRAL_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+    END_RECORD = struct.Struct('<4s4H2LH')
+    END_RECORD64 = struct.Struct('<4sQ2H2L4Q')
+    END_LOCATOR64 = struct.Struct('<4sLQL')
+    ZIP64_LIMIT = (1 << 31) - 1
+    ZIP_MAX = 0xffffffff
+    ZIP_FILECOUNT_LIMIT = 0xffff
+
+    def __init__(self, archive, zip64=False, chunk=65536,
+                 level=zlib.Z_DEFAULT_COMPRESSION, jobs=1):
+        self.archive = archive
+        self.zip64 = zip64
+        self.chunk = chunk
+        self.level = level
+        self.jobs = max(jobs or 1, 1)
+        self.pool = None
+        self.store = False
+        self.offset = 0
+        self.entries = []
+        self.compressor = None
+        # progress of the archive
+        self.files = 0
+        self.size = 0
+        if archive == 'tar.gz':
+            self.compressor = BUIgzip(level, self._pool(), self.jobs)
+        elif archive == 'tar.bz2':
+            self.compressor = BUIcompressor(bz2.BZ2Compressor(
+                9 if level < 0 else min(max(level, 1), 9)
+            ))
+        elif archive == 'tar.zst':
+            if not zstandard:
+                raise ValueError('The zstandard module is needed for tar.zst archives')
+            self.compressor = BUIcompressor(zstandard.ZstdCompressor(
+                level=3 if level < 0 else level,
+                threads=self.jobs if self.jobs > 1 else 0
+            ).compressobj())
+        elif archive not in ['zip', 'tar']:
+            raise ValueError('Unsupported archive format: {}'.format(archive))
+
+    def _pool(self):
+        """Returns the threads compressing the deflate streams if any"""
+        if self.jobs > 1 and not self.pool:
+            if 'gevent' in sys.modules:
+                # waiting for native threads would block the gevent hub
+                from gevent.threadpool import ThreadPool as GeventThreadPool
+                self.pool = GeventThreadPool(self.jobs)
+            else:
+                self.pool = ThreadPool(self.jobs)
+        return self.pool
+
+    def terminate(self):
+        """Stops the compression threads"""
+        if self.pool:
+            if hasattr(self.pool, 'kill'):
+                self.pool.kill()
+            else:
+                self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def _output(self, data):
+        """Returns the data to send once compressed if needed"""
+        self.offset += len(data)
+        if self.compressor and data:
+            return self.compressor.compress(data, self.store)
+        return data
+
+    def _read(self, path):
+        """Reads a file by chunks"""
+        with open(path, 'rb') as fileobj:
+            buf = fileobj.read(self.chunk)
+            while buf:
+                self.size += len(buf)
+                yield buf
+                buf = fileobj.read(self.chunk)
 
     def append(self, path, arcname):
+        """Adds a file to the archive
+
+        :param path: Path of the file to add
+        :type path: str
+
+        :param arcname: Name of the file within the archive
+        :type arcname: str
+
+        :returns: A generator of the archive chunks
+        """
+        self.store = (self.level != 0 and
+                      self.archive in ['zip', 'tar.gz'] and
+                      not os.path.islink(path) and incompressible(path))
+        if self.archive == 'zip':
+            gen = self._append_zip(path, arcname)
+        else:
+            gen = self._append_tar(path, arcname)
+        for data in gen:
+            data = self._output(data)
+            if data:
+                yield data
+        self.files += 1
+
+    def close(self):
+        """Terminates the archive
+
+        :returns: A generator of the last archive chunks
+        """
         if self.archive == 'zip':
-            if os.path.islink(path):
-                # This is a symlink, we virtually create one in memory
-                # because zipfile does not seem to support them natively
-                vfile = zipfile.ZipInfo()
-                vfile.filename = arcname  # That's the name of the actual file
-                vfile.external_attr |= 0o120000 << long(16)  # symlink file type
-                vfile.compress_type = zipfile.ZIP_STORED
-                # os.readlink gives us the target of the symlink
-                self.arch.writestr(vfile, os.readlink(path))
+            data = self._output(self._central_directory())
+        else:
+            # two empty blocks then padding up to the record size
+            size = self.offset + tarfile.BLOCKSIZE * 2
+            size += -size % tarfile.RECORDSIZE
+            data = self._output(tarfile.NUL * (size - self.offset))
+            if self.compressor:
+                data += self.compressor.flush()
+        self.terminate()
+        if data:
+            yield data
+
+    def _append_tar(self, path, arcname):
+        stat = os.lstat(path)
+        tarinfo = tarfile.TarInfo(arcname)
+        tarinfo.mode = stat.st_mode & 0o7777
+        tarinfo.uid = stat.st_uid
+        tarinfo.gid = stat.st_gid
+        tarinfo.mtime = stat.st_mtime
+        if os.path.islink(path):
+            tarinfo.type = tarfile.SYMTYPE
+            tarinfo.linkname = os.readlink(path)
+        else:
+            tarinfo.size = stat.st_size
+        yield tarinfo.tobuf(tarfile.GNU_FORMAT, 'utf-8', 'surrogateescape' if PY3 else 'strict')
+        if tarinfo.type == tarfile.SYMTYPE:
+            return
+        size = 0
+        for buf in self._read(path):
+            size += len(buf)
+            if size > tarinfo.size:
+                # the header is already gone, we cannot store more
+                buf = buf[:len(buf) - size + tarinfo.size]
+                size = tarinfo.size
+            yield buf
+            if size == tarinfo.size:
+                break
+        if size < tarinfo.size:
+            yield tarfile.NUL * (tarinfo.size - size)
+        if size % tarfile.BLOCKSIZE:
+            yield tarfile.NUL * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE)
+
+    def _append_zip(self, path, arcname):
+        stat = os.lstat(path)
+        year, month, day, hour, minute, second = time.localtime(stat.st_mtime)[:6]
+        if year < 1980:
+            year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+        entry = {
+            'offset': self.offset,
+            'date': (year - 1980) << 9 | month << 5 | day,
+            'time': hour << 11 | minute << 5 | second // 2,
+            'attr': (stat.st_mode & 0xffff) << 16,
+            'crc': 0,
+            'csize': 0,
+            'size': 0,
+            'flags': 0x08,
+        }
+        if not isinstance(arcname, bytes):
+            try:
+                arcname = arcname.encode('ascii')
+            except UnicodeEncodeError:
+                arcname = arcname.encode('utf-8', 'surrogateescape' if PY3 else 'strict')
+                entry['flags'] |= 0x800
+        entry['name'] = arcname
+        if os.path.islink(path):
+            # zipfile has no notion of symlinks, we store the target instead
+            entry['method'] = zipfile.ZIP_STORED
+            target = os.readlink(path)
+            if not isinstance(target, bytes):
+                target = target.encode('utf-8', 'surrogateescape' if PY3 else 'strict')
+            gen = [target]
+            compressor = None
+            entry['zip64'] = False
+        elif self.level == 0 or self.store:
+            entry['method'] = zipfile.ZIP_STORED
+            gen = self._read(path)
+            compressor = None
+            entry['zip64'] = stat.st_size > self.ZIP64_LIMIT
+        else:
+            entry['method'] = zipfile.ZIP_DEFLATED
+            gen = self._read(path)
+            if self.jobs > 1 and stat.st_size > self.chunk:
+                compressor = BUIdeflate(self.level, self._pool(), self.jobs)
+            else:
+                compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+            # same heuristic as zipfile
+            entry['zip64'] = stat.st_size * 1.05 > self.ZIP64_LIMIT
+        if entry['zip64'] and not self.zip64:
+            raise zipfile.LargeZipFile('Filesize would require ZIP64 extensions')
+        extra = b''
+        version = 20
+        csize = size = 0
+        if entry['zip64']:
+            extra = struct.pack('<2H2Q', 1, 16, 0, 0)
+            version = 45
+            csize = size = self.ZIP_MAX
+        entry['version'] = version
+        self.entries.append(entry)
+        yield self.LOCAL_HEADER.pack(
+            b'PK\003\004', version, 0, entry['flags'], entry['method'],
+            entry['time'], entry['date'], 0, csize, size, len(arcname),
+            len(extra)
+        ) + arcname + extra
+        for buf in gen:
+            entry['crc'] = zlib.crc32(buf, entry['crc'])
+            entry['size'] += len(buf)
+            if compressor:
+                buf = compressor.compress(buf)
+            entry['csize'] += len(buf)
+            if buf:
+                yield buf
+        if compressor:
+            buf = compressor.flush()
+            entry['csize'] += len(buf)
+            yield buf
+        entry['crc'] &= 0xffffffff
+        if entry['zip64']:
+            yield self.DATA_DESCRIPTOR64.pack(
+                b'PK\007\010', entry['crc'], entry['csize'], entry['size']
+            )
+        elif max(entry['csize'], entry['size']) > self.ZIP64_LIMIT:
+            raise RuntimeError('File size unexpectedly exceeded ZIP64 limit')
+        else:
+            yield self.DATA_DESCRIPTOR.pack(
+                b'PK\007\010', entry['crc'], entry['csize'], entry['size']
+            )
+
+    def _central_directory(self):
+        data = b''
+        start = self.offset
+        for entry in self.entries:
+            extra = []
+            csize = entry['csize']
+            size = entry['size']
+            offset = entry['offset']
+            if entry['zip64']:
+                extra += [size, csize]
+                csize = size = self.ZIP_MAX
+            if offset > self.ZIP64_LIMIT:
+                if not self.zip64:
+                    raise zipfile.LargeZipFile('Zipfile size would require ZIP64 extensions')
+                extra.append(offset)
+                offset = self.ZIP_MAX
+            version = entry['version']
+            if extra:
+                extra = struct.pack('<2H{}Q'.format(len(extra)), 1, 8 * len(extra), *extra)
+                version = 45
             else:
-                self.arch.write(path, arcname)
-        elif self.archive in ['tar.gz', 'tar.bz2']:
-            self.arch.add(path, arcname=arcname, recursive=False)
+                extra = b''
+            data += self.CENTRAL_HEADER.pack(
+                b'PK\001\002', version, 3, version, 0, entry['flags'],
+                entry['method'], entry['time'], entry['date'], entry['crc'],
+                csize, size, len(entry['name']), len(extra), 0, 0, 0,
+                entry['attr'], offset
+            ) + entry['name'] + extra
+        count = len(self.entries)
+        size = len(data)
+        if (count > self.ZIP_FILECOUNT_LIMIT or start > self.ZIP64_LIMIT or
+                size > self.ZIP64_LIMIT):
+            if not self.zip64:
+                raise zipfile.LargeZipFile('Zipfile size would require ZIP64 extensions')
+            data += self.END_RECORD64.pack(
+                b'PK\006\006', 44, 45, 45, 0, 0, count, count, size, start
+            )
+            data += self.END_LOCATOR64.pack(b'PK\006\007', 0, start + size, 1)
+            count = min(count, self.ZIP_FILECOUNT_LIMIT)
+            size = min(size, self.ZIP_MAX)
+            start = min(start, self.ZIP_MAX)
+        data += self.END_RECORD.pack(b'PK\005\006', 0, 0, count, count, size, start, 0)
+        return data
+
+
+class BUIprogressStream(object):
+    """Iterates over the chunks of an archive while keeping track of its
+    progress.
+
+    :param stream: Generator of the archive chunks
+    :type stream: generator
+
+    :param arch: The archive being generated if known
+    :type arch: :class:`burpui.utils.BUIcompressStream`
+    """
+    def __init__(self, stream, arch=None):
+        self.stream = stream
+        self.arch = arch
+        self.sent = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = next(self.stream)
+        self.sent += len(data)
+        return data
+
+    next = __next__
+
+    def close(self):
+        """Stops the generation of the archive"""
+        if hasattr(self.stream, 'close'):
+            self.stream.close()
+
+    @property
+    def files(self):
+        """Number of files archived so far (None when unknown)"""
+        return self.arch.files if self.arch else None
+
+    @property
+    def restored(self):
+        """Number of restored bytes archived so far (None when unknown)"""
+        return self.arch.size if self.arch else None
 
 
 def implement(func):
@@ -228,6 +228,9 @@ setup(
         'ldap_authentication': ['ldap3'],
         'local_authentication': ['pam'],
         'extra': ['ujson'],
+        'zstd': ['zstandard'],
+        'lz4': ['lz4'],
+        'msgpack': ['msgpack>=1.0'],
         'gunicorn': ['gevent'],
         'gunicorn-extra': ['redis', 'Flask-Session'],
         'agent': ['gevent'],
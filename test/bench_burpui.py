@@ -0,0 +1,699 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""Micro-benchmarks of some Burp-UI hot paths.
+
+Usage: python test/bench_burpui.py [name...]
+"""
+import os
+import sys
+import json
+import timeit
+
+sys.path.append('{0}/..'.format(os.path.join(os.path.dirname(os.path.realpath(__file__)))))
+
+
+def _browse_reply(entries=10000, indent=None):
+    """Builds a burp-like browse reply"""
+    doc = {
+        'clients': [{
+            'name': 'bench',
+            'run_status': 'idle',
+            'backups': [{
+                'number': 1,
+                'timestamp': 1480000000,
+                'flags': [],
+                'browse': {
+                    'directory': '/home',
+                    'entries': [
+                        {
+                            'name': 'file{}'.format(i),
+                            'dev': 2049,
+                            'ino': i,
+                            'mode': 33188,
+                            'nlink': 1,
+                            'uid': 1000,
+                            'gid': 1000,
+                            'rdev': 0,
+                            'size': 4096,
+                            'blksize': 4096,
+                            'blocks': 8,
+                            'atime': 1480000000,
+                            'ctime': 1480000000,
+                            'mtime': 1480000000
+                        } for i in range(entries)
+                    ]
+                }
+            }]
+        }]
+    }
+    logline = json.dumps({'logline': 'Server version: 2.0.40'})
+    return (logline + '\n' + json.dumps(doc, indent=indent) + '\n').encode('utf-8')
+
+
+def _legacy_read(data):
+    """What the Burp2 backend used to do: accumulate lines and try to parse
+    the whole buffer after each one"""
+    doc = u''
+    for line in data.decode('utf-8').splitlines(True):
+        doc += line.rstrip('\n')
+        try:
+            jso = json.loads(doc)
+        except ValueError:
+            continue
+        if 'logline' in jso:
+            doc = u''
+            continue
+        return jso
+
+
+def _decoder_read(data, chunk=65536):
+    from burpui.misc.backend.burp2 import LOGLINE
+    from burpui.misc.backend.utils import JSONFrameDecoder
+    decoder = JSONFrameDecoder(skip=LOGLINE.match, chunk=chunk)
+    view = memoryview(data)
+    for pos in range(0, len(data), chunk):
+        decoder.feed(view[pos:pos + chunk])
+        for jso in decoder:
+            return jso
+
+
+def bench_json_framing(number=10):
+    """Reading a 10k-entries browse reply"""
+    # the legacy reader is quadratic on multi-line documents, so keep the
+    # pretty-printed reply smaller
+    for name, entries, indent in (('one line', 10000, None),
+                                  ('pretty-printed', 500, 2)):
+        data = _browse_reply(entries, indent)
+        assert _legacy_read(data) == _decoder_read(data)
+        print('  {}, {} entries ({} bytes)'.format(name, entries, len(data)))
+        for label, func in (('legacy', _legacy_read), ('decoder', _decoder_read)):
+            res = timeit.timeit(lambda: func(data), number=number)
+            print('    {:<8} {:8.2f} ms'.format(label, res * 1000 / number))
+
+
+BACKUP_LOG = """\
+--------------------------------------------------------------------------------
+Start time: 2016-11-28 10:00:00
+  End time: 2016-11-28 10:42:17
+Time taken: 42:17
+                     New   Changed Unchanged   Deleted     Total |   Scanned
+------------------------------------------------------------------------------
+           Files:    139         2     10231         0     10372 |     10372
+Files (encrypted):      0         0         0         0         0 |         0
+     Directories:     14         0      1420         0      1434 |      1434
+      Soft links:      0         0        12         0        12 |        12
+      Hard links:      0         0         0         0         0 |         0
+    Meta data:         0         0         0         0         0 |         0
+  Meta data(enc):      0         0         0         0         0 |         0
+   Special files:      0         0         2         0         2 |         2
+       EFS files:      0         0         0         0         0 |         0
+     VSS headers:      0         0         0         0         0 |         0
+VSS headers (enc):      0         0         0         0         0 |         0
+     VSS footers:      0         0         0         0         0 |         0
+VSS footers (enc):      0         0         0         0         0 |         0
+     Grand total:    153         2     11665         0     11820 |     11820
+------------------------------------------------------------------------------
+
+             Warnings:             3
+
+      Bytes estimated:     734839265 (700.80 MB)
+      Bytes in backup:     734839265 (700.80 MB)
+       Bytes received:       2319552 (2.21 MB)
+           Bytes sent:             0 (0 bytes)
+--------------------------------------------------------------------------------
+"""
+
+
+def _backup_log(noise=50000, inside=False):
+    """Builds a burp-1 like log.gz of about 90 bytes per line of noise"""
+    lines = [
+        '2016-11-28 10:00:00: bui[4242] Client version: 1.4.40',
+        '2016-11-28 10:00:00: bui[4242] Client is Windows',
+    ]
+    warnings = [
+        '2016-11-28 10:{:02d}:00: bui[4242] WARNING: '
+        '/home/user/some/directory/file{}: Permission denied'.format(i % 60, i)
+        for i in range(noise)
+    ]
+    stats = BACKUP_LOG.splitlines()
+    if inside:
+        # within a section every line goes through the lookups
+        return lines + stats[:4] + warnings + stats[4:]
+    return lines + warnings + stats
+
+
+def _legacy_parse_backup_log(filemap, number, client=None):
+    """What the Burp1 backend used to do"""
+    import re
+    import time
+    import datetime
+    from six import iteritems
+    lookup_easy = {
+        'start': r'^Start time: (.+)$',
+        'end': r'^\s*End time: (.+)$',
+        'duration': r'^Time taken: (.+)$',
+        'totsize': r'^\s*Bytes in backup:\s+(\d+)',
+        'received': r'^\s*Bytes received:\s+(\d+)'
+    }
+    lookup_complex = {
+        'files': r'^\s*Files:?\s+([\d\s]+)\s+\|\s+(\d+)$',
+        'files_enc': r'^\s*Files \(encrypted\):?\s+([\d\s]+)\s+\|\s+(\d+)$',
+        'dir': r'^\s*Directories:?\s+([\d\s]+)\s+\|\s+(\d+)$',
+        'softlink': r'^\s*Soft links:?\s+([\d\s]+)\s+\|\s+(\d+)$',
+        'hardlink': r'^\s*Hard links:?\s+([\d\s]+)\s+\|\s+(\d+)$',
+        'meta': r'^\s*Meta data:?\s+([\d\s]+)\s+\|\s+(\d+)$',
+        'meta_enc': r'^\s*Meta data\(enc\):?\s+([\d\s]+)\s+\|\s+(\d+)$',
+        'special': r'^\s*Special files:?\s+([\d\s]+)\s+\|\s+(\d+)$',
+        'efs': r'^\s*EFS files:?\s+([\d\s]+)\s+\|\s+(\d+)$',
+        'vssheader': r'^\s*VSS headers:?\s+([\d\s]+)\s+\|\s+(\d+)$',
+        'vssheader_enc': r'^\s*VSS headers \(enc\):?\s+([\d\s]+)\s+\|\s+(\d+)$',
+        'vssfooter': r'^\s*VSS footers:?\s+([\d\s]+)\s+\|\s+(\d+)$',
+        'vssfooter_enc': r'^\s*VSS footers \(enc\):?\s+([\d\s]+)\s+\|\s+(\d+)$',
+        'total': r'^\s*Grand total:?\s+([\d\s]+)\s+\|\s+(\d+)$'
+    }
+    backup = {'windows': 'false', 'number': int(number)}
+    if client is not None:
+        backup['name'] = client
+    useful = False
+    for line in filemap:
+        if re.match(r'^\d{4}-\d{2}-\d{2} (\d{2}:){3} \w+\[\d+\] Client is Windows$', line):
+            backup['windows'] = 'true'
+        elif not useful and not re.match(r'^-+$', line):
+            continue
+        elif useful and re.match(r'^-+$', line):
+            useful = False
+            continue
+        elif re.match(r'^-+$', line):
+            useful = True
+            continue
+        found = False
+        for (key, regex) in iteritems(lookup_easy):
+            reg = re.search(regex, line)
+            if reg:
+                found = True
+                if key in ['start', 'end']:
+                    backup[key] = int(time.mktime(datetime.datetime.strptime(reg.group(1), '%Y-%m-%d %H:%M:%S').timetuple()))
+                elif key == 'duration':
+                    tmp = reg.group(1).split(':')
+                    tmp.reverse()
+                    fields = [0] * 4
+                    for (i, val) in enumerate(tmp):
+                        fields[i] = int(val)
+                    seconds = 0
+                    seconds += fields[0]
+                    seconds += fields[1] * 60
+                    seconds += fields[2] * (60 * 60)
+                    seconds += fields[3] * (60 * 60 * 24)
+                    backup[key] = seconds
+                else:
+                    backup[key] = int(reg.group(1))
+                break
+        if found:
+            continue
+        for (key, regex) in iteritems(lookup_complex):
+            reg = re.search(regex, line)
+            if reg:
+                spl = re.split(r'\s+', reg.group(1))
+                if len(spl) < 5:
+                    return {}
+                backup[key] = {
+                    'new': int(spl[0]),
+                    'changed': int(spl[1]),
+                    'unchanged': int(spl[2]),
+                    'deleted': int(spl[3]),
+                    'total': int(spl[4]),
+                    'scanned': int(reg.group(2))
+                }
+                break
+    return backup
+
+
+def bench_backup_log(number=3):
+    """Parsing a burp-1 log.gz"""
+    from burpui.misc.backend.burp1 import Burp
+    backend = Burp(dummy=True)
+    for name, inside in (('noise outside sections', False),
+                         ('noise inside sections', True)):
+        log = _backup_log(50000, inside)
+        assert _legacy_parse_backup_log(log, 1) == backend._parse_backup_log(log, 1)
+        print('  {}, {} lines ({} bytes)'.format(name, len(log), sum(len(x) + 1 for x in log)))
+        for label, func in (('legacy', _legacy_parse_backup_log), ('compiled', backend._parse_backup_log)):
+            res = timeit.timeit(lambda: func(log, 1), number=number)
+            print('    {:<8} {:8.2f} ms'.format(label, res * 1000 / number))
+
+
+def _vss_tree(root, files=400, size=4096):
+    """Builds a restored Windows tree, every file embedding a VSS header"""
+    import struct
+    for i in range(files):
+        path = os.path.join(root, 'dir{}'.format(i % 10))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        with open(os.path.join(path, 'file{}'.format(i)), 'wb') as fileobj:
+            fileobj.write(struct.pack('<2LQL', 1, 0, size, 0))
+            fileobj.write(b'x' * size)
+
+
+def _vss_strip(root):
+    """Returns the vss_strip binary, or a shell substitute"""
+    import stat
+    from distutils.spawn import find_executable
+    binary = find_executable('vss_strip')
+    if binary:
+        return binary
+    binary = os.path.join(root, 'vss_strip')
+    with open(binary, 'w') as fileobj:
+        fileobj.write('#!/bin/sh\n'
+                      '[ "$1" = "-p" ] && echo "BACKUP_DATA" && exit 0\n'
+                      'tail -c +21 "$2" >"$4"\n')
+    os.chmod(binary, stat.S_IRWXU)
+    return binary
+
+
+def _legacy_walk_restored(stripbin, tmpdir):
+    """What the Burp1 backend used to do: one vss_strip at a time"""
+    import shutil
+    import subprocess
+    zip_len = len(tmpdir) + 1
+    stripping = True
+    test_strip = True
+    for dirname, _, files in os.walk(tmpdir):
+        for filename in files:
+            path = os.path.join(dirname, filename)
+            if test_strip:
+                test_strip = False
+                otp = None
+                try:
+                    with open(os.devnull, 'w') as devnul:
+                        otp = subprocess.check_output([stripbin, '-p', '-i', path], stderr=devnul)
+                except subprocess.CalledProcessError:
+                    pass
+                if not otp:
+                    stripping = False
+            if stripping and os.path.isfile(path):
+                shutil.move(path, path + '.tmp')
+                status = subprocess.call([stripbin, '-i', path + '.tmp', '-o', path])
+                if status != 0:
+                    os.remove(path)
+                    shutil.move(path + '.tmp', path)
+                    stripping = False
+                else:
+                    os.remove(path + '.tmp')
+            yield path, path[zip_len:]
+
+
+def bench_vss_strip(files=400):
+    """Stripping the VSS headers of a restored Windows tree"""
+    import shutil
+    import tempfile
+    from multiprocessing import cpu_count
+    from burpui.misc.backend.burp1 import Burp
+    root = tempfile.mkdtemp()
+    try:
+        backend = Burp(dummy=True)
+        backend.stripbin = _vss_strip(root)
+        tmpdir = os.path.join(root, 'restore')
+        runs = [('legacy', lambda: _legacy_walk_restored(backend.stripbin, tmpdir))]
+        for jobs in (1, 4, 8):
+            runs.append(('jobs={}'.format(jobs), lambda: backend._walk_restored(tmpdir)))
+        print('  {} files, {} CPU'.format(files, cpu_count()))
+        for label, func in runs:
+            if label.startswith('jobs='):
+                backend.stripjobs = int(label[5:])
+            _vss_tree(tmpdir, files)
+            start = timeit.default_timer()
+            res = sorted(entry for _, entry in func())
+            elapsed = timeit.default_timer() - start
+            assert len(res) == files
+            with open(os.path.join(tmpdir, 'dir0', 'file0'), 'rb') as fileobj:
+                assert fileobj.read(1) == b'x'
+            shutil.rmtree(tmpdir)
+            print('    {:<8} {:8.2f} ms'.format(label, elapsed * 1000))
+    finally:
+        shutil.rmtree(root)
+
+
+def _restored_tree(root):
+    """Text files, a random file and an already compressed one"""
+    os.mkdir(root)
+    with open(os.path.join(root, 'syslog'), 'wb') as fileobj:
+        for num in range(300000):
+            fileobj.write('Nov 28 10:00:00 host daemon[{}]: event {} done\n'.format(num % 977, num).encode('ascii'))
+    with open(os.path.join(root, 'random.bin'), 'wb') as fileobj:
+        fileobj.write(os.urandom(16 * 1024 * 1024))
+    with open(os.path.join(root, 'photo.jpg'), 'wb') as fileobj:
+        fileobj.write(os.urandom(4 * 1024 * 1024))
+    return sorted(os.listdir(root))
+
+
+def bench_compress():
+    """Generating the restoration archives"""
+    import shutil
+    import tarfile
+    import tempfile
+    import zipfile
+    from multiprocessing import cpu_count
+    from burpui.utils import BUIcompressStream
+    root = tempfile.mkdtemp()
+    try:
+        tree = os.path.join(root, 'tree')
+        names = _restored_tree(tree)
+        output = os.path.join(root, 'archive')
+
+        def _legacy(archive):
+            # what BUIcompress used to do
+            if archive == 'zip':
+                arch = zipfile.ZipFile(output, mode='w', compression=zipfile.ZIP_DEFLATED)
+                for name in names:
+                    arch.write(os.path.join(tree, name), name)
+            else:
+                arch = tarfile.open(output, 'w:gz')
+                for name in names:
+                    arch.add(os.path.join(tree, name), arcname=name, recursive=False)
+            arch.close()
+
+        def _stream(archive, level, jobs):
+            arch = BUIcompressStream(archive, level=level, jobs=jobs)
+            with open(output, 'wb') as fileobj:
+                for name in names:
+                    for chunk in arch.append(os.path.join(tree, name), name):
+                        fileobj.write(chunk)
+                for chunk in arch.close():
+                    fileobj.write(chunk)
+
+        print('  {} CPU'.format(cpu_count()))
+        for archive in ('zip', 'tar.gz'):
+            runs = [('legacy', lambda: _legacy(archive))]
+            for level, jobs in ((-1, 1), (-1, 4), (1, 4)):
+                runs.append((
+                    'level={} jobs={}'.format(level, jobs),
+                    lambda level=level, jobs=jobs: _stream(archive, level, jobs)
+                ))
+            for label, func in runs:
+                start = timeit.default_timer()
+                func()
+                elapsed = timeit.default_timer() - start
+                print('    {:<7} {:<18} {:8.2f} ms {:10d} bytes'.format(
+                    archive, label, elapsed * 1000, os.path.getsize(output)))
+    finally:
+        shutil.rmtree(root)
+
+
+def _legacy_recvall(sock, length):
+    """What the agent and NClient used to do"""
+    buf = b''
+    bsize = 1024
+    received = 0
+    if length < bsize:
+        bsize = length
+    while received < length:
+        newbuf = sock.recv(bsize)
+        if not newbuf:
+            return None
+        buf += newbuf
+        received += len(newbuf)
+    return buf
+
+
+def bench_framing(rounds=5):
+    """Receiving length-prefixed messages on loopback"""
+    import socket
+    import threading
+    from burpui.misc.protocol import LENGTH, recvall
+
+    def _reader(sock, length):
+        size, = LENGTH.unpack_from(recvall(sock, LENGTH.size))
+        return recvall(sock, size)
+
+    def _legacy_reader(sock, length):
+        size, = LENGTH.unpack(_legacy_recvall(sock, LENGTH.size))
+        return _legacy_recvall(sock, size)
+
+    def _receive(func, payload, size):
+        # one message per connection, like the historical protocol
+        server = socket.socket(socket.AF_INET)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        client = socket.create_connection(server.getsockname())
+        conn, _ = server.accept()
+        sender = threading.Thread(target=conn.sendall, args=(payload,))
+        start = timeit.default_timer()
+        sender.start()
+        assert len(func(client, size)) == size
+        elapsed = timeit.default_timer() - start
+        sender.join()
+        for sock in (client, conn, server):
+            sock.close()
+        return elapsed
+
+    for size in (64 * 1024, 1024 * 1024, 8 * 1024 * 1024):
+        payload = LENGTH.pack(size) + b'x' * size
+        for label, func in (('legacy', _legacy_reader), ('recv_into', _reader)):
+            elapsed = sum(_receive(func, payload, size) for _ in range(rounds))
+            print('    {:>8} KiB {:<10} {:8.2f} ms {:8.1f} MiB/s'.format(
+                size // 1024, label, elapsed * 1000, size * rounds / elapsed / 1024 / 1024))
+
+
+def bench_sendfile(size=256 * 1024 * 1024):
+    """Sending a restoration archive from the agent on loopback"""
+    import socket
+    import tempfile
+    import threading
+    from burpui.misc.protocol import RELAY_SIZE, sendfile
+
+    def _legacy(sock, fileobj):
+        # what the agent used to do
+        buf = fileobj.read(1024)
+        while buf:
+            sock.sendall(buf)
+            buf = fileobj.read(1024)
+
+    def _drain(sock, received):
+        buf = bytearray(RELAY_SIZE)
+        count = sock.recv_into(buf)
+        while count:
+            received.append(count)
+            count = sock.recv_into(buf)
+
+    with tempfile.NamedTemporaryFile() as archive:
+        block = os.urandom(1024 * 1024)
+        for _ in range(size // len(block)):
+            archive.write(block)
+        archive.flush()
+        for label, func in (('legacy', _legacy), ('sendfile', sendfile)):
+            server = socket.socket(socket.AF_INET)
+            server.bind(('127.0.0.1', 0))
+            server.listen(1)
+            client = socket.create_connection(server.getsockname())
+            conn, _ = server.accept()
+            received = []
+            reader = threading.Thread(target=_drain, args=(client, received))
+            reader.start()
+            with open(archive.name, 'rb') as fileobj:
+                start = timeit.default_timer()
+                func(conn, fileobj)
+                conn.shutdown(socket.SHUT_WR)
+                reader.join()
+                elapsed = timeit.default_timer() - start
+            assert sum(received) == size
+            for sock in (client, conn, server):
+                sock.close()
+            print('    {:<9} {:8.2f} ms {:8.1f} MiB/s'.format(
+                label, elapsed * 1000, size / elapsed / 1024 / 1024))
+
+
+def _agent_replies():
+    """Typical agent replies, JSON encoded"""
+    tree = [{
+        'name': 'file{}'.format(i),
+        'fullname': '/home/user/data/file{}'.format(i),
+        'parent': '/home/user/data',
+        'type': 'f',
+        'inodes': 1,
+        'uid': 1000,
+        'gid': 1000,
+        'mode': '-rw-r--r--',
+        'size': '{} KB'.format(i % 1000),
+        'date': '2016-11-28 10:00:{:02d}'.format(i % 60),
+        'selected': False,
+        'lazy': False,
+        'key': '/home/user/data/file{}'.format(i),
+        'folder': False,
+    } for i in range(10000)]
+    client = [{
+        'number': i,
+        'date': 1480000000 + i * 86400,
+        'deletable': i > 10,
+        'encrypted': False,
+        'received': 1024 * i,
+        'size': 4096 * i,
+    } for i in range(1000)]
+    history = [{
+        'title': 'Client: cli{} - Backup #{}'.format(i % 50, i),
+        'start': '2016-11-28T10:00:00+01:00',
+        'end': '2016-11-28T10:30:00+01:00',
+        'name': 'cli{}'.format(i % 50),
+        'backup': i,
+        'url': '/client/cli{}/backup/{}'.format(i % 50, i),
+    } for i in range(2000)]
+    return [
+        ('get_tree', json.dumps(tree).encode('UTF-8')),
+        ('get_client', json.dumps(client).encode('UTF-8')),
+        ('history', json.dumps(history).encode('UTF-8')),
+        ('small', json.dumps({'running': False}).encode('UTF-8')),
+    ]
+
+
+def bench_agent_compression(bandwidth=100):
+    """Compressing the agent replies (latency for a 100 Mbit/s link)"""
+    from burpui.misc.protocol import FRAME_OK, compress, decompress, supported_codecs
+    rate = bandwidth * 1000 * 1000 / 8.0
+    for name, reply in _agent_replies():
+        for codec in [None] + supported_codecs():
+            start = timeit.default_timer()
+            kind, payload = compress(FRAME_OK, reply, codec)
+            assert decompress(kind, payload, codec)[1] == reply
+            elapsed = timeit.default_timer() - start
+            print('    {:<10} {:<5} {:10d} bytes {:8.2f} ms codec {:8.2f} ms total'.format(
+                name, codec or 'none', len(payload), elapsed * 1000,
+                (elapsed + len(payload) / rate) * 1000))
+
+
+def bench_agent_serialization(rounds=5):
+    """Encoding and decoding the agent calls and replies"""
+    import pickle
+    from base64 import b64encode, b64decode
+    from werkzeug.datastructures import ImmutableMultiDict
+    from burpui.misc.protocol import dumps, loads, supported_serializers
+
+    form = ImmutableMultiDict([('key{}'.format(i % 100), 'value{}'.format(i)) for i in range(2000)])
+    call = {'func': 'store_conf_cli', 'args': {'data': form, 'conf': None, 'client': 'toto'}}
+
+    def _legacy_call():
+        # what NClient and the agent used to do
+        raw = json.dumps({
+            'func': call['func'],
+            'args': b64encode(pickle.dumps(call['args'], -1)).decode('ascii'),
+            'pickled': True
+        })
+        res = json.loads(raw)
+        pickle.loads(b64decode(res['args']))
+        return raw.encode('UTF-8')
+
+    def _roundtrip(obj, serializer):
+        raw = dumps(obj, serializer)
+        loads(raw, serializer)
+        return raw
+
+    runs = [('store_conf', 'json+pickle', _legacy_call)]
+    if 'msgpack' in supported_serializers():
+        runs.append(('store_conf', 'msgpack', lambda: _roundtrip(call, 'msgpack')))
+    for name, reply in _agent_replies():
+        obj = json.loads(reply.decode('UTF-8'))
+        for serializer in supported_serializers():
+            runs.append((name, serializer, lambda obj=obj, serializer=serializer: _roundtrip(obj, serializer)))
+    for name, label, func in runs:
+        size = len(func())
+        elapsed = min(timeit.repeat(func, number=1, repeat=rounds))
+        print('    {:<10} {:<11} {:10d} bytes {:8.2f} ms'.format(name, label, size, elapsed * 1000))
+
+
+def bench_tls_handshake(connections=50):
+    """Opening SSL connections to an agent on loopback"""
+    import ssl
+    import shutil
+    import socket
+    import tempfile
+    import threading
+    import subprocess
+    root = tempfile.mkdtemp()
+    try:
+        cert = os.path.join(root, 'cert.pem')
+        key = os.path.join(root, 'key.pem')
+        try:
+            subprocess.check_call(
+                ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+                 '-keyout', key, '-out', cert, '-days', '1', '-subj', '/CN=agent'],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+        except (OSError, subprocess.CalledProcessError):
+            print('    openssl not found, skipped')
+            return
+        srvctx = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        srvctx.load_cert_chain(cert, key)
+
+        def _legacy_server(sock):
+            # what the agent used to do: a new context for each connection
+            return ssl.wrap_socket(sock, keyfile=key, certfile=cert, server_side=True)
+
+        def _server(sock):
+            return srvctx.wrap_socket(sock, server_side=True)
+
+        def _legacy_client(sock, state):
+            # what NClient used to do
+            return ssl.wrap_socket(sock, cert_reqs=ssl.CERT_NONE, ssl_version=ssl.PROTOCOL_SSLv23)
+
+        def _client(sock, state):
+            if 'ctx' not in state:
+                state['ctx'] = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+                state['ctx'].verify_mode = ssl.CERT_NONE
+            kwargs = {}
+            if state.get('session') is not None:
+                kwargs['session'] = state['session']
+            return state['ctx'].wrap_socket(sock, **kwargs)
+
+        def _run(server_wrap, client_wrap):
+            listener = socket.socket(socket.AF_INET)
+            listener.bind(('127.0.0.1', 0))
+            listener.listen(5)
+
+            def _serve():
+                for _ in range(connections):
+                    conn, _ = listener.accept()
+                    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    conn = server_wrap(conn)
+                    conn.sendall(b'OK')
+                    conn.recv(1)
+                    conn.close()
+
+            thread = threading.Thread(target=_serve)
+            thread.start()
+            state = {}
+            resumed = 0
+            start = timeit.default_timer()
+            for _ in range(connections):
+                sock = socket.create_connection(listener.getsockname())
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock = client_wrap(sock, state)
+                assert sock.recv(2) == b'OK'
+                state['session'] = getattr(sock, 'session', None)
+                resumed += getattr(sock, 'session_reused', False) and 1 or 0
+                sock.sendall(b'.')
+                sock.close()
+            elapsed = timeit.default_timer() - start
+            thread.join()
+            listener.close()
+            return elapsed, resumed
+
+        for label, server_wrap, client_wrap in (
+                ('legacy', _legacy_server, _legacy_client),
+                ('resumed', _server, _client)):
+            elapsed, resumed = _run(server_wrap, client_wrap)
+            print('    {:<8} {:8.2f} ms per connection, {}/{} sessions resumed'.format(
+                label, elapsed * 1000 / connections, resumed, connections))
+    finally:
+        shutil.rmtree(root)
+
+
+def main(names):
+    benches = dict(
+        (key[6:], val) for key, val in globals().items() if key.startswith('bench_')
+    )
+    for name in names or sorted(benches):
+        print('{}: {}'.format(name, benches[name].__doc__))
+        benches[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
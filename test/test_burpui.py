@@ -360,6 +360,860 @@ class BurpuiTestInit(TestCase):
         self.assertRaises(ImportError, BUIinit, conf3, False, None, False, unittest=True)
 
 
+class BurpuiBackendUtilsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        print ('\nBegin Test 8\n')
+
+    def tearDown(self):
+        print ('\nTest 8 Finished!\n')
+
+    def test_json_frame_decoder(self):
+        from burpui.misc.backend.burp2 import LOGLINE
+        from burpui.misc.backend.utils import JSONFrameDecoder
+        decoder = JSONFrameDecoder(skip=LOGLINE.match)
+        data = (
+            b'{"logline": "Server version: 2.0.40"}\n'
+            b'{\n  "warning": "pretty {print} \\"off\\""\n}\n'
+            b'Could not connect\n'
+            b'{"clients": [{"name": "toto"}]}\n{"clients": '
+        )
+        docs = []
+        # feed the decoder byte per byte to split documents everywhere
+        for idx in range(len(data)):
+            decoder.feed(data[idx:idx + 1])
+            docs += list(decoder)
+        self.assertEqual(docs, [
+            {u'warning': u'pretty {print} "off"'},
+            {u'clients': [{u'name': u'toto'}]},
+        ])
+        decoder.feed(b'[]}\n')
+        self.assertEqual(list(decoder), [{u'clients': []}])
+
+    def test_backup_stats_store(self):
+        from burpui.misc.backend.utils import BackupStatsStore
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, 'stats.db')
+        try:
+            store = BackupStatsStore(path)
+            store.put('toto', 1, 1000, {'end': 1010})
+            store.put('toto', 2, 2000, {'end': 2010})
+            self.assertEqual(BackupStatsStore(path).get('toto', '1', '1000'), {u'end': 1010})
+            # backup 2 number was reused before the store was pruned
+            self.assertIsNone(store.get('toto', 2, 3000))
+            # backup 1 disappeared and backup 2 number was reused
+            store.prune('toto', {2: 3000, 3: 4000})
+            self.assertIsNone(store.get('toto', 1, 1000))
+            self.assertIsNone(store.get('toto', 2, 2000))
+            self.assertIsNone(BackupStatsStore(None).get('toto', 1, 1000))
+            # the database is only created when used
+            lazy = os.path.join(tmpdir, 'lazy.db')
+            store = BackupStatsStore(lazy)
+            self.assertFalse(os.path.exists(lazy))
+            self.assertIsNone(store.get('toto', 1, 1000))
+            self.assertTrue(os.path.exists(lazy))
+        finally:
+            import shutil
+            shutil.rmtree(tmpdir)
+
+    def test_burp2_backup_logs_store(self):
+        import shutil
+        from burpui.misc.backend.burp2 import Burp
+        from burpui.misc.backend.utils import BackupStatsStore
+        tmpdir = tempfile.mkdtemp()
+        try:
+            backend = object.__new__(Burp)
+            backend.store = BackupStatsStore(os.path.join(tmpdir, 'stats.db'))
+            backend.store.put('toto', 1, 1000, {'end': 1010, 'encrypted': False})
+            queries = []
+
+            def status(query='c:\n', agent=None):
+                queries.append(query)
+                return {'clients': [{'name': 'toto', 'backups': [
+                    {'number': 2, 'timestamp': 2000},
+                    {'number': 1, 'timestamp': 1000},
+                ]}]}
+
+            def status_pipeline(batch, agent=None):
+                queries.extend(batch)
+                return [None] * len(batch)
+
+            backend.status = status
+            backend.status_pipeline = status_pipeline
+            self.assertEqual(backend.get_backup_logs(1, 'toto'), {'end': 1010, 'encrypted': False})
+            self.assertEqual(queries, ['c:toto\n'])
+            # not stored yet
+            self.assertEqual(backend.get_backup_logs(2, 'toto'), {})
+            self.assertEqual(queries[1:], ['c:toto\n', 'c:toto:b:2:l:backup_stats\n'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_snapshot_collector(self):
+        from burpui.misc.backend.utils import SnapshotCollector
+
+        class Backend(object):
+            logger = None
+
+            def _get_clients_state(self):
+                return [
+                    {'name': 'toto', 'state': 'running', 'last': 'now', 'labels': ['a']},
+                    {'name': 'tata', 'state': 'idle', 'last': 1000},
+                    {'name': 'titi', 'state': 'backup', 'last': 1000},
+                    {'name': 'tutu', 'state': 'client crashed', 'last': 1000},
+                ]
+
+        collector = SnapshotCollector(Backend(), 0)
+        collector.start()
+        self.assertIsNone(collector.thread)
+        self.assertIsNone(collector.get())
+        collector.interval = 10
+        snap = collector.refresh()
+        self.assertIs(collector.get(), snap)
+        self.assertEqual(snap.running, set(['toto', 'titi']))
+        self.assertEqual(snap.labels, {'toto': ['a']})
+        self.assertNotIn('labels', snap.index['toto'])
+        snap.time -= 30
+        self.assertIsNone(collector.get())
+
+    def test_circuit_breaker(self):
+        from burpui.exceptions import BUIserverException
+        from burpui.misc.backend.utils import CircuitBreaker
+
+        def call(breaker, fail=False, error=IOError):
+            with breaker:
+                if fail:
+                    raise error('burp is down')
+                return True
+
+        breaker = CircuitBreaker()
+        self.assertTrue(call(breaker))
+        # burp answered, the query itself is wrong
+        self.assertRaises(BUIserverException, call, breaker, True, BUIserverException)
+        self.assertRaises(ValueError, call, breaker, True, ValueError)
+        self.assertEqual(breaker.get_state()['state'], 'closed')
+        self.assertRaises(IOError, call, breaker, True)
+        self.assertEqual(breaker.get_state()['state'], 'open')
+        # fail fast with the cached error while open
+        self.assertRaises(BUIserverException, call, breaker)
+        breaker.retry = 0
+        # half-open: the probe fails and the backoff doubles
+        self.assertRaises(IOError, call, breaker, True)
+        self.assertEqual(breaker.get_state()['failures'], 2)
+        self.assertGreater(breaker.retry, 0)
+        breaker.retry = 0
+        self.assertTrue(call(breaker))
+        self.assertEqual(breaker.get_state(), {'state': 'closed', 'failures': 0, 'retry': 0, 'error': None})
+
+    def test_monitor_pool_breaker(self):
+        from burpui.exceptions import BUIserverException
+        from burpui.misc.backend.burp2 import Burp, MonitorPool
+        from burpui.misc.backend.utils import CircuitBreaker
+
+        class Monitor(object):
+            def revive(self):
+                raise OSError('No such file or directory')
+
+        backend = object.__new__(Burp)
+        backend.breaker = CircuitBreaker()
+        backend.timeout = 0.01
+        # every monitor is busy: burp is not down
+        backend.pool = MonitorPool(backend, 0)
+        self.assertRaises(BUIserverException, backend._status, 'c:\n')
+        self.assertRaises(BUIserverException, backend.status_pipeline, ['c:'])
+        self.assertEqual(backend.breaker.get_state()['state'], 'closed')
+        # a monitor that cannot be spawned is a failure
+        backend.pool.idle.put(Monitor())
+        self.assertRaises(BUIserverException, backend._status, 'c:\n')
+        self.assertEqual(backend.breaker.get_state()['state'], 'open')
+
+    def test_single_flight(self):
+        import threading
+        import time
+        from burpui.misc.backend.utils import SingleFlight
+        calls = []
+
+        def query(key):
+            calls.append(key)
+            time.sleep(0.2)
+            return [key]
+
+        flight = SingleFlight()
+        res = []
+        threads = [
+            threading.Thread(target=lambda: res.append(flight.do('c:\n', query, 'c:\n')))
+            for _ in range(5)
+        ]
+        [x.start() for x in threads]
+        [x.join() for x in threads]
+        self.assertEqual(res, [['c:\n']] * 5)
+        self.assertEqual(calls, ['c:\n'])
+        # no ttl: the next call is sent again
+        flight.do('c:\n', query, 'c:\n')
+        self.assertEqual(len(calls), 2)
+        flight.ttl = 10
+        flight.do('c:\n', query, 'c:\n').append('modified')
+        self.assertEqual(flight.do('c:\n', query, 'c:\n'), ['c:\n'])
+        self.assertEqual(len(calls), 3)
+
+    def test_parse_backup_log(self):
+        import time
+        import datetime
+        from burpui.misc.backend.burp1 import Burp
+        log = [
+            '2016-11-28 10:00:00: bui[4242] Client version: 1.4.40',
+            '2016-11-28 10:00:00: bui[4242] Client is Windows',
+            '2016-11-28 10:00:01: bui[4242] WARNING: /home/file: Permission denied',
+            '----------------------------------------------------------------',
+            'Start time: 2016-11-28 10:00:00',
+            '  End time: 2016-11-28 10:42:17',
+            'Time taken: 42:17',
+            '                     New   Changed Unchanged   Deleted     Total |   Scanned',
+            '           Files:    139         2     10231         0     10372 |     10372',
+            '     Directories:     14         0      1420         0      1434 |      1434',
+            '  Meta data(enc):      0         0         0         0         0 |         0',
+            'VSS headers (enc):     0         0         0         0         0 |         0',
+            '     Grand total:    153         2     11665         0     11820 |     11820',
+            '----------------------------------------------------------------',
+            '      Bytes in backup:     734839265 (700.80 MB)',
+            '----------------------------------------------------------------',
+            '      Bytes in backup:     734839265 (700.80 MB)',
+            '       Bytes received:       2319552 (2.21 MB)',
+            '----------------------------------------------------------------',
+        ]
+
+        def stamp(date):
+            return int(time.mktime(datetime.datetime.strptime(date, '%Y-%m-%d %H:%M:%S').timetuple()))
+
+        def counters(new, changed, unchanged, total):
+            return {
+                'new': new,
+                'changed': changed,
+                'unchanged': unchanged,
+                'deleted': 0,
+                'total': total,
+                'scanned': total
+            }
+
+        backend = Burp(dummy=True)
+        self.assertEqual(backend._parse_backup_log(log, '3', 'toto'), {
+            'name': 'toto',
+            'number': 3,
+            'windows': 'true',
+            'start': stamp('2016-11-28 10:00:00'),
+            'end': stamp('2016-11-28 10:42:17'),
+            'duration': 2537,
+            'files': counters(139, 2, 10231, 10372),
+            'dir': counters(14, 0, 1420, 1434),
+            'meta_enc': counters(0, 0, 0, 0),
+            'vssheader_enc': counters(0, 0, 0, 0),
+            'total': counters(153, 2, 11665, 11820),
+            'totsize': 734839265,
+            'received': 2319552
+        })
+        # truncated counters make the whole log unusable
+        log[8] = '           Files:    139         2 |     10372'
+        self.assertEqual(backend._parse_backup_log(log, 3), {})
+
+    def test_one_backup_running(self):
+        from burpui.misc.backend.burp1 import Burp
+        from burpui.misc.backend.utils import SnapshotCollector
+        queries = []
+
+        def status(query='\n', agent=None):
+            queries.append(query)
+            return [
+                'toto\t1\ti\t1 0 1480000000',
+                'tata\t1\tr\t2\t0',
+                'titi\t1\ti\t0',
+                'tutu\t1\tr\t1\t0',
+            ]
+
+        backend = Burp(dummy=True)
+        backend.status = status
+        backend.collector = SnapshotCollector(backend)
+        self.assertEqual(backend.is_one_backup_running(), ['tata', 'tutu'])
+        self.assertEqual(backend.running, ['tata', 'tutu'])
+        self.assertEqual(queries, ['\n'])
+
+    def test_vss_headers(self):
+        import struct
+        from burpui.misc.backend.utils import has_vss_headers
+        _, path = tempfile.mkstemp()
+        try:
+            with open(path, 'wb') as fileobj:
+                fileobj.write(struct.pack('<2LQL', 3, 0, 4, 0) + b'\0' * 4)
+                fileobj.write(struct.pack('<2LQL', 1, 0, 4, 0) + b'data')
+            self.assertTrue(has_vss_headers(path))
+            with open(path, 'wb') as fileobj:
+                fileobj.write(b'root:x:0:0:root:/root:/bin/bash\n')
+            self.assertFalse(has_vss_headers(path))
+            # truncated stream
+            with open(path, 'wb') as fileobj:
+                fileobj.write(struct.pack('<2LQL', 1, 0, 4096, 0) + b'data')
+            self.assertFalse(has_vss_headers(path))
+        finally:
+            os.unlink(path)
+
+    def test_compress_stream(self):
+        import io
+        import shutil
+        import tarfile
+        import zipfile
+        from burpui.utils import BUIcompressStream
+        tmpdir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(tmpdir, 'etc'))
+            with open(os.path.join(tmpdir, 'etc', 'passwd'), 'wb') as fileobj:
+                fileobj.write(b'root:x:0:0:root:/root:/bin/bash\n' * 5000)
+            os.symlink('etc/passwd', os.path.join(tmpdir, 'link'))
+            random = os.urandom(300 * 1024)
+            with open(os.path.join(tmpdir, 'random.bin'), 'wb') as fileobj:
+                fileobj.write(random)
+            for archive, level, jobs in [('zip', -1, 1), ('zip', 0, 1), ('zip', 9, 2),
+                                         ('tar', -1, 1), ('tar.gz', -1, 1),
+                                         ('tar.gz', 1, 2), ('tar.bz2', -1, 1)]:
+                stream = BUIcompressStream(archive, chunk=1024, level=level, jobs=jobs)
+                data = b''
+                for name in ['etc/passwd', 'link', 'random.bin']:
+                    for chunk in stream.append(os.path.join(tmpdir, name), name):
+                        data += chunk
+                for chunk in stream.close():
+                    data += chunk
+                if archive == 'zip':
+                    arch = zipfile.ZipFile(io.BytesIO(data))
+                    self.assertIsNone(arch.testzip())
+                    self.assertEqual(arch.namelist(), ['etc/passwd', 'link', 'random.bin'])
+                    self.assertEqual(arch.read('link'), b'etc/passwd')
+                    # incompressible files are stored
+                    self.assertEqual(arch.getinfo('random.bin').compress_type, zipfile.ZIP_STORED)
+                    self.assertEqual(arch.getinfo('etc/passwd').compress_type,
+                                     zipfile.ZIP_STORED if level == 0 else zipfile.ZIP_DEFLATED)
+                    content = arch.read('etc/passwd')
+                    self.assertEqual(arch.read('random.bin'), random)
+                else:
+                    arch = tarfile.open(fileobj=io.BytesIO(data))
+                    self.assertEqual(arch.getnames(), ['etc/passwd', 'link', 'random.bin'])
+                    self.assertEqual(arch.getmember('link').linkname, 'etc/passwd')
+                    content = arch.extractfile('etc/passwd').read()
+                    self.assertEqual(arch.extractfile('random.bin').read(), random)
+                self.assertEqual(content, b'root:x:0:0:root:/root:/bin/bash\n' * 5000)
+                self.assertEqual(stream.files, 3)
+                self.assertEqual(stream.size, 32 * 5000 + 300 * 1024)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_restore_cache(self):
+        import time
+        import shutil
+        from burpui.misc.restore import RestoreCache
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cache = RestoreCache(tmpdir, 3600, 1)
+            files = '{"restore":[{"folder":true,"key":"/etc"},{"folder":false,"key":"/root/a.txt"}]}'
+            same = '{"restore":[{"folder":false,"key":"/root/a.txt"},{"folder":true,"key":"/etc"}]}'
+            key = cache.key('client', 1, files, 0, 'zip', None, 42)
+            self.assertEqual(key, cache.key('client', '1', same, None, 'zip', None, '42'))
+            self.assertNotEqual(key, cache.key('client', 1, files, 1, 'zip', None, 42))
+            self.assertNotEqual(key, cache.key('client', 1, files, 0, 'tar.gz', None, 42))
+            self.assertNotEqual(key, cache.key('client', 2, files, 0, 'zip', None, 42))
+            self.assertNotEqual(key, cache.key('client', 1, files, 0, 'zip', 'agent', 42))
+            # same number but another backup
+            self.assertNotEqual(key, cache.key('client', 1, files, 0, 'zip', None, 43))
+            self.assertIsNone(cache.key('client', 1, files, 0, 'zip'))
+            self.assertIsNone(cache.key('client', 1, '{"wrong":[]}', timestamp=42))
+            self.assertIsNone(cache.key('client', 1, 'garbage', timestamp=42))
+            self.assertIsNone(cache.get(key))
+
+            # the archive is cached once it has been entirely sent
+            stream = cache.store(key, iter([b'a' * 1024, b'b' * 1024]))
+            next(stream)
+            stream.close()
+            self.assertIsNone(cache.get(key))
+            self.assertEqual(b''.join(cache.store(key, iter([b'a' * 1024, b'b' * 1024]))), b'a' * 1024 + b'b' * 1024)
+            with open(cache.get(key), 'rb') as archive:
+                self.assertEqual(archive.read(), b'a' * 1024 + b'b' * 1024)
+            self.assertEqual(os.listdir(tmpdir), [key + '.archive'])
+
+            # too big to be cached
+            other = cache.key('client', 2, files, timestamp=42)
+            self.assertEqual(len(b''.join(cache.store(other, iter([b'x' * 1024 * 1024] * 2)))), 2 * 1024 * 1024)
+            self.assertIsNone(cache.get(other))
+
+            # least recently used archives are evicted first
+            keys = [cache.key('client', num, files, timestamp=42) for num in range(3, 6)]
+            for num, name in enumerate(keys):
+                b''.join(cache.store(name, iter([b'x' * 400 * 1024])))
+                os.utime(cache.get(name), (time.time() + num, time.time()))
+            self.assertIsNone(cache.get(key))
+            self.assertIsNone(cache.get(keys[0]))
+            self.assertIsNotNone(cache.get(keys[1]))
+            self.assertIsNotNone(cache.get(keys[2]))
+
+            # expired
+            os.utime(cache.get(keys[1]), (time.time(), time.time() - 7200))
+            self.assertIsNone(cache.get(keys[1]))
+
+            # disabled
+            self.assertIsNone(RestoreCache(tmpdir, 3600, 0).key('client', 1, files, timestamp=42))
+
+            # private directory
+            private = os.path.join(tmpdir, 'spool', 'cache')
+            RestoreCache(private, 3600, 1)
+            self.assertEqual(os.stat(private).st_mode & 0o777, 0o700)
+            self.assertEqual(os.stat(os.path.dirname(private)).st_mode & 0o777, 0o700)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_restore_jobs(self):
+        import time
+        import shutil
+        from burpui.exceptions import BUIserverException
+        from burpui.misc.restore import RestoreJobs
+        from burpui.utils import BUIprogressStream
+
+        class Backend(object):
+            def restore_files_stream(self, name, backup, files, strip, archive, password, agent):
+                if password != 'secret':
+                    return None, 'wrong password'
+                return BUIprogressStream(iter([b'PK', files.encode('utf-8')])), None
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            jobs = RestoreJobs(Backend(), 1, 1, tmpdir, 3600)
+
+            def _wait(jobid):
+                for _ in range(50):
+                    job = jobs.get(jobid)
+                    if job['status'] not in jobs.pending:
+                        return job
+                    time.sleep(0.1)
+                self.fail('job {} did not finish'.format(jobid))
+
+            job = jobs.submit('toto', 'client', 1, '/etc', password='secret')
+            self.assertEqual(job['status'], 'queued')
+            job = _wait(job['id'])
+            self.assertEqual(job['status'], 'done')
+            self.assertEqual(job['size'], 6)
+            with open(jobs.archive(job['id']), 'rb') as archive:
+                self.assertEqual(archive.read(), b'PK/etc')
+            # the password is never stored
+            with open(os.path.join(tmpdir, job['id'] + '.json')) as state:
+                self.assertNotIn('secret', state.read())
+
+            failed = jobs.submit('toto', 'client', 1, '/etc', password='wrong')
+            failed = _wait(failed['id'])
+            self.assertEqual(failed['status'], 'failed')
+            self.assertEqual(failed['error'], 'wrong password')
+            self.assertIsNone(jobs.archive(failed['id']))
+            self.assertEqual(len(jobs.list('toto')), 2)
+            self.assertEqual(jobs.list('tata'), [])
+
+            # per-user limit
+            with open(os.path.join(tmpdir, 'slot-0.lock'), 'w') as slot:
+                import fcntl
+                fcntl.flock(slot, fcntl.LOCK_EX)
+                queued = jobs.submit('toto', 'client', 1, '/etc', password='secret')
+                with self.assertRaises(BUIserverException):
+                    jobs.submit('toto', 'client', 1, '/etc', password='secret')
+                self.assertTrue(jobs.cancel(queued['id']))
+            self.assertEqual(_wait(queued['id'])['status'], 'cancelled')
+
+            # a job left running by a dead process does not hold the user
+            stale = dict(job, id='stale', status='running', finished=None,
+                         created=time.time() - 3600)
+            with open(os.path.join(tmpdir, 'stale.json'), 'w') as state:
+                json.dump(stale, state)
+            self.assertIn('stale', [x['id'] for x in jobs.list('toto')])
+            stale = jobs.get('stale')
+            self.assertEqual(stale['status'], 'failed')
+            self.assertEqual(stale['error'], 'The restoration was interrupted')
+            jobs.cancel(jobs.submit('toto', 'client', 1, '/etc', password='secret')['id'])
+
+            self.assertTrue(jobs.cancel(job['id']))
+            self.assertIsNone(jobs.get(job['id']))
+            self.assertFalse(jobs.cancel(job['id']))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_mux_protocol(self):
+        import socket
+        import threading
+        from burpui.misc.protocol import MuxClient, FRAME_CALL, FRAME_OK, \
+            pack_frame, read_frame
+        client, agent = socket.socketpair()
+        timedout = threading.Event()
+
+        def serve():
+            # answer the two calls in the reverse order
+            calls = [read_frame(agent), read_frame(agent)]
+            for reqid, kind, payload in reversed(calls):
+                self.assertEqual(kind, FRAME_CALL)
+                agent.sendall(pack_frame(reqid, FRAME_OK, payload.upper()))
+            # the third call never gets its reply
+            read_frame(agent)
+            timedout.wait(5)
+            agent.close()
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        mux = MuxClient(client)
+        res = {}
+
+        def call(payload):
+            res[payload] = mux.call(payload, 5)
+
+        threads = [threading.Thread(target=call, args=(x,)) for x in (b'foo', b'bar')]
+        [x.start() for x in threads]
+        [x.join() for x in threads]
+        self.assertEqual(res, {b'foo': (FRAME_OK, b'FOO'), b'bar': (FRAME_OK, b'BAR')})
+        with self.assertRaises(socket.timeout):
+            mux.call(b'baz', 0.1)
+        timedout.set()
+        thread.join()
+        mux.reader.join()
+        self.assertTrue(mux.closed)
+        with self.assertRaises(socket.error):
+            mux.call(b'baz', 1)
+
+    def test_agent_connections(self):
+        import struct
+        import gevent
+        from gevent import socket
+        from burpui.agent import BUIAgent
+        from burpui.misc.protocol import FRAME_CALL, FRAME_OK, pack_frame, \
+            read_frame, read_message, recvall
+
+        class Backend(object):
+            def ping(self):
+                return 'pong'
+
+        agent = BUIAgent.__new__(BUIAgent)
+        agent.password = 'secret'
+        agent.pool = None
+        agent.subscribers = {}
+        agent.cli = Backend()
+        conns = []
+        for _ in range(2):
+            client, server = socket.socketpair()
+            gevent.spawn(agent.handle, server, None)
+            hello = json.dumps({'password': 'secret', 'func': 'hello', 'args': None}).encode('utf-8')
+            client.sendall(struct.pack('!Q', len(hello)) + hello)
+            self.assertEqual(recvall(client, 2), b'OK')
+            self.assertIsNotNone(read_message(client))
+            conns.append(client)
+        # closing a multiplexed connection does not close the others
+        conns[0].close()
+        gevent.sleep(0.1)
+        call = json.dumps({'func': 'ping', 'args': None}).encode('utf-8')
+        conns[1].sendall(pack_frame(1, FRAME_CALL, call))
+        reqid, kind, payload = read_frame(conns[1])
+        self.assertEqual((reqid, kind), (1, FRAME_OK))
+        self.assertEqual(json.loads(bytes(payload).decode('utf-8')), 'pong')
+        conns[1].close()
+
+    def test_agent_collect(self):
+        from burpui.agent import BUIAgent
+
+        class Backend(object):
+            def is_one_backup_running(self):
+                return []
+
+            def get_all_clients(self):
+                return [
+                    {'name': 'toto', 'state': 'running'},
+                    {'name': 'titi', 'state': 'backup'},
+                    {'name': 'tutu', 'state': 'client crashed'},
+                    {'name': 'tata', 'state': 'idle'},
+                ]
+
+            def get_counters(self, name=None):
+                return {'percent': 50}
+
+        agent = BUIAgent.__new__(BUIAgent)
+        agent.cli = Backend()
+        _, counters = agent._collect()
+        # same running clients as the live view
+        self.assertEqual(sorted(counters), ['titi', 'toto'])
+
+    def test_stream_error(self):
+        import socket
+        from burpui.misc.protocol import LENGTH, pack_stream_error, read_chunk
+        sender, receiver = socket.socketpair()
+        try:
+            sender.sendall(LENGTH.pack(3) + b'abc' + pack_stream_error('disk full'))
+            self.assertEqual(read_chunk(receiver), b'abc')
+            with self.assertRaises(IOError) as ctx:
+                read_chunk(receiver)
+            self.assertEqual(str(ctx.exception), 'disk full')
+            sender.sendall(LENGTH.pack(0))
+            self.assertEqual(read_chunk(receiver), b'')
+            sender.close()
+            self.assertRaises(IOError, read_chunk, receiver)
+        finally:
+            receiver.close()
+
+    def test_frame_compression(self):
+        from burpui.misc.protocol import FRAME_OK, COMPRESSED, COMPRESS_MIN, \
+            compress, decompress, choose_codec, supported_codecs
+        self.assertIn('zlib', supported_codecs())
+        self.assertEqual(choose_codec(['snappy', 'zlib']), 'zlib')
+        self.assertIsNone(choose_codec(['snappy']))
+        self.assertIsNone(choose_codec(None))
+        small = b'{"name": "toto"}'
+        self.assertEqual(compress(FRAME_OK, small, 'zlib'), (FRAME_OK, small))
+        big = json.dumps([{'name': 'file{}'.format(x), 'size': 4096} for x in range(1000)]).encode('UTF-8')
+        self.assertGreater(len(big), COMPRESS_MIN)
+        self.assertEqual(compress(FRAME_OK, big), (FRAME_OK, big))
+        for codec in supported_codecs():
+            kind, payload = compress(FRAME_OK, big, codec)
+            self.assertEqual(kind, FRAME_OK | COMPRESSED)
+            self.assertLess(len(payload), len(big))
+            self.assertEqual(decompress(kind, bytearray(payload), codec), (FRAME_OK, big))
+        # incompressible payloads are sent as is
+        noise = os.urandom(COMPRESS_MIN * 2)
+        self.assertEqual(compress(FRAME_OK, noise, 'zlib'), (FRAME_OK, noise))
+
+    def test_serializers(self):
+        from collections import OrderedDict
+        from werkzeug.datastructures import ImmutableMultiDict
+        from burpui.misc.protocol import dumps, loads, choose_serializer, \
+            supported_serializers
+        self.assertIn('json', supported_serializers())
+        self.assertEqual(choose_serializer(['protobuf', 'json']), 'json')
+        self.assertEqual(choose_serializer(None), 'json')
+        obj = {
+            'func': 'get_tree',
+            'args': {'name': u'tötö', 'backup': 1, 'root': None, 'pwd': (1, 2.5, True)},
+            'options': OrderedDict([('a', [{'b': False}])]),
+        }
+        expected = json.loads(json.dumps(obj))
+        for serializer in supported_serializers():
+            self.assertEqual(loads(bytearray(dumps(obj, serializer)), serializer), expected)
+        if 'msgpack' in supported_serializers():
+            # the forms survive without being pickled
+            form = ImmutableMultiDict([('a', '1'), ('a', '2'), ('b', u'é')])
+            res = loads(dumps({'data': form}, 'msgpack'), 'msgpack')['data']
+            self.assertIsInstance(res, ImmutableMultiDict)
+            self.assertEqual(list(res.items(multi=True)), list(form.items(multi=True)))
+
+    def test_multi_call(self):
+        from burpui.misc.backend.burp1 import Burp
+        from burpui.exceptions import BUIserverException
+        backend = Burp(dummy=True)
+
+        def get_client(name=None, agent=None):
+            if name == 'unknown':
+                raise BUIserverException('Cannot contact burp server')
+            return [{'number': 1}]
+
+        backend.get_client = get_client
+        res = backend.multi_call([
+            ('get_client_labels', {'client': 'toto'}),
+            ('get_client', {'name': 'toto'}),
+            ('get_client', {'name': 'unknown'}),
+            ('_restore', {}),
+            ('multi_call', {'calls': []}),
+        ])
+        self.assertEqual(res[:3], [
+            {'result': [], 'error': None},
+            {'result': [{'number': 1}], 'error': None},
+            {'result': None, 'error': 'Cannot contact burp server'},
+        ])
+        for call in res[3:]:
+            self.assertIsNone(call['result'])
+            self.assertIn('Wrong method call', call['error'])
+
+    def test_nclient_multi_call(self):
+        from burpui.misc.backend.multi import NClient
+        from burpui.exceptions import BUIserverException, BUIagentUnsupported
+        client = object.__new__(NClient)
+        client.host, client.port, client.nobatch = 'agent', 10000, 0
+        answers = {}
+        sent = []
+
+        def call(data, strict=False):
+            self.assertTrue(strict)
+            sent.append(data['func'])
+            res = answers[data['func']]
+            if isinstance(res, Exception):
+                raise res
+            return res
+
+        client.call = call
+        calls = [('get_client', {'name': 'toto'}), ('get_client', {'name': 'titi'})]
+        # an unreachable agent is not mistaken for an old one
+        answers['multi_call'] = BUIserverException('Unable to reach agent agent:10000: timed out')
+        self.assertEqual(client.multi_call(calls), [
+            {'result': None, 'error': 'Unable to reach agent agent:10000: timed out'},
+        ] * 2)
+        self.assertEqual(sent, ['multi_call'])
+        self.assertEqual(client.nobatch, 0)
+        # old agents get the calls one by one, and are remembered
+        answers['multi_call'] = BUIagentUnsupported('Unknown method multi_call')
+        answers['get_client'] = [{'number': 1}]
+        for _ in range(2):
+            self.assertEqual(client.multi_call(calls), [
+                {'result': [{'number': 1}], 'error': None},
+            ] * 2)
+        self.assertEqual(sent, ['multi_call'] * 2 + ['get_client'] * 4)
+        self.assertNotEqual(client.nobatch, 0)
+        answers['get_client'] = BUIserverException('Unable to reach agent agent:10000: timed out')
+        self.assertIsNone(client.multi_call(calls)[0]['result'])
+
+    def test_read_cache(self):
+        from burpui.misc.backend.burp1 import Burp
+        from burpui.misc.backend.utils import ReadCache
+        backend = Burp(dummy=True)
+        state = {'last': 1, 'state': 'idle'}
+        calls = []
+
+        def get_client(name=None, agent=None):
+            calls.append(name)
+            return [{'number': len(calls)}]
+
+        backend._get_clients_state = lambda: [dict(state, name='toto')]
+        cache = ReadCache(backend, 10, 0)
+        func = cache.wrap('get_client', get_client)
+        self.assertEqual(func(name='toto'), [{'number': 1}])
+        self.assertEqual(func(name='toto'), [{'number': 1}])
+        self.assertEqual(calls, ['toto'])
+        # a new backup invalidates the entry
+        state['last'] = 2
+        self.assertEqual(func(name='toto'), [{'number': 2}])
+        # nothing is cached while the client is running
+        state['state'] = 'running'
+        func(name='toto')
+        func(name='toto')
+        self.assertEqual(len(calls), 4)
+        # unknown clients and the other methods are not cached
+        func(name='unknown')
+        func(name='unknown')
+        self.assertEqual(len(calls), 6)
+        self.assertIs(cache.wrap('get_counters', get_client), get_client)
+        self.assertIs(ReadCache(backend, 0).wrap('get_client', get_client), get_client)
+        # the callers get their own copy
+        state['state'] = 'idle'
+        func(name='toto').append('garbage')
+        self.assertEqual(func(name='toto'), [{'number': 2}])
+
+        # the labels follow the configuration of the client
+        import shutil
+        confdir = tempfile.mkdtemp()
+        try:
+            conf = os.path.join(confdir, 'toto')
+            with open(conf, 'w') as handle:
+                handle.write('label = a\n')
+
+            class Parser(object):
+                clientconfdir = confdir
+
+            backend.parser = Parser()
+            labels = cache.wrap('get_client_labels', lambda client=None: calls.append(client) or ['a'])
+            labels(client='toto')
+            self.assertEqual(len(calls), 7)
+            os.utime(conf, (0, 0))
+            labels(client='toto')
+            self.assertEqual(len(calls), 8)
+        finally:
+            shutil.rmtree(confdir)
+
+    def test_live_view(self):
+        from burpui.misc.backend.utils import LiveView, client_events, \
+            counter_events
+        idle = {'name': 'toto', 'state': 'idle', 'last': 1}
+        running = {'name': 'toto', 'state': 'running', 'phase': 'scanning', 'last': 'now'}
+        done = {'name': 'toto', 'state': 'idle', 'last': 2}
+        self.assertEqual(client_events({'toto': idle}, {'toto': idle}), [])
+        self.assertEqual(
+            [x['event'] for x in client_events({'toto': idle}, {'toto': running})],
+            ['started']
+        )
+        self.assertEqual(
+            [x['event'] for x in client_events({'toto': running}, {'toto': dict(running, phase='backup')})],
+            ['phase']
+        )
+        self.assertEqual(
+            [x['event'] for x in client_events({'toto': running}, {'toto': done})],
+            ['finished']
+        )
+        self.assertEqual(
+            [x['event'] for x in client_events({'toto': running}, {'toto': dict(idle, state='server crashed')})],
+            ['crashed']
+        )
+        self.assertEqual(
+            [x['event'] for x in client_events({'toto': idle}, {'tata': idle})],
+            ['added', 'removed']
+        )
+        self.assertEqual(
+            counter_events({'toto': {'percent': 10, 'total': 5}}, {'toto': {'percent': 20, 'total': 5}}),
+            [{'event': 'counters', 'client': {'name': 'toto'}, 'counters': {'percent': 20}}]
+        )
+
+        view = LiveView()
+        view.apply({'events': [{'event': 'started', 'client': running}]})
+        self.assertFalse(view.fresh())
+        view.reset(5)
+        view.apply({'clients': [idle], 'events': []})
+        self.assertTrue(view.fresh())
+        self.assertEqual(view.is_one_backup_running(), [])
+        view.apply({'events': [
+            {'event': 'started', 'client': running},
+            {'event': 'counters', 'client': {'name': 'toto'}, 'counters': {'percent': 10, 'total': 5}},
+        ]})
+        view.apply({'events': [
+            {'event': 'counters', 'client': {'name': 'toto'}, 'counters': {'percent': 20}},
+        ]})
+        self.assertTrue(view.is_backup_running('toto'))
+        self.assertEqual(view.get_counters('toto'), {'percent': 20, 'total': 5})
+        self.assertEqual(view.get_all_clients()[0]['percent'], 20)
+        view.apply({'events': [{'event': 'finished', 'client': done}]})
+        self.assertEqual(view.is_one_backup_running(), [])
+        self.assertEqual(view.get_counters('toto'), {})
+
+        # the snapshot can arrive before the answer to the subscription
+        view = LiveView()
+        view.apply({'clients': [idle], 'events': []})
+        view.set_interval(5)
+        self.assertTrue(view.fresh())
+        self.assertEqual(view.get_all_clients()[0]['name'], 'toto')
+
+    def test_fanout(self):
+        import time
+        import threading
+        from burpui.misc.backend.multi import Burp
+
+        class Agent(object):
+            def __init__(self, deadline):
+                self.deadline = deadline
+
+        release = threading.Event()
+
+        def work(name, agent):
+            if name == 'dead':
+                release.wait(5)
+            elif name == 'broken':
+                raise IOError('Connection refused')
+            return name.upper()
+
+        backend = object.__new__(Burp)
+        backend.servers = {
+            'fast': Agent(1),
+            'dead': Agent(0.2),
+            'broken': Agent(1),
+        }
+        start = time.time()
+        try:
+            res = backend.fanout(work, ['fast', 'dead', 'broken', 'unknown'])
+        finally:
+            release.set()
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(res['fast'], {'result': 'FAST', 'error': None})
+        self.assertIsNone(res['dead']['result'])
+        self.assertIn('did not answer', res['dead']['error'])
+        self.assertEqual(res['broken'], {'result': None, 'error': 'Connection refused'})
+        self.assertIn('not found', res['unknown']['error'])
+
+
 #class BurpuiAPILoginTestCase(TestCase):
 #
 #    def setUp(self):